@@ -1,7 +1,41 @@
 import os
+import re
 import shutil
+from datetime import datetime
+from collections import Counter
+import numpy as np
+import pandas as pd
+from loguru import logger
 from config import cfg
-from file import load_pdf_info, load_pdf_pure_text, load_pdf_tables, load_total_tables
+from file import load_pdf_info, get_pdf_text_path, load_pdf_tables, load_total_tables
+from file import load_failures, get_unit, load_json_manifest, save_json_manifest, get_image_only_keys
+
+# statements the accounting identities are checked on
+VALIDATED_TABLES = ['cbs_info']
+# name, total row, rows adding up to it
+IDENTITIES = [
+    ('assets', '资产总计', ['流动资产合计', '非流动资产合计']),
+    ('liabilities', '负债合计', ['流动负债合计', '非流动负债合计']),
+    ('balance', '负债和所有者权益总计', ['资产总计']),
+    ('equity', '负债和所有者权益总计', ['负债合计', '所有者权益合计']),
+]
+# relative difference tolerated between a total and its parts
+IDENTITY_TOLERANCE = 0.01
+# plausible 资产总计 of a listed company in yuan, outside it the unit is suspect
+TOTAL_ASSETS_RANGE = (1e6, 1e14)
+ROW_ALIASES = {
+    '资产合计': '资产总计',
+    '负债总计': '负债合计',
+    '股东权益合计': '所有者权益合计',
+    '负债和股东权益总计': '负债和所有者权益总计',
+    '负债及所有者权益总计': '负债和所有者权益总计',
+    '负债及股东权益总计': '负债和所有者权益总计',
+    '负债和所有者权益合计': '负债和所有者权益总计',
+    '负债和股东权益合计': '负债和所有者权益总计',
+}
+# the row name cleanup of file.fs_info_to_tuple
+ROW_NAME_PATTERNS = ['[\d \n\.．]', '（[一二三四五六七八九十]）', '\([一二三四五六七八九十]\)',
+    '[一二三四五六七八九十][、.]', '其中：', '[加减]：', '（.*）', '\(.*\)']
     
 
 def init_check_dir():
@@ -11,30 +45,171 @@ def init_check_dir():
     os.mkdir(check_dir)
 
 
+def _copy_error_pdf(pdf_path, name):
+    dst_path = os.path.join(cfg.DATA_PATH, cfg.ERROR_PDF_DIR, name)
+    if not os.path.exists(dst_path):
+        shutil.copy(pdf_path, dst_path)
+
+
 def check_text(copy_error_pdf=True):
+    '''
+        reports in the 'text' failure manifest or with an empty pure_content.txt,
+        returns {key: failure}; image only reports are reported as such, they wait for OCR
+    '''
     pdf_info = load_pdf_info()
-    
-    check_dir = os.path.join(cfg.DATA_PATH, cfg.ERROR_PDF_DIR)
+    failures = load_failures('text')
+    image_only_keys = get_image_only_keys()
 
     for k, v in pdf_info.items():
-        text_lines = load_pdf_pure_text(k)
-        if len(text_lines) == 0 and copy_error_pdf:
-            dst_path = os.path.join(check_dir, 'TextError_{}.pdf'.format(k))
-            if not os.path.exists(dst_path):
-                shutil.copy(v['pdf_path'], dst_path)
+        if k in image_only_keys:
+            failures[k] = {'reason': 'image_only'}
+            if copy_error_pdf:
+                _copy_error_pdf(v['pdf_path'], 'ImageOnly_{}.pdf'.format(k))
+            continue
+        text_path = get_pdf_text_path(k)
+        if k not in failures and (not os.path.exists(text_path) or os.path.getsize(text_path) == 0):
+            failures[k] = {'reason': 'empty output'}
+        if k in failures and copy_error_pdf:
+            _copy_error_pdf(v['pdf_path'], 'TextError_{}.pdf'.format(k))
+    logger.info('{} of {} reports without text, {}'.format(
+        len(failures), len(pdf_info), dict(Counter(f['reason'].split(':')[0] for f in failures.values()))))
+    return failures
 
 
 def check_tables(copy_error_pdf=True):
+    '''
+        reports in the 'tables' failure manifest, and for the others the sections
+        extracted empty; returns ({key: failure}, {key: [empty section names]}).
+        Image only reports were never extracted and are left to check_text
+    '''
     pdf_info = load_pdf_info()
+    failures = load_failures('tables')
     all_tables = load_total_tables()
+    image_only_keys = get_image_only_keys()
 
-    check_dir = os.path.join(cfg.DATA_PATH, cfg.ERROR_PDF_DIR)
-    
+    empty_sections = {}
     for k, v in pdf_info.items():
+        if k in image_only_keys:
+            continue
+        if k in failures:
+            if copy_error_pdf:
+                _copy_error_pdf(v['pdf_path'], 'TableError_{}.pdf'.format(k))
+            continue
         tables = load_pdf_tables(k, all_tables)
         for name, table in tables.items():
-            if len(table) == 0 and copy_error_pdf:
-                dst_path = os.path.join(check_dir, 'TableError_{}_{}.pdf'.format(name, k))
-                if not os.path.exists(dst_path):
-                    shutil.copy(v['pdf_path'], dst_path)
-                
+            if len(table) == 0:
+                empty_sections.setdefault(k, []).append(name)
+                if copy_error_pdf:
+                    _copy_error_pdf(v['pdf_path'], 'TableError_{}_{}.pdf'.format(name, k))
+    logger.info('{} of {} reports failed table extraction, {} with empty sections'.format(
+        len(failures), len(pdf_info), len(empty_sections)))
+    return failures, empty_sections
+
+
+def statement_rows(records):
+    '''
+        records: [(key, table name, line)] of table store lines; returns a frame of
+        (key, table_name, row_name, value) with the current year value of every
+        合计/总计 row, the first row of a name wins like in the company table
+    '''
+    df = pd.DataFrame(records, columns=['key', 'table_name', 'line'])
+    # every row of the identities is a total
+    df = df[df['line'].str.contains('合计|总计', regex=True)].reset_index(drop=True)
+    # re_util.sep_numbers as one regex over all lines
+    lines = df['line'].str.replace('(\\.\\d\\d)(?= +[+\\-\\d])', '\\1|', regex=True)
+    cells = lines.str.rstrip('\n').str.split('|')
+
+    # the same few hundred row names repeat in every report, clean each once
+    row_names = cells.str[0]
+    clean_names = {}
+    for name in row_names.unique():
+        clean_name = name
+        for pattern in ROW_NAME_PATTERNS:
+            clean_name = re.sub(pattern, '', clean_name)
+        clean_names[name] = ROW_ALIASES.get(clean_name, clean_name)
+    df['row_name'] = row_names.map(clean_names)
+
+    # like fs_info_to_tuple, a row with 3+ values starts with its note number
+    values = cells.str[1:].explode().str.replace('[ ,]', '', regex=True)
+    values = values[values.str.fullmatch('-?(\d+\.\d+|\d{3,})', na=False)].astype(float)
+    position = values.groupby(level=0).cumcount()
+    num_values = values.groupby(level=0).transform('size')
+    df['value'] = values[((num_values >= 3) & (position == 1)) | ((num_values < 3) & (position == 0))]
+
+    df = df[(df['row_name'] != '') & df['value'].notna()]
+    return df.drop_duplicates(['key', 'table_name', 'row_name'])[['key', 'table_name', 'row_name', 'value']]
+
+
+def check_statements(rows, units=None):
+    '''
+        rows: statement_rows of the balance sheets; units: {key: unit of get_unit}
+        for the unit sanity check. Returns a frame indexed by report key with one
+        column per identity (True, False, or NaN when a row is missing), 'unit'
+        and 'reasons', the list of failed checks
+    '''
+    rows = rows[rows['table_name'] == 'cbs_info']
+    values = rows.pivot(index='key', columns='row_name', values='value')
+    checks = pd.DataFrame(index=values.index)
+    reasons = pd.Series([[] for _ in range(len(values))], index=values.index, dtype=object)
+    for name, total, parts in IDENTITIES:
+        if total not in values.columns or any(p not in values.columns for p in parts):
+            checks[name] = np.nan
+            continue
+        present = values[[total] + parts].notna().all(axis=1)
+        diff = (values[parts].sum(axis=1) - values[total]).abs()
+        ok = diff <= IDENTITY_TOLERANCE * values[total].abs().clip(lower=1)
+        checks[name] = ok.where(present)
+        for key in checks.index[present & ~ok]:
+            reasons[key].append('{}: {} != {}'.format(name, total, '+'.join(parts)))
+
+    checks['unit'] = np.nan
+    if units is not None and '资产总计' in values.columns:
+        unit = pd.Series(units, dtype=float).reindex(values.index)
+        total_assets = values['资产总计'] * unit
+        present = total_assets.notna()
+        ok = total_assets.abs().between(*TOTAL_ASSETS_RANGE)
+        checks['unit'] = ok.where(present)
+        for key in checks.index[present & ~ok]:
+            reasons[key].append('unit: 资产总计 {:.0f} x {:.0f}'.format(values.loc[key, '资产总计'], unit[key]))
+    for key in checks.index:
+        if '资产总计' not in values.columns or pd.isna(values.loc[key, '资产总计']):
+            reasons[key].append('missing: 资产总计')
+    checks['reasons'] = reasons
+    return checks
+
+
+def validate_statements(check_units=True):
+    '''
+        check the accounting identities of every extracted balance sheet at once and
+        queue the reports failing them in cfg.REEXTRACT_QUEUE for re-extraction with
+        another table engine. returns the frame of check_statements
+    '''
+    all_tables = load_total_tables()
+    records = []
+    units = {} if check_units else None
+    for table_name in VALIDATED_TABLES:
+        for key in all_tables.keys(table_name):
+            lines = all_tables.get(key, table_name)
+            if check_units:
+                units[key] = get_unit(key, lines, table_name)
+            records.extend([(key, table_name, line) for line in lines])
+    checks = check_statements(statement_rows(records), units)
+
+    queue = load_json_manifest(cfg.REEXTRACT_QUEUE)
+    failed = checks[checks['reasons'].map(len) > 0]
+    for key in checks.index:
+        if key not in failed.index:
+            queue.pop(key, None)
+    for key, reasons in failed['reasons'].items():
+        queue[key] = {
+            'sections': VALIDATED_TABLES,
+            'reasons': reasons,
+            'tried': queue.get(key, {}).get('tried', []),
+            'queued_at': datetime.now().isoformat(timespec='seconds')
+        }
+    save_json_manifest(cfg.REEXTRACT_QUEUE, queue)
+
+    summary = {name: int((checks[name] == False).sum()) for name, _, _ in IDENTITIES + [('unit', None, None)]}
+    logger.info('Validated {} balance sheets, {} queued for re-extraction, failures {}'.format(
+        len(checks), len(failed), summary))
+    return checks
@@ -7,24 +7,35 @@ import numpy as np
 import pandas as pd
 
 from config import cfg
-from file import load_pdf_info, load_tables_of_years
+from file import load_tables_of_years
 from file import load_total_tables
+from report_registry import get_report_registry
 
 
+def load_report_row_values(registry, all_tables):
+    '''
+        {pdf key: {row name: first value}} of every report, read from the row store
+        which re-parses only the reports whose tables changed
+    '''
+    reports = {}
+    for pdf_key, pdf_item in list(registry.items()):
+        table = load_tables_of_years(pdf_item['company'], [pdf_item['year'].replace('年', '')], all_tables, registry)
+        rows = {}
+        for _, _, row_name, row_value in table:
+            rows.setdefault(row_name, row_value)
+        reports[pdf_key] = rows
+    return reports
+
 
 def count_table_keys():
-    pdf_info = load_pdf_info()
+    registry = get_report_registry()
     all_tables = load_total_tables()
+    reports = load_report_row_values(registry, all_tables)
     
     all_keys = []
 
-    for pdf_key, pdf_item in list(pdf_info.items()):
-        # print(pdf_key)
-        company = pdf_item['company']
-        year = pdf_item['year'].replace('年', '')
-        table = load_tables_of_years(company, [year], all_tables, pdf_info)
-
-        row_names = list(set([t[2] for t in table]))
+    for pdf_key in list(registry.keys()):
+        row_names = list(reports[pdf_key].keys())
 
         all_keys.extend(row_names)
     all_keys = Counter(all_keys)
@@ -33,8 +44,9 @@ def count_table_keys():
 
 
 def build_table(min_ratio=0.1):
-    pdf_info = load_pdf_info()
+    registry = get_report_registry()
     all_tables = load_total_tables()
+    reports = load_report_row_values(registry, all_tables)
 
     with open(os.path.join(cfg.DATA_PATH, 'key_count.json'), 'r', encoding='utf-8') as f:
         key_count = json.load(f)
@@ -48,24 +60,18 @@ def build_table(min_ratio=0.1):
     for col in columns:
         df_dict[col] = []
     
-    for pdf_key, pdf_item in list(pdf_info.items()):
+    for pdf_key, pdf_item in list(registry.items()):
         # if pdf_key != '2020-04-22__BYD...2019 annual report.pdf':
         #     continue
         company = pdf_item['company']
         year = pdf_item['year'].replace('年', '')
-        table = load_tables_of_years(company, [year], all_tables, pdf_info)
+        rows = reports[pdf_key]
         
         df_dict['公司全称'].append(company)
         df_dict['年份'].append(year)
 
         for key in used_keys:
-            value = 'NULLVALUE'
-            for table_name, year, row_name, row_value in table:
-                if year != year:
-                    continue
-                if row_name == key:
-                    value = row_value
-                    break
+            value = rows.get(key, 'NULLVALUE')
             value = value.replace('人', '').replace('元', '').replace(' ', '')
             df_dict[key].append(value)
     pd.DataFrame(df_dict).to_csv(os.path.join(cfg.DATA_PATH, 'CompanyTable.csv'), sep='\t', index=False, encoding='utf-8')
@@ -77,8 +83,7 @@ def load_company_table():
 
     df['key'] = df.apply(lambda t: t['公司全称'] + str(t['年份']), axis=1)
 
-    pdf_info = load_pdf_info()
-    company_keys = [v['company'] + v['year'].replace('年', '').replace(' ', '') for v in pdf_info.values()]
+    company_keys = [company + year for company, year in get_report_registry().by_company_year.keys()]
     df = df[df['key'].isin(company_keys)]
 
     del df['key']
@@ -174,9 +179,8 @@ def check_company_table():
 
     with open(os.path.join(cfg.DATA_PATH, 'B-pdf-name.txt'), 'r', encoding='utf-8') as f:
         pdf_names = [t.strip() for t in f.readlines()]
-    pdf_info = load_pdf_info()
     B_pdf_keys = []
-    for pdf_name, pdf_item in pdf_info.items():
+    for pdf_name, pdf_item in get_report_registry().items():
         if pdf_name not in pdf_names:
             continue
         B_pdf_keys.append(pdf_item['company'] + pdf_item['year'].replace('年', ''))
@@ -9,6 +9,22 @@ DATA_PATH = os.path.join(BASE_DIR, "data")
 # ========== PDF Related ==========
 PDF_TEXT_DIR = 'pdf_docs'
 ERROR_PDF_DIR = 'error_pdfs'
+PURE_CONTENT_MANIFEST = 'pure_content_manifest.json'
+PDF_META_INDEX = 'pdf_meta.json'
+ALLTXT_DIR = 'alltxt'
+ALLTXT_MANIFEST = 'alltxt_manifest.json'
+TABLE_CACHE_DIR = 'table_cache'
+FAILURE_MANIFEST = 'failure_manifest.json'
+# SQLite store of the extracted section lines of every report.
+TABLE_STORE = 'tables.sqlite'
+# SQLite store of the normalized statement rows of every report.
+ROW_STORE = 'rows.sqlite'
+# Page and keyword attempt every section was found with, per company code.
+SECTION_HINTS = 'section_hints.json'
+# Reports whose statements failed validation, waiting for re-extraction.
+REEXTRACT_QUEUE = 'reextract_queue.json'
+# Image only reports skipped by the extractors, for an offline OCR pass.
+OCR_QUEUE = 'ocr_queue.json'
 
 # ========== Model Settings ==========
 CLASSIFY_PTUNING_PRE_SEQ_LEN = 512
@@ -27,3 +43,24 @@ LLM_MODEL_DIR = os.path.join(DATA_PATH, "pretrained_models", "chatglm2-6b")
 # ========== Other ==========
 XPDF_PATH = os.path.join(BASE_DIR, "xpdf", "bin64")
 NUM_PROCESSES = 64
+# Reports longer than this are split into page ranges during text extraction.
+SHARD_PAGES = 100
+# Address space ceiling of every pdfplumber worker in MB, None to disable.
+WORKER_MEMORY_LIMIT_MB = 4096
+# Wall clock limit in seconds of one report in the extraction pools, None to disable.
+REPORT_TIMEOUT = 1800
+# Pages sampled by the text layer probe, and the mean chars per page below which
+# a report is tagged image_only.
+TEXT_PROBE_PAGES = 5
+TEXT_PROBE_MIN_CHARS = 50
+# Table engine of the financial_state sections, 'camelot', 'pdfplumber' or 'text'.
+TABLE_ENGINE = 'camelot'
+# Per section overrides of TABLE_ENGINE, e.g. {'employee_info': 'pdfplumber'}.
+SECTION_TABLE_ENGINES = {}
+# Parse statements from the pdftotext -table layout first, the table engine only
+# runs when the parsed rows fail validation.
+TEXT_TABLE_PARSER = True
+# Table engine of the retry when a report fails or times out in extract_pdf_tables.
+FALLBACK_TABLE_ENGINE = 'pdfplumber'
+# Pages searched on either side of the hinted page before the full scan.
+SECTION_HINT_WINDOW = 10
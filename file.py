@@ -1,12 +1,19 @@
 import os
 import json
 import re
+import hashlib
+import struct
+from datetime import datetime
 import pandas as pd
 from loguru import logger
 from functools import cmp_to_key
 from langchain.embeddings.huggingface import HuggingFaceEmbeddings
 from config import cfg
 import re_util
+from page_store import PageStore, write_page_store
+from table_store import TABLE_NAMES, STATEMENT_NAMES, get_table_store
+from report_registry import get_report_registry
+from row_store import get_row_store
 
 
 def download_data():
@@ -38,34 +45,120 @@ def load_test_questions():
 
 
 def load_pdf_info():
-    with open(os.path.join(cfg.DATA_PATH, 'pdf_info.json'), 'r', encoding='utf-8') as f:
-        pdf_info = json.load(f)
-    part = {}
-    for k, v in list(pdf_info.items()):
-        part[k] = v
-    return part
+    '''
+        {key: report info} of pdf_info.json, a copy of the registry's dict;
+        lookups should use get_report_registry() directly
+    '''
+    return dict(get_report_registry().reports)
 
 
 def get_raw_pdf_path(key):
-    pdf_info = load_pdf_info()
-    return pdf_info[key]['pdf_path']
+    return get_report_registry().get_pdf_path(key)
 
 
+_pdf_meta_cache = {'mtime': None, 'meta': {}}
 
-def load_total_tables():
-    key_and_paths = [
-        ('basic_info', os.path.join(cfg.DATA_PATH, 'basic_info.json')),
-        ('employee_info', os.path.join(cfg.DATA_PATH, 'employee_info.json')),
-        ('cbs_info', os.path.join(cfg.DATA_PATH, 'cbs_info.json')),
-        ('cscf_info', os.path.join(cfg.DATA_PATH, 'cscf_info.json')),
-        ('cis_info', os.path.join(cfg.DATA_PATH, 'cis_info.json')),
-        ('dev_info', os.path.join(cfg.DATA_PATH, 'dev_info.json')),
-    ]
-    tables = {}
-    for key, path in key_and_paths:
+
+def load_pdf_meta():
+    '''
+        page count / text layer / size / hash of every report, cached per process
+        and reloaded when the index file changes; do not modify the result
+    '''
+    path = os.path.join(cfg.DATA_PATH, cfg.PDF_META_INDEX)
+    if not os.path.exists(path):
+        return {}
+    mtime = os.path.getmtime(path)
+    if _pdf_meta_cache['mtime'] != mtime:
         with open(path, 'r', encoding='utf-8') as f:
-            tables[key] = json.load(f)
-    return tables
+            _pdf_meta_cache['meta'] = json.load(f)
+        _pdf_meta_cache['mtime'] = mtime
+    return _pdf_meta_cache['meta']
+
+
+def get_pdf_page_count(key):
+    return load_pdf_meta().get(key, {}).get('page_count')
+
+
+def get_image_only_keys():
+    '''
+        reports the text layer probe tagged image_only, the heavy extractors skip them
+    '''
+    return set([k for k, v in load_pdf_meta().items() if v.get('image_only', False)])
+
+
+def get_pdf_text_path(key):
+    return os.path.join(cfg.DATA_PATH, cfg.PDF_TEXT_DIR, key, 'pure_content.txt')
+
+
+def get_file_md5(path, chunk_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def load_json_manifest(name):
+    path = os.path.join(cfg.DATA_PATH, name)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error('Unable to load manifest {}, {}'.format(path, e))
+        return {}
+
+
+def save_json_manifest(name, manifest):
+    path = os.path.join(cfg.DATA_PATH, name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def load_failures(stage=None):
+    '''
+        {stage: {key: failure}} of the failure manifest, or {key: failure} of one stage
+    '''
+    manifest = load_json_manifest(cfg.FAILURE_MANIFEST)
+    if stage is None:
+        return manifest
+    return manifest.get(stage, {})
+
+
+def update_failures(stage, failures, succeeded_keys=[]):
+    '''
+        failures: {key: {'reason', 'elapsed', ...}} of one run of stage, reports
+        that succeeded this time are dropped from the manifest
+    '''
+    manifest = load_json_manifest(cfg.FAILURE_MANIFEST)
+    stage_failures = manifest.get(stage, {})
+    for key in succeeded_keys:
+        stage_failures.pop(key, None)
+    for key, failure in failures.items():
+        stage_failures[key] = dict(failure, key=key, stage=stage,
+            failed_at=failure.get('failed_at', datetime.now().isoformat(timespec='seconds')))
+    manifest[stage] = stage_failures
+    save_json_manifest(cfg.FAILURE_MANIFEST, manifest)
+    return stage_failures
+
+
+def load_total_tables():
+    '''
+        the table store of all reports, nothing is read until load_pdf_tables asks
+        for a report; <table>_info.json files of older runs are imported once
+    '''
+    store = get_table_store()
+    if store.is_empty():
+        for table_name in TABLE_NAMES:
+            path = os.path.join(cfg.DATA_PATH, '{}.json'.format(table_name))
+            if os.path.exists(path):
+                logger.info('Import {} into {}'.format(path, store.path))
+                store.import_merged_json(table_name, path)
+        save_missing_units(store)
+    return store
 
 
 def get_pdf_table_path(key):
@@ -81,10 +174,14 @@ def get_pdf_table_path(key):
 
 
 def load_pdf_tables(key, all_tables):
+    '''
+        all_tables: the TableStore of load_total_tables
+    '''
+    report_tables = all_tables.get_report(key)
     tables = {}
-    for k, v in all_tables.items():
-        if key in v.keys() and k in v[key]:
-            lines = v[key][k]
+    for k in TABLE_NAMES:
+        if k in report_tables:
+            lines = report_tables[k]
             lines = [re_util.sep_numbers(line) for line in lines]
             tables[k] = lines
         else:
@@ -171,50 +268,60 @@ def dev_info_to_tuple(year, table_lines):
     return tuples
 
 
-def get_unit(pdf_key, table):
-    unit = 1
+def find_table_unit(pdf_key, table):
+    '''
+        (unit, scale, evidence line, page) of a statement, detected in the last
+        10 lines of the page before its first page and its first page
+    '''
     if len(table) == 0:
-        return unit
-    page_num = table[0].strip().split('|')[1]
-    pages = load_pdf_pure_text(pdf_key)
-    for idx, page_item in enumerate(pages):
-        if str(page_item['page']) == page_num:
-            last_page_lines = []
-            if idx > 0:
-                last_page_lines = pages[idx-1]['text'].split('\n')[-10:]
-            current_page_lines = page_item['text'].split('\n')
-            search_string = None
-            for line in last_page_lines + current_page_lines:
-                re_unit = re.findall('单位\s*[:：；].{0,3}元', line) + \
-                    re.findall('人民币.{0,3}元', line)
-                if len(re_unit) != 0:
-                    search_string = re_unit[0]
-                    break
-            if search_string is not None:
-                if '百万' in search_string:
-                    unit = 1000000
-                elif '万' in search_string:
-                    unit = 10000
-                elif '千' in search_string:
-                    unit = 1000
-                else:
-                    pass
-            else:
-                print('cannot find unit for key {} page {}'.format(pdf_key, page_num))
-                print(page_item['text'])
-
-            if unit != 1:
-                print(pdf_key)
-                print(search_string)
-                print(page_item['text'])
-            break
-    if unit != 1:
-        logger.info('{}的单位是{}'.format(pdf_key, unit))
-    return unit
+        return 1, None, None, None
+    try:
+        page_id = int(table[0].strip().split('|')[1])
+    except (IndexError, ValueError):
+        return 1, None, None, None
+    pages = load_pdf_pure_pages(pdf_key, page_id, num_previous=1)
+    if len(pages) == 0 or pages[-1]['page'] != page_id:
+        return 1, None, None, page_id
+    last_page_lines = pages[-2]['text'].split('\n')[-10:] if len(pages) > 1 else []
+    unit, scale, evidence = re_util.detect_unit(last_page_lines + pages[-1]['text'].split('\n'))
+    if evidence is None:
+        logger.warning('Cannot find unit for {} page {}'.format(pdf_key, page_id))
+    return unit, scale, evidence, page_id
+
+
+def get_unit(pdf_key, table, table_name=None):
+    '''
+        multiplier of the values of a statement; with table_name the unit saved
+        with the stored table is used, detected without saving it if missing
+    '''
+    if table_name is not None:
+        saved = get_table_store().get_unit(pdf_key, table_name)
+        if saved is not None:
+            return saved['unit']
+    return find_table_unit(pdf_key, table)[0]
+
+
+def save_missing_units(store, table_names=STATEMENT_NAMES):
+    '''
+        detect and save the unit of every stored statement that has none,
+        returns the number of units saved
+    '''
+    num_saved = 0
+    for table_name in table_names:
+        for key in store.keys_without_unit(table_name):
+            table = store.get(key, table_name)
+            if len(table) == 0:
+                continue
+            store.put_unit(key, table_name, *find_table_unit(key, table))
+            num_saved += 1
+    if num_saved > 0:
+        logger.info('Saved {} missing units in {}'.format(num_saved, store.path))
+    return num_saved
 
 
-def fs_info_to_tuple(pdf_key, table_name, year, table_lines):
-    unit = get_unit(pdf_key, table_lines)
+def fs_info_to_tuple(pdf_key, table_name, year, table_lines, unit=None):
+    if unit is None:
+        unit = get_unit(pdf_key, table_lines, table_name)
     # print('table name and unit ', table_name, unit)
     tuples = []
     page_id = None
@@ -272,7 +379,7 @@ def fs_info_to_tuple(pdf_key, table_name, year, table_lines):
     return tuples
 
 
-def table_to_tuples(pdf_key, year, table_name, table_lines):
+def table_to_tuples(pdf_key, year, table_name, table_lines, unit=None):
     if table_name == 'basic_info':
         return basic_info_to_tuple(year, table_lines)
     elif table_name == 'employee_info':
@@ -280,23 +387,63 @@ def table_to_tuples(pdf_key, year, table_name, table_lines):
     elif table_name == 'dev_info':
         return dev_info_to_tuple(year, table_lines)
     else:
-        return fs_info_to_tuple(pdf_key, table_name, year, table_lines)
-
-
-def load_tables_of_years(company, years, pdf_tables, pdf_info):
+        return fs_info_to_tuple(pdf_key, table_name, year, table_lines, unit)
+
+
+def table_to_rows(pdf_key, year, table_name, table_lines):
+    '''
+        [(table name, row year, row name, text value, unit, page)] of one table;
+        the row parsers are line local, so the table is parsed page by page to
+        know the page of every row
+    '''
+    unit = None
+    if table_name in STATEMENT_NAMES:
+        unit = get_unit(pdf_key, table_lines, table_name)
+    pages = [(None, [])]
+    for line in table_lines:
+        if line.startswith('page|'):
+            pages.append((int(line.strip().split('|')[1]), []))
+        pages[-1][1].append(line)
+    rows = []
+    for page, lines in pages:
+        for _, row_year, row_name, row_value in table_to_tuples(pdf_key, year, table_name, lines, unit):
+            rows.append((table_name, row_year, row_name, row_value, unit, page))
+    return rows
+
+
+def report_to_rows(pdf_key, year, pdf_tables):
+    rows = []
+    for table_name, table_lines in load_pdf_tables(pdf_key, pdf_tables).items():
+        rows.extend(table_to_rows(pdf_key, year, table_name, table_lines))
+    return rows
+
+
+def load_report_rows(pdf_key, year, pdf_tables):
+    '''
+        [(table name, row year, row name, row value)] of one report from the row
+        store; a report that was never built, or whose tables changed in the table
+        store since, is parsed and stored again now
+    '''
+    row_store = get_row_store()
+    signature = pdf_tables.get_report_signature(pdf_key)
+    rows = row_store.get_report_rows(pdf_key, signature)
+    if rows is None:
+        rows = report_to_rows(pdf_key, year, pdf_tables)
+        row_store.put_report(pdf_key, get_report_registry().get(pdf_key)['company'], year, rows, signature)
+        rows = [row[:4] for row in rows]
+    return rows
+
+
+def load_tables_of_years(company, years, pdf_tables, registry=None):
+    registry = registry or get_report_registry()
     table = []
     for year in years:
         year = year.replace('年', '')
-        pdf_key = None
-        for k, v in pdf_info.items():
-            if v['company'] == company and year in v['year']:
-                pdf_key = k
+        pdf_key = registry.find(company, year)
         if pdf_key is None:
             logger.error('Cannot find pdf key for {} {}'.format(company, year))
             continue
-        year_tables = load_pdf_tables(pdf_key, pdf_tables)
-        for table_name, table_lines in year_tables.items():
-            table.extend(table_to_tuples(pdf_key, year, table_name, table_lines))
+        table.extend(load_report_rows(pdf_key, year, pdf_tables))
 
     alias = {
         '在职员工的数量合计': '职工总人数',
@@ -425,7 +572,7 @@ def page_to_text(page: list):
 
 def load_pdf_pure_text(key):
     text_lines = []
-    text_path = os.path.join(cfg.DATA_PATH, 'pdf_docs', key, 'pure_content.txt')
+    text_path = get_pdf_text_path(key)
     if not os.path.exists(text_path):
         logger.warning('{} not exists'.format(text_path))
         return text_lines
@@ -441,15 +588,127 @@ def load_pdf_pure_text(key):
     return text_lines
 
 
-def load_pdf_pure_text_alltxt(key):
-    text_lines = []
-    text_path = os.path.join(cfg.DATA_PATH, 'alltxt', '{}.txt'.format(os.path.splitext(key)[0]))
-    # print(text_path)
+def get_pdf_page_store_path(key):
+    return os.path.join(cfg.DATA_PATH, cfg.PDF_TEXT_DIR, key, 'pure_content.pages')
+
+
+def build_pdf_page_store(key):
+    pages = load_pdf_pure_text(key)
+    if len(pages) == 0:
+        return False
+    write_page_store(get_pdf_page_store_path(key), [(p['page'], p['text'].split('\n')) for p in pages])
+    return True
+
+
+def open_page_store(store_path, source_path):
+    '''
+        None if the store is missing or older than the file it was built from
+    '''
+    if not os.path.exists(store_path):
+        return None
+    if os.path.exists(source_path) and os.path.getmtime(source_path) > os.path.getmtime(store_path):
+        return None
+    try:
+        return PageStore(store_path)
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning('Unable to open {}, {}'.format(store_path, e))
+        return None
+
+
+def open_pdf_page_store(key):
+    return open_page_store(get_pdf_page_store_path(key), get_pdf_text_path(key))
+
+
+def load_pdf_pure_pages(key, page_id, num_previous=0):
+    '''
+        page page_id of pure_content and the num_previous pages before it,
+        read from the page store without loading the whole report if possible
+    '''
+    store = open_pdf_page_store(key)
+    if store is not None:
+        with store:
+            idx = store.page_index(page_id)
+            if idx is None:
+                return []
+            return [store.get_page_at(i) for i in range(max(0, idx-num_previous), idx+1)]
+
+    pages = load_pdf_pure_text(key)
+    for idx, page in enumerate(pages):
+        if page['page'] == page_id:
+            return pages[max(0, idx-num_previous):idx+1]
+    return []
+
+
+def get_alltxt_path(key):
+    return os.path.join(cfg.DATA_PATH, cfg.ALLTXT_DIR, '{}.txt'.format(os.path.splitext(key)[0]))
+
+
+def get_alltxt_page_store_path(key):
+    return os.path.join(cfg.DATA_PATH, cfg.ALLTXT_DIR, '{}.pages'.format(os.path.splitext(key)[0]))
+
+
+def build_alltxt_page_store(key):
+    text_path = get_alltxt_path(key)
+    if not os.path.exists(text_path):
+        return False
+    pages = []
+    with open(text_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if len(line) == 0:
+                continue
+            page_id = json.loads(line).get('page', 0)
+            if len(pages) == 0 or pages[-1][0] != page_id:
+                pages.append((page_id, []))
+            pages[-1][1].append(line)
+    write_page_store(get_alltxt_page_store_path(key), pages)
+    return True
+
+
+def load_alltxt_page_records(key, page_id):
+    '''
+        raw alltxt records of one page, falls back to scanning the jsonl file
+    '''
+    store = open_page_store(get_alltxt_page_store_path(key), get_alltxt_path(key))
+    if store is not None:
+        with store:
+            return [json.loads(line) for line in store.get_page_lines(page_id)]
+
+    records = []
+    text_path = get_alltxt_path(key)
+    if not os.path.exists(text_path):
+        return records
+    with open(text_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            record = json.loads(line)
+            if record.get('page') == page_id:
+                records.append(record)
+    return records
+
+
+def load_alltxt_lines(key):
+    '''
+        raw jsonl lines of alltxt, from the page store when it is up to date
+    '''
+    store = open_page_store(get_alltxt_page_store_path(key), get_alltxt_path(key))
+    if store is not None:
+        with store:
+            return store.get_lines(0, store.num_lines)
+    text_path = get_alltxt_path(key)
     if not os.path.exists(text_path):
         logger.warning('{} not exists'.format(text_path))
-        return text_lines
+        return None
     with open(text_path, 'r', encoding='utf-8', errors='ignore') as f:
-        lines = f.readlines()
+        return [line for line in f if len(line.strip()) > 0]
+
+
+def load_pdf_pure_text_alltxt(key):
+    text_lines = []
+    text_path = get_alltxt_path(key)
+    lines = load_alltxt_lines(key)
+    if lines is not None:
         raw_lines = [json.loads(line) for line in lines]
         for line in raw_lines:
             if 'type' not in line or 'inside' not in line:
@@ -1,10 +1,11 @@
 import os
-import json
 import copy
 # import parse
 import re
+import time
 import shutil
 import numpy as np
+from bisect import bisect_left, bisect_right
 from functools import cmp_to_key
 from multiprocessing import Pool
 from collections import Counter
@@ -14,13 +15,146 @@ from datetime import datetime
 from config import cfg
 from re_util import clean_row_name
 from pdf_util import PdfExtractor
+from keyword_util import KeywordLineIndex
+from table_store import STATEMENT_NAMES, get_table_store, text_to_lines
+from text_table import parse_text_tables, validate_text_tables
 from file import get_raw_pdf_path, get_pdf_table_path
 from file import load_pdf_info, load_test_questions
-from file import load_pdf_pure_text
+from file import load_pdf_pure_text, get_pdf_page_count
+from file import load_json_manifest, find_table_unit, save_missing_units
 
 DEBUG = False
 
 
+class ReportText(object):
+    '''
+        non empty lines of pure_content.txt without spaces, loaded once and
+        shared by every section located in the report
+    '''
+
+    def __init__(self, pdf_name) -> None:
+        self.pdf_name = pdf_name
+        pure_text = load_pdf_pure_text(pdf_name)
+        # print(get_raw_pdf_path(pdf_name))
+        self.pages = {}
+        self.text_lines = []
+        for page in pure_text:
+            self.pages[page['page']] = page['text']
+            page_lines = page['text'].split('\n')
+            self.text_lines.extend([{'page': page['page'], 'text': t.replace(' ', '')} \
+                for t in page_lines if len(t.replace(' ', '')) > 0])
+
+        self.max_page_id = get_pdf_page_count(pdf_name)
+        if self.max_page_id is None and len(pure_text) > 0:
+            self.max_page_id = np.max([t['page'] for t in pure_text])
+        self.line_pages = [t['page'] for t in self.text_lines]
+        self.keyword_index = KeywordLineIndex([t['text'] for t in self.text_lines])
+
+    def find_match_page(self, max_continuous_lines=100,
+            min_match_number = 0,
+            required_line_keywords=[],
+            invalid_line_keywords=[],
+            required_post_keywords=[],
+            invalid_pre_keywords=[],
+            invalid_post_keywords=[],
+            page_window=None):
+        '''
+            page_window: (first page, last page), only lines on these pages can match
+        '''
+        text_lines = self.text_lines
+        index = self.keyword_index
+        index.add_keywords(required_line_keywords + invalid_line_keywords + required_post_keywords + \
+            invalid_pre_keywords + invalid_post_keywords)
+
+        # Only lines containing a positive row-level keyword can match.
+        if '' in required_line_keywords:
+            candidates = range(len(text_lines))
+        else:
+            candidates = sorted(set([i for keyword in required_line_keywords \
+                for i in index.occurrences(keyword)]))
+        if page_window is not None:
+            first_line = bisect_left(self.line_pages, page_window[0])
+            last_line = bisect_right(self.line_pages, page_window[1])
+            candidates = [i for i in candidates if first_line <= i < last_line]
+
+        matched_line_index = None
+        for i in candidates:
+            find = True
+            if DEBUG:
+                for keyword in required_line_keywords:
+                    if index.contains(keyword, i, i+1):
+                        print(keyword, text_lines[i]['page'])
+                        break
+            # Negative row-level keywords that indicate false matches.
+            for keyword in invalid_line_keywords:
+                if index.contains(keyword, i, i+1):
+                    if DEBUG:
+                        print('Filter as invalid line keyword {}'.format(keyword))
+                    find = False
+
+            # Return immediately if no candidate is found.
+            if not find:
+                continue
+
+            start = max(0, i-max_continuous_lines)
+            end = min(len(text_lines), i+max_continuous_lines)
+            
+            # Check whether the following text contains enough positive keywords.
+            num_match = 0
+            for keyword in required_post_keywords:
+                if index.contains(keyword, i, end):
+                    num_match += 1
+            if num_match < min_match_number:
+                if DEBUG:
+                    print('Filter as not enough post keywords {}<{}'.format(num_match, min_match_number))
+                    if text_lines[i]['page'] == 154:
+                        print('\n'.join([t['text'] for t in text_lines[i:end]]))
+                find = False
+
+            # Check whether preceding text contains negative keywords.
+            for invalid_keyword in invalid_pre_keywords:
+                if index.contains(invalid_keyword, start, i):
+                    print('Filter as invalid pre keyword {}'.format(invalid_keyword))
+                    find = False
+            # Check whether following text contains negative keywords.
+            for invalid_keyword in invalid_post_keywords:
+                if index.contains(invalid_keyword, i, end):
+                    if DEBUG:
+                        print('Filter as invalid post keyword {}'.format(invalid_keyword))
+                    find = False
+
+            if find:
+                matched_line_index = i
+                break
+
+        if matched_line_index is None:
+            return None
+        return text_lines[matched_line_index]['page']
+
+    def get_pages(self, page_ids):
+        return [(page_id, self.pages[page_id]) for page_id in page_ids if page_id in self.pages]
+
+    def locate_section(self, prefix_pages=1, post_pages=1, **kwargs):
+        '''
+            (matched page, pages to parse around it), None if the section is not found
+        '''
+        match_page_id = self.find_match_page(**kwargs)
+        if match_page_id is None:
+            return None
+        page_start = max(0, match_page_id-prefix_pages)
+        page_end = min(match_page_id + post_pages + 1, self.max_page_id+1)
+        return match_page_id, list(range(page_start, page_end))
+
+    def get_section_pages(self, prefix_pages=1, post_pages=1, **kwargs):
+        '''
+            pages to parse around the matched page, None if the section is not found
+        '''
+        located = self.locate_section(prefix_pages, post_pages, **kwargs)
+        if located is None:
+            return None
+        return located[1]
+
+
 def find_match_page(pdf_name, max_continuous_lines=100,
         min_match_number = 0,
         required_line_keywords=[],
@@ -28,79 +162,28 @@ def find_match_page(pdf_name, max_continuous_lines=100,
         required_post_keywords=[],
         invalid_pre_keywords=[],
         invalid_post_keywords=[]):
-    pure_text = load_pdf_pure_text(pdf_name)
-    # print(get_raw_pdf_path(pdf_name))
-    text_lines = []
-    for page in pure_text:
-        page_lines = page['text'].split('\n')
-        text_lines.extend([{'page': page['page'], 'text': t.replace(' ', '')} \
-            for t in page_lines if len(t.replace(' ', '')) > 0])
-    matched_line_index = None
-    
-    for i in range(len(text_lines)):
-        # print(text_lines[i]['text'])
-        find = False
-
-        # Positive row-level keywords to match target tables.
-        for keyword in required_line_keywords:
-            if keyword in text_lines[i]['text']:
-                if DEBUG:
-                    print(keyword, text_lines[i]['page'])
-                find = True
-                break
-        # Negative row-level keywords that indicate false matches.
-        for keyword in invalid_line_keywords:
-            if keyword in text_lines[i]['text']:
-                if DEBUG:
-                    print('Filter as invalid line keyword {}'.format(keyword))
-                find = False
-
-        # Return immediately if no candidate is found.
-        if not find:
-            continue
+    doc = ReportText(pdf_name)
+    match_page_id = doc.find_match_page(max_continuous_lines,
+        min_match_number, required_line_keywords, invalid_line_keywords,
+        required_post_keywords, invalid_pre_keywords, invalid_post_keywords)
+    return match_page_id, doc.max_page_id
 
-        start = max(0, i-max_continuous_lines)
-        pre_text = '\n'.join([t['text'] for t in text_lines[start:i]])
-        end = min(len(text_lines), i+max_continuous_lines)
-        post_text = '\n'.join([t['text'] for t in text_lines[i:end]])
-        
-        # Check whether the following text contains enough positive keywords.
-        num_match = 0
-        for keyword in required_post_keywords:
-            if keyword in post_text:
-                num_match += 1
-        if num_match < min_match_number:
-            if DEBUG:
-                print('Filter as not enough post keywords {}<{}'.format(num_match, min_match_number))
-                if text_lines[i]['page'] == 154:
-                    print(post_text)
-            find = False
-
-        # Check whether preceding text contains negative keywords.
-        for invalid_keyword in invalid_pre_keywords:
-            if invalid_keyword in pre_text:
-                print('Filter as invalid pre keyword {}'.format(invalid_keyword))
-                find = False
-        # Check whether following text contains negative keywords.
-        for invalid_keyword in invalid_post_keywords:
-            if invalid_keyword in post_text:
-                if DEBUG:
-                    print('Filter as invalid post keyword {}'.format(invalid_keyword))
-                find = False
 
-        if find:
-            matched_line_index = i
-            break
-    
-    if len(pure_text) > 0:
-        max_page_id = np.max([t['page'] for t in pure_text])
-    else:
-        max_page_id = None
-
-    if matched_line_index is None:
-        return None, max_page_id
-    else:
-        return text_lines[matched_line_index]['page'], max_page_id
+def select_tables(tables, required_post_keywords):
+    selected_tables = []
+    for table in tables:
+        table_text = table.df.to_string().replace(' ', '')
+        # print(table.page, '*'*20)
+        # print(table_text)
+        has_match = False
+        for name in required_post_keywords:
+            if name in table_text:
+                # print(name)
+                has_match = True
+                break
+        if has_match:
+            selected_tables.append(table)
+    return selected_tables
 
 
 def extract_table_for_rows(pdf_name, max_continuous_lines=100,
@@ -112,38 +195,53 @@ def extract_table_for_rows(pdf_name, max_continuous_lines=100,
         invalid_post_keywords=[],
         prefix_pages=1, post_pages=1):
     
-    match_page_id, max_page_id = find_match_page(pdf_name, max_continuous_lines,
-        min_match_number, required_line_keywords, invalid_line_keywords,
-        required_post_keywords, invalid_pre_keywords, invalid_post_keywords)
-    print(match_page_id)
-    tables = []
-    if match_page_id is None:
-        return tables
+    doc = ReportText(pdf_name)
+    page_ids = doc.get_section_pages(prefix_pages, post_pages,
+        max_continuous_lines=max_continuous_lines,
+        min_match_number=min_match_number,
+        required_line_keywords=required_line_keywords,
+        invalid_line_keywords=invalid_line_keywords,
+        required_post_keywords=required_post_keywords,
+        invalid_pre_keywords=invalid_pre_keywords,
+        invalid_post_keywords=invalid_post_keywords)
+    logger.debug('Section pages of {}: {}'.format(pdf_name, page_ids))
+    if page_ids is None:
+        return []
 
     pdf_path = get_raw_pdf_path(pdf_name)
     extractor = PdfExtractor(pdf_path)
-    
-    page_start = max(0, match_page_id-prefix_pages)
-    page_end = min(match_page_id + post_pages + 1, max_page_id+1)
     try:
-        near_tables = extractor.extract_table_of_pages(range(page_start, page_end))
+        near_tables = extractor.extract_table_of_pages(page_ids)
     except Exception as e:
         print(e, pdf_name, 'parse error')
         near_tables = []
-    for table in near_tables:
-        table_text = table.df.to_string().replace(' ', '')
-        # print(table.page, '*'*20)
-        # print(table_text)
-        has_match = False
-        for name in required_post_keywords:
-            if name in table_text:
-                # print(name)
-                has_match = True
-                break
-        if has_match:
-            tables.append(table)
+    return select_tables(near_tables, required_post_keywords)
 
-    return tables
+
+def extract_tables_of_sections(extractor, section_pages, pdf_name='', engine='camelot'):
+    '''
+        section_pages: {section name: page ids}
+        the engine reads the union of the pages once, for camelot lattice or stream
+        is decided per page so a section gets the same tables as parsing its pages alone
+    '''
+    if len(section_pages) == 0:
+        return {}
+    try:
+        all_pages = sorted(set([p for page_ids in section_pages.values() for p in page_ids]))
+        tables = extractor.extract_tables(all_pages, engine)
+        return {name: [t for t in tables if t.page in page_ids] for name, page_ids in section_pages.items()}
+    except Exception as e:
+        # a page camelot fails on must only affect the sections containing it
+        logger.warning('Parse sections together failed for {}, {}'.format(pdf_name, e))
+
+    section_tables = {}
+    for name, page_ids in section_pages.items():
+        try:
+            section_tables[name] = extractor.extract_tables(page_ids, engine)
+        except Exception as e:
+            print(e, pdf_name, 'parse error')
+            section_tables[name] = []
+    return section_tables
 
 
 def filter_tables(tables, invalid_keywords):
@@ -163,7 +261,7 @@ def filter_tables(tables, invalid_keywords):
     return filtered_tables
 
 
-def tables_to_file(tables, file_path):
+def tables_to_text(tables):
     text = ''
     for table in tables:
         # print(table.df)
@@ -174,8 +272,14 @@ def tables_to_file(tables, file_path):
             # row = [t for t in row if t != '']
             text += '|'.join(row) + '\n'
     # print(text)
+    return text
+
+
+def tables_to_file(tables, file_path):
+    text = tables_to_text(tables)
     with open(file_path, 'w', encoding='utf-8') as f:
         f.write(text)
+    return text
 
 
 # Company website extracted count: 8640
@@ -183,66 +287,34 @@ def tables_to_file(tables, file_path):
 # 2020-03-30__HuAn Securities...2019 annual report.pdf: too many cross-page splits.
 # China Merchants Shekou...: not a table section.
 # CIMC...: not a table section.
-def extract_basic_info(key):
-    logger.info('Extract basic info for {}'.format(key))
+BASIC_INFO_ROWS = ['股票简称', '股票代码', '中文简称', '外文名称', '法定代表人',
+    '注册地址', '邮政编码', '办公地址', '电子信箱']
 
-    bi_path = get_pdf_table_path(key)['basic_info']
-    # if os.path.exists(bi_path):
-    #     return
-
-    row_keywords = ['股票简称', '股票代码', '中文简称', '外文名称', '法定代表人',
-        '注册地址', '邮政编码', '办公地址', '电子信箱']
-    bi_tables = extract_table_for_rows(key, int(len(row_keywords)*1.5),
-        min_match_number=0.3*len(row_keywords),
-        required_line_keywords=['公司简介', '基本情况', '公司信息', '中文简称', '电子信箱'],
-        invalid_line_keywords=[],
-        required_post_keywords=row_keywords,
-        invalid_pre_keywords=[],
-        invalid_post_keywords=[],
-        prefix_pages=1, post_pages=1)
 
+def postprocess_basic_info(tables):
     invalid_keywords = ['会计师事务所', '董事会秘书', '证券事务代表', '保荐机构',
         '公司股票简况', '持续督导', '变更前股票']
-    filtered_tables = filter_tables(bi_tables, invalid_keywords)
-    
-    if DEBUG:
-        for table in filtered_tables:
-            print(table.page, '*'*30)
-            print(table.df)
-    
-    tables_to_file(filtered_tables, bi_path)
+    return filter_tables(tables, invalid_keywords)
 
 
-def extract_employee_info(key):
-    logger.info('Extract employee info for {}'.format(key))
+def extract_basic_info(key):
+    extract_sections(key, ['basic_info'])
 
-    ei_path = get_pdf_table_path(key)['employee_info']
 
-    row_keywords = ['在职员工', '职工人数', '专业构成', '离退休职',
-        '生产人员', '销售人员', '技术人员',
-        '行政人员', '管理人员', '业务人员',
-        '教育程度', '硕士', '本科', '大专', '研究生',
-        '专科']
-    
-    ei_tables = extract_table_for_rows(key, int(1.5*len(row_keywords)),
-        min_match_number=0.3*len(row_keywords),
-        required_line_keywords=['员工情况', '员工的数量', '员工数量', '专业构成',
-            '离退休职工人数', '员工教育结构'],
-        invalid_line_keywords=[],
-        required_post_keywords=row_keywords,
-        invalid_pre_keywords=[],
-        invalid_post_keywords=[],
-        prefix_pages=1, post_pages=1)
+EMPLOYEE_INFO_ROWS = ['在职员工', '职工人数', '专业构成', '离退休职',
+    '生产人员', '销售人员', '技术人员',
+    '行政人员', '管理人员', '业务人员',
+    '教育程度', '硕士', '本科', '大专', '研究生',
+    '专科']
+
 
+def postprocess_employee_info(tables):
     invalid_keywords = ['其他单位', '董事', '经理', '审议']
-    filtered_tables = filter_tables(ei_tables, invalid_keywords)
+    return filter_tables(tables, invalid_keywords)
 
-    if DEBUG:
-        for table in filtered_tables:
-            print(table.page, '*'*30)
-            print(table.df)
-    
-    tables_to_file(filtered_tables, ei_path)
+
+def extract_employee_info(key):
+    extract_sections(key, ['employee_info'])
 
 
 def sort_table_groups(table_groups):
@@ -360,203 +432,439 @@ def remove_tables_over_pages(tables):
 # 2021-04-27__Zhejiang Lante Optics...2020 annual report.pdf: parse failed (3 balance sheet candidates).
 # 2021-03-30__CRHI...2020 annual report.pdf is image-based.
 # 2020-03-26__Livzon Pharma...2019 annual report.pdf: table not recognized in lattice mode; stream mode works.
-def extract_cbs_info(key):
-    logger.info('Extract cbs info for {}'.format(key))
-
-    cbs_path = get_pdf_table_path(key)['cbs_info']
-    
-    row_names = [
-        '流动资产', '货币资金', '结算备付金', '拆出资金', '交易性金融资产',
-        '应收保费', '应收分保账款', '应收分保合同准备金', '其他应收款',
-        '存货', '合同资产', '持有待售资产', '返售金融资产',
-        '非流动资产', '债权投资', '其他债权投资', '长期应收款',
-        '固定资产', '油气资产', '商誉', '无形资产', 
-        '递延所得税资产', '其他非流动资产', '资产合计', '资产总计',
-        '应付账款', '预收款项', '合同负债', '应付职工薪酬',
-        '持有待售负债', '一年内到期的非流动负债', '其他流动负债', '流动负债合计',
-        '长期应付职工薪酬', '预计负债', '递延收益', '递延所得税负债',
-        '其他权益工具', '优先股', '资本公积', '负债合计', '股本',
-        '未分配利润', '股东权益合计',
-        '所有者权益', '少数股东权益'
-        ]
-    
-    cbs_tables = extract_table_for_rows(key, int(1.5*len(row_names)),
-        min_match_number=0.3*len(row_names),
-        required_line_keywords=['资产负债表'],
-        invalid_line_keywords=['母公司资产负债表'],
-        required_post_keywords=row_names,
-        invalid_pre_keywords=[],
-        invalid_post_keywords=['调整', '变动比例', '变更'],
-        prefix_pages=0, post_pages=5)
-    
-    if len(cbs_tables) == 0:
-        # 2021-03-25__Jiangsu Financial Leasing...__600901__Jiangsu Jinzu__2020__AnnualReport.pdf
-        cbs_tables = extract_table_for_rows(key, int(1.5*len(row_names)),
-            min_match_number=0.2*len(row_names),
-            required_line_keywords=['合并及母公司资产负债表'],
-            invalid_line_keywords=[],
-            required_post_keywords=row_names,
-            invalid_pre_keywords=[],
-            invalid_post_keywords=['调整', '变更'],
-            prefix_pages=0, post_pages=5)
-        
-    if len(cbs_tables) == 0:
-        # 2021-03-27__China Everbright Bank...__601818__Everbright Bank__2020__AnnualReport.pdf
-        cbs_tables = extract_table_for_rows(key, int(2*len(row_names)),
-            min_match_number=0.2*len(row_names),
-            required_line_keywords=['合并资产负债表和资产负债表'],
-            invalid_line_keywords=[],
-            required_post_keywords=row_names,
-            invalid_pre_keywords=[],
-            invalid_post_keywords=['调整', '变更'],
-            prefix_pages=0, post_pages=5)
-
+CBS_INFO_ROWS = [
+    '流动资产', '货币资金', '结算备付金', '拆出资金', '交易性金融资产',
+    '应收保费', '应收分保账款', '应收分保合同准备金', '其他应收款',
+    '存货', '合同资产', '持有待售资产', '返售金融资产',
+    '非流动资产', '债权投资', '其他债权投资', '长期应收款',
+    '固定资产', '油气资产', '商誉', '无形资产', 
+    '递延所得税资产', '其他非流动资产', '资产合计', '资产总计',
+    '应付账款', '预收款项', '合同负债', '应付职工薪酬',
+    '持有待售负债', '一年内到期的非流动负债', '其他流动负债', '流动负债合计',
+    '长期应付职工薪酬', '预计负债', '递延收益', '递延所得税负债',
+    '其他权益工具', '优先股', '资本公积', '负债合计', '股本',
+    '未分配利润', '股东权益合计',
+    '所有者权益', '少数股东权益'
+    ]
+
+
+def postprocess_cbs_info(tables):
     invalid_keywords = ['非流动资产处置损益']
-    filtered_tables = filter_tables(cbs_tables, invalid_keywords)
+    filtered_tables = filter_tables(tables, invalid_keywords)
 
     filtered_tables = sort_tables(filtered_tables)
 
     filtered_tables = remove_overlap_tables(filtered_tables,
         valid_overlap_words=['优先股', '永续债', '金额单位', '年度报告'])
 
-    filtered_tables = remove_tables_same_page_by_keywords(filtered_tables, row_names)
+    filtered_tables = remove_tables_same_page_by_keywords(filtered_tables, CBS_INFO_ROWS)
     filtered_tables = remove_tables_over_pages(filtered_tables)
     filtered_tables = remove_tables_over_pages(filtered_tables)
-
-    if DEBUG:
-        for table in filtered_tables:
-            print(table.page, '*'*30)
-            print(table.df)
+    return filtered_tables
 
 
-    tables_to_file(filtered_tables, cbs_path)
+def extract_cbs_info(key):
+    extract_sections(key, ['cbs_info'])
 
 
 # Consolidated cash flow statement
 # 2020-04-28__Shanmei International...2019 annual report.pdf: table not recognized in lattice mode; stream mode works.
-def extract_cscf_info(key):
-    logger.info('Extract cscf info for {}'.format(key))
-
-    row_keywords = [
-        '经营活动产生的', '收到的现金', '客户存款',
-        '其他金融机构', '中央银行', '原保险合同',
-        '收取利息', '拆入资金', '买卖证券',
-        '税费返还', '经营活动有关',
-        '经营活动现金', '支付的现金',
-        '客户贷款及垫款', '原保险合同',
-        '拆出资金', '手续费及佣金',
-        '支付给职工', '支付的各项税费',
-        '投资活动现金', '收回投资',
-        '处置固定资产', '处置子公司',
-        '投资支付', '筹资活动',
-        '汇率变动', '现金及现金等价物',
-        '现金等价物余额'
-        ]
-
-    cscf_tables = extract_table_for_rows(key, 50,
-        min_match_number=0.3*len(row_keywords),
-        required_line_keywords=['合并现金流量表'],
-        invalid_line_keywords=['母公司现金流量表'],
-        required_post_keywords=row_keywords,
-        invalid_pre_keywords=[],
-        invalid_post_keywords=['变动比例', '调整', '变更'],
-        prefix_pages=0, post_pages=3)
-    
-    if len(cscf_tables) == 0:
-        cscf_tables = extract_table_for_rows(key, 50,
-        min_match_number=0.3*len(row_keywords),
-        required_line_keywords=['现金流量表'],
-        invalid_line_keywords=['母公司现金流量表'],
-        required_post_keywords=row_keywords,
-        invalid_pre_keywords=[],
-        invalid_post_keywords=['变动比例', '调整', '变更'],
-        prefix_pages=0, post_pages=3)
-    
-    cscf_tables = sort_tables(cscf_tables)
+CSCF_INFO_ROWS = [
+    '经营活动产生的', '收到的现金', '客户存款',
+    '其他金融机构', '中央银行', '原保险合同',
+    '收取利息', '拆入资金', '买卖证券',
+    '税费返还', '经营活动有关',
+    '经营活动现金', '支付的现金',
+    '客户贷款及垫款', '原保险合同',
+    '拆出资金', '手续费及佣金',
+    '支付给职工', '支付的各项税费',
+    '投资活动现金', '收回投资',
+    '处置固定资产', '处置子公司',
+    '投资支付', '筹资活动',
+    '汇率变动', '现金及现金等价物',
+    '现金等价物余额'
+    ]
+
+
+def postprocess_cscf_info(tables):
+    cscf_tables = sort_tables(tables)
 
     filtered_tables = remove_overlap_tables(cscf_tables,
         valid_overlap_words=['净额', '人民币'])
-    filtered_tables = remove_tables_same_page_by_keywords(filtered_tables, row_keywords)
+    filtered_tables = remove_tables_same_page_by_keywords(filtered_tables, CSCF_INFO_ROWS)
     filtered_tables = remove_tables_over_pages(filtered_tables)
+    return filtered_tables
 
-    if DEBUG:
-        for table in filtered_tables:
-            print(table.page, '*'*30)
-            print(table.df)
 
-    cscf_path = get_pdf_table_path(key)['cscf_info']
-    tables_to_file(filtered_tables, cscf_path)
+def extract_cscf_info(key):
+    extract_sections(key, ['cscf_info'])
 
 
 # Consolidated income statement
 # 2022-06-14__Shanghai Pharmaceuticals...2021 annual report.pdf is image-based.
 # 2020-03-26__Livzon Pharma...2019 annual report.pdf: table not recognized.
-def extract_cis_info(key):
-    logger.info('Extract cis info for {}'.format(key))
-
-    row_keywords = [
-        '营业总收入', '营业收入', '利息收入', '已赚保费',
-        '手续费及佣金收入', '营业总成本', '营业成本', '利息支出',
-        '保单红利支出', '分保费用', '营业税金及附加', '销售费用',
-        '管理费用', '研发费用', '财务费用', '利息费用',
-        '以摊余成本计量', '汇兑收益', '净敞口套期收益', '公允价值变动收益',
-        '营业外收入', '营业外支出', '利润总额', '所得税费用',
-        '少数股东损益', '其他综合收益的税后净额', '收益的税后净额', '不能重分类进损益',
-        '权益法下可转损益', '其他债权投资公允价值', '可供出售金融资产', '金融资产重分类计入',
-        '外币财务报表', '归属于少数股东的', 
-        '归属于少数股东的',
-        '基本每股收益', '稀释每股收益']
-    cis_tables = extract_table_for_rows(key, int(1.5*len(row_keywords)),
-        min_match_number=0.3*len(row_keywords),
-        required_line_keywords=['利润表'],
-        invalid_line_keywords=['母公司利润表'],
-        required_post_keywords=row_keywords,
-        invalid_pre_keywords=[],
-        invalid_post_keywords=['变动比例', '变更', '调整'],
-        prefix_pages=0, post_pages=3)
-    
-    filtered_tables = sort_tables(cis_tables)
+CIS_INFO_ROWS = [
+    '营业总收入', '营业收入', '利息收入', '已赚保费',
+    '手续费及佣金收入', '营业总成本', '营业成本', '利息支出',
+    '保单红利支出', '分保费用', '营业税金及附加', '销售费用',
+    '管理费用', '研发费用', '财务费用', '利息费用',
+    '以摊余成本计量', '汇兑收益', '净敞口套期收益', '公允价值变动收益',
+    '营业外收入', '营业外支出', '利润总额', '所得税费用',
+    '少数股东损益', '其他综合收益的税后净额', '收益的税后净额', '不能重分类进损益',
+    '权益法下可转损益', '其他债权投资公允价值', '可供出售金融资产', '金融资产重分类计入',
+    '外币财务报表', '归属于少数股东的', 
+    '归属于少数股东的',
+    '基本每股收益', '稀释每股收益']
+
+
+def postprocess_cis_info(tables):
+    filtered_tables = sort_tables(tables)
     # Remove parent-company-only variants.
     filtered_tables = remove_overlap_tables(filtered_tables,
         valid_overlap_words=['利息收入', '项目'])
     # Remove remaining unfiltered entries.
-    filtered_tables = remove_tables_same_page_by_keywords(filtered_tables, row_keywords)
+    filtered_tables = remove_tables_same_page_by_keywords(filtered_tables, CIS_INFO_ROWS)
     # Remove cross-page fragments.
     filtered_tables = remove_tables_over_pages(filtered_tables)
+    return filtered_tables
+
+
+def extract_cis_info(key):
+    extract_sections(key, ['cis_info'])
 
-    if DEBUG:
-        for table in filtered_tables:
-            print('*'*50, table.page)
-            print(table.df)
-    cis_path = get_pdf_table_path(key)['cis_info']
-    tables_to_file(filtered_tables, cis_path)
+
+DEV_INFO_ROWS = [
+    '研发人员数量', '研发人员的数量']
+
+
+def postprocess_dev_info(tables):
+    return sort_tables(tables)
 
 
 def extract_dev_info(key):
-    logger.info('Extract dev info for {}'.format(key))
+    extract_sections(key, ['dev_info'])
+
+
+# Every section is located with its attempts in order, the next attempt is only
+# tried when the previous one gives no table.
+SECTIONS = {
+    'basic_info': {
+        'attempts': [
+            dict(max_continuous_lines=int(len(BASIC_INFO_ROWS)*1.5),
+                min_match_number=0.3*len(BASIC_INFO_ROWS),
+                required_line_keywords=['公司简介', '基本情况', '公司信息', '中文简称', '电子信箱'],
+                invalid_line_keywords=[],
+                required_post_keywords=BASIC_INFO_ROWS,
+                invalid_pre_keywords=[],
+                invalid_post_keywords=[],
+                prefix_pages=1, post_pages=1),
+        ],
+        'postprocess': postprocess_basic_info
+    },
+    'employee_info': {
+        'attempts': [
+            dict(max_continuous_lines=int(1.5*len(EMPLOYEE_INFO_ROWS)),
+                min_match_number=0.3*len(EMPLOYEE_INFO_ROWS),
+                required_line_keywords=['员工情况', '员工的数量', '员工数量', '专业构成',
+                    '离退休职工人数', '员工教育结构'],
+                invalid_line_keywords=[],
+                required_post_keywords=EMPLOYEE_INFO_ROWS,
+                invalid_pre_keywords=[],
+                invalid_post_keywords=[],
+                prefix_pages=1, post_pages=1),
+        ],
+        'postprocess': postprocess_employee_info
+    },
+    'cbs_info': {
+        'attempts': [
+            dict(max_continuous_lines=int(1.5*len(CBS_INFO_ROWS)),
+                min_match_number=0.3*len(CBS_INFO_ROWS),
+                required_line_keywords=['资产负债表'],
+                invalid_line_keywords=['母公司资产负债表'],
+                required_post_keywords=CBS_INFO_ROWS,
+                invalid_pre_keywords=[],
+                invalid_post_keywords=['调整', '变动比例', '变更'],
+                prefix_pages=0, post_pages=5),
+            # 2021-03-25__Jiangsu Financial Leasing...__600901__Jiangsu Jinzu__2020__AnnualReport.pdf
+            dict(max_continuous_lines=int(1.5*len(CBS_INFO_ROWS)),
+                min_match_number=0.2*len(CBS_INFO_ROWS),
+                required_line_keywords=['合并及母公司资产负债表'],
+                invalid_line_keywords=[],
+                required_post_keywords=CBS_INFO_ROWS,
+                invalid_pre_keywords=[],
+                invalid_post_keywords=['调整', '变更'],
+                prefix_pages=0, post_pages=5),
+            # 2021-03-27__China Everbright Bank...__601818__Everbright Bank__2020__AnnualReport.pdf
+            dict(max_continuous_lines=int(2*len(CBS_INFO_ROWS)),
+                min_match_number=0.2*len(CBS_INFO_ROWS),
+                required_line_keywords=['合并资产负债表和资产负债表'],
+                invalid_line_keywords=[],
+                required_post_keywords=CBS_INFO_ROWS,
+                invalid_pre_keywords=[],
+                invalid_post_keywords=['调整', '变更'],
+                prefix_pages=0, post_pages=5),
+        ],
+        'postprocess': postprocess_cbs_info,
+        # try the pdftotext -table layout before rendering pages
+        'text_layout': True
+    },
+    'cscf_info': {
+        'attempts': [
+            dict(max_continuous_lines=50,
+                min_match_number=0.3*len(CSCF_INFO_ROWS),
+                required_line_keywords=['合并现金流量表'],
+                invalid_line_keywords=['母公司现金流量表'],
+                required_post_keywords=CSCF_INFO_ROWS,
+                invalid_pre_keywords=[],
+                invalid_post_keywords=['变动比例', '调整', '变更'],
+                prefix_pages=0, post_pages=3),
+            dict(max_continuous_lines=50,
+                min_match_number=0.3*len(CSCF_INFO_ROWS),
+                required_line_keywords=['现金流量表'],
+                invalid_line_keywords=['母公司现金流量表'],
+                required_post_keywords=CSCF_INFO_ROWS,
+                invalid_pre_keywords=[],
+                invalid_post_keywords=['变动比例', '调整', '变更'],
+                prefix_pages=0, post_pages=3),
+        ],
+        'postprocess': postprocess_cscf_info,
+        # try the pdftotext -table layout before rendering pages
+        'text_layout': True
+    },
+    'cis_info': {
+        'attempts': [
+            dict(max_continuous_lines=int(1.5*len(CIS_INFO_ROWS)),
+                min_match_number=0.3*len(CIS_INFO_ROWS),
+                required_line_keywords=['利润表'],
+                invalid_line_keywords=['母公司利润表'],
+                required_post_keywords=CIS_INFO_ROWS,
+                invalid_pre_keywords=[],
+                invalid_post_keywords=['变动比例', '变更', '调整'],
+                prefix_pages=0, post_pages=3),
+        ],
+        'postprocess': postprocess_cis_info,
+        # try the pdftotext -table layout before rendering pages
+        'text_layout': True
+    },
+    'dev_info': {
+        'attempts': [
+            dict(max_continuous_lines=int(1.5*len(DEV_INFO_ROWS)),
+                min_match_number=0.2*len(DEV_INFO_ROWS),
+                required_line_keywords=['研发人员数量', '研发人员的数量'],
+                invalid_line_keywords=[],
+                required_post_keywords=DEV_INFO_ROWS,
+                invalid_pre_keywords=[],
+                invalid_post_keywords=[],
+                prefix_pages=0, post_pages=2),
+        ],
+        'postprocess': postprocess_dev_info
+    },
+}
+
+
+def get_section_engine(name):
+    return cfg.SECTION_TABLE_ENGINES.get(name, cfg.TABLE_ENGINE)
+
+
+def get_alternate_engine(name):
+    '''
+        table engine to re-extract a section whose tables failed validation with
+    '''
+    if get_section_engine(name) != cfg.FALLBACK_TABLE_ENGINE:
+        return cfg.FALLBACK_TABLE_ENGINE
+    return 'camelot'
+
+
+def get_hint_window(doc, hint):
+    '''
+        pages around the relative page a section was found on in an earlier report
+    '''
+    if hint is None or not doc.max_page_id:
+        return None
+    hint_page = int(round(hint['relative_page'] * doc.max_page_id))
+    return hint_page - cfg.SECTION_HINT_WINDOW, hint_page + cfg.SECTION_HINT_WINDOW
+
+
+def parse_sections(key, names=None, engine=None, hints=None, located=None):
+    '''
+        locate and parse several sections of one report, the page text is loaded
+        once and every table engine runs once per attempt round on the union of
+        their pages
+        engine: force one table engine ('camelot', 'pdfplumber' or 'text'), otherwise
+        text layout first when enabled, then cfg.SECTION_TABLE_ENGINES / cfg.TABLE_ENGINE
+        hints: {section name: {'relative_page', 'attempt'}} of an earlier report of the
+        company, the hinted attempt is tried first on the pages near the hinted page
+        and the full scan of every attempt only runs when it finds nothing
+        located: filled with {section name: {'attempt', 'page', 'relative_page', 'hint'}}
+        returns {section name: filtered tables}
+    '''
+    if names is None:
+        names = list(SECTIONS.keys())
+    if hints is None:
+        hints = {}
+
+    doc = ReportText(key)
+    # one automaton scan indexes the keywords of every attempt
+    for name in names:
+        for attempt in SECTIONS[name]['attempts']:
+            doc.keyword_index.add_keywords([k for field, v in attempt.items() \
+                if field.endswith('keywords') for k in v])
+
+    # (attempt index, page window) tried in order by every section
+    tries = {}
+    for name in names:
+        num_attempts = len(SECTIONS[name]['attempts'])
+        tries[name] = [(attempt_idx, None) for attempt_idx in range(num_attempts)]
+        hint = hints.get(name)
+        window = get_hint_window(doc, hint)
+        if window is not None and hint['attempt'] < num_attempts:
+            tries[name].insert(0, (hint['attempt'], window))
+
+    extractor = None
+    section_tables = {name: [] for name in names}
+    section_found = {}
+    next_try = {name: 0 for name in names}
+    pending = list(names)
+    text_decisions = Counter()
+    while len(pending) > 0:
+        engine_pages = {}
+        round_tries = {}
+        for name in pending:
+            location = None
+            while location is None and next_try[name] < len(tries[name]):
+                attempt_idx, window = tries[name][next_try[name]]
+                next_try[name] += 1
+                location = doc.locate_section(page_window=window, **SECTIONS[name]['attempts'][attempt_idx])
+                # a miss in the hinted window goes straight on to the full scan
+                if window is None:
+                    break
+            if location is None:
+                continue
+            match_page_id, page_ids = location
+            round_tries[name] = (attempt_idx, window, match_page_id)
+            attempt = SECTIONS[name]['attempts'][attempt_idx]
+            section_engine = engine or get_section_engine(name)
+            if section_engine == 'text' or (engine is None and cfg.TEXT_TABLE_PARSER \
+                    and SECTIONS[name].get('text_layout', False)):
+                tables = select_tables(parse_text_tables(doc.get_pages(page_ids)), attempt['required_post_keywords'])
+                if section_engine == 'text' or validate_text_tables(tables,
+                        attempt['required_post_keywords'], attempt['min_match_number']):
+                    text_decisions['text'] += 1
+                    section_tables[name] = tables
+                    continue
+                text_decisions['text_rejected'] += 1
+            engine_pages.setdefault(section_engine, {})[name] = page_ids
+        if len(engine_pages) > 0 and extractor is None:
+            extractor = PdfExtractor(get_raw_pdf_path(key))
+        for section_engine, section_pages in engine_pages.items():
+            near_tables = extract_tables_of_sections(extractor, section_pages, key, section_engine)
+            for name, tables in near_tables.items():
+                required_post_keywords = SECTIONS[name]['attempts'][round_tries[name][0]]['required_post_keywords']
+                section_tables[name] = select_tables(tables, required_post_keywords)
+
+        for name, found in round_tries.items():
+            if len(section_tables[name]) > 0:
+                section_found[name] = found
+        pending = [name for name in pending if len(section_tables[name]) == 0 \
+            and next_try[name] < len(tries[name])]
+
+    if len(text_decisions) > 0:
+        logger.info('Text layout sections of {}: {}'.format(key, dict(text_decisions)))
+    if extractor is not None:
+        logger.info('Table pages of {}: {}'.format(key, dict(extractor.page_decisions)))
+
+    if located is not None:
+        for name in names:
+            attempt_idx, window, match_page_id = section_found.get(name, (None, None, None))
+            hint = None
+            if len(tries[name]) > len(SECTIONS[name]['attempts']):
+                hint = 'hit' if window is not None else 'miss'
+            located[name] = {
+                'attempt': attempt_idx,
+                'page': None if match_page_id is None else int(match_page_id),
+                'relative_page': None if match_page_id is None else float(match_page_id / doc.max_page_id),
+                'hint': hint
+            }
+
+    filtered_tables = {}
+    for name in names:
+        filtered_tables[name] = SECTIONS[name]['postprocess'](section_tables[name])
+        if DEBUG:
+            for table in filtered_tables[name]:
+                print(table.page, '*'*30)
+                print(table.df)
+    return filtered_tables
+
+
+def extract_sections(key, names=None, engine=None, hints=None):
+    '''
+        returns {section name: location} as filled in by parse_sections
+    '''
+    if names is None:
+        names = list(SECTIONS.keys())
+    logger.info('Extract {} for {}'.format(', '.join(names), key))
+    located = {}
+    section_tables = parse_sections(key, names, engine, hints, located)
+    save_sections(key, section_tables)
+    return located
 
-    row_keywords = [
-        '研发人员数量', '研发人员的数量']
-    
-    dev_tables = extract_table_for_rows(key, int(1.5*len(row_keywords)),
-        min_match_number=0.2*len(row_keywords),
-        required_line_keywords=['研发人员数量', '研发人员的数量'],
-        invalid_line_keywords=[],
-        required_post_keywords=row_keywords,
-        invalid_pre_keywords=[],
-        invalid_post_keywords=[],
-        prefix_pages=0, post_pages=2)
-    
-    filtered_tables = sort_tables(dev_tables)
 
-    if DEBUG:
-        for table in filtered_tables:
-            print('*'*50, table.page)
-            print(table.df)
-    dev_path = get_pdf_table_path(key)['dev_info']
-    tables_to_file(filtered_tables, dev_path)
+def save_sections(key, section_tables):
+    '''
+        write the tables of every section to its .txt file and the table store,
+        together with the unit of every statement
+    '''
+    texts = {}
+    source_stats = {}
+    units = {}
+    for name, tables in section_tables.items():
+        table_path = get_pdf_table_path(key)[name]
+        texts[name] = tables_to_file(tables, table_path)
+        table_stat = os.stat(table_path)
+        source_stats[name] = (table_stat.st_size, table_stat.st_mtime)
+        if name in STATEMENT_NAMES and len(texts[name]) > 0:
+            units[name] = find_table_unit(key, text_to_lines(texts[name]))
+    get_table_store().put_report(key, texts, source_stats, units)
+
+
+def extract_all_info(key, hints=None):
+    '''
+        returns {'elapsed', 'sections': located sections} for the section hints
+    '''
+    start = time.time()
+    located = extract_sections(key, list(SECTIONS.keys()), hints=hints)
+    return {'elapsed': time.time() - start, 'sections': located}
+
+
+def extract_all_info_fallback(key, hints=None):
+    '''
+        retry of extract_all_info with cfg.FALLBACK_TABLE_ENGINE for every section
+    '''
+    start = time.time()
+    located = extract_sections(key, list(SECTIONS.keys()), engine=cfg.FALLBACK_TABLE_ENGINE, hints=hints)
+    return {'elapsed': time.time() - start, 'sections': located}
 
 
+def load_section_hints():
+    '''
+        {company code: {section name: {'relative_page', 'attempt', 'key'}}}
+    '''
+    return load_json_manifest(cfg.SECTION_HINTS)
+
+
+def update_section_hints(section_hints, code, key, located):
+    '''
+        remember where the sections of report key were found for the next report of code
+    '''
+    for name, section in located.items():
+        if section['attempt'] is None:
+            continue
+        section_hints.setdefault(code, {})[name] = {
+            'relative_page': section['relative_page'],
+            'attempt': section['attempt'],
+            'key': key
+        }
+
 
 def clean_info(table_name):
     pdf_info = load_pdf_info()
@@ -568,17 +876,39 @@ def clean_info(table_name):
 
 
 def merge_info(table_name):
+    '''
+        sync the <table_name>.txt files of every report into the table store,
+        reports without the file are removed from it. Only files whose size or
+        mtime differ from the last sync are read, and only tables whose checksum
+        changed are rewritten
+        returns the keys of the changed reports
+    '''
     pdf_info = load_pdf_info()
+    store = get_table_store()
+    synced_stats = store.get_source_stats(table_name)
+    texts = {}
+    source_stats = {}
+    present_keys = set()
     for key in list(pdf_info.keys()):
         table_path = get_pdf_table_path(key)[table_name]
-        if not os.path.exists(table_path):
-            del pdf_info[key]
+        try:
+            table_stat = os.stat(table_path)
+        except FileNotFoundError:
+            continue
+        present_keys.add(key)
+        source_stats[key] = (table_stat.st_size, table_stat.st_mtime)
+        if synced_stats.get(key) == source_stats[key]:
             continue
         with open(table_path, 'r', encoding='utf-8') as f:
-            table_content = f.readlines()
-        pdf_info[key][table_name] = table_content
-    with open(os.path.join(cfg.DATA_PATH, '{}.json'.format(table_name)), 'w', encoding='utf-8') as f:
-        json.dump(pdf_info, f, ensure_ascii=False, indent=4)
+            texts[key] = f.read()
+    changed = store.put_table(table_name, texts, source_stats)
+    removed = [k for k in store.keys(table_name) if k not in present_keys]
+    store.delete(removed, table_name)
+    if table_name in STATEMENT_NAMES:
+        save_missing_units(store, [table_name])
+    logger.info('Merge {}: {} files read, {} changed, {} removed'.format(
+        table_name, len(texts), len(changed), len(removed)))
+    return set([k for k, _ in changed] + removed)
 
 
 
@@ -13,7 +13,8 @@ from file import load_total_tables
 from file import load_tables_of_years
 from file import add_growth_rate_in_table
 from file import table_to_text, add_text_compare_in_table
-from file import load_pdf_info, load_test_questions
+from file import load_test_questions
+from report_registry import get_report_registry
 from company_table import get_sql_search_cursor, load_company_table
 from recall_report_text import recall_annual_report_texts
 from recall_report_names import recall_pdf_tables
@@ -28,7 +29,7 @@ def do_classification(model: ChatGLM_Ptuning):
     logger.info('Do classfication...')
     test_questions = load_test_questions()
     
-    pdf_info = load_pdf_info()
+    registry = get_report_registry()
 
     classify_dir = os.path.join(cfg.DATA_PATH, 'classify')
     if not os.path.exists(classify_dir):
@@ -37,7 +38,7 @@ def do_classification(model: ChatGLM_Ptuning):
     for question in test_questions:
         class_csv = os.path.join(classify_dir, '{}.csv'.format(question['id']))
 
-        mactched_comp_names = question_util.get_match_company_names(question['question'], pdf_info)
+        mactched_comp_names = question_util.get_match_company_names(question['question'], registry)
 
         
         logger.opt(colors=True).info('<blue>Start process question {} {}</>'.format(question['id'], question['question']))
@@ -70,8 +71,6 @@ def do_gen_keywords(model: ChatGLM_Ptuning):
     logger.info('Do gen keywords...')
     test_questions = load_test_questions()
 
-    pdf_info = load_pdf_info()
-
     keywords_dir = os.path.join(cfg.DATA_PATH, 'keywords')
     if not os.path.exists(keywords_dir):
         os.mkdir(keywords_dir)
@@ -126,7 +125,7 @@ def do_sql_generation(model: ChatGLM_Ptuning):
 
 def generate_answer(model):
     logger.info('Load pdf info...')
-    pdf_info = load_pdf_info()
+    registry = get_report_registry()
     pdf_tables = load_total_tables()
 
     test_questions = load_test_questions()
@@ -163,8 +162,8 @@ def generate_answer(model):
         ori_question = re.sub('[\(\)（）]', '', question['question'])
         
         years = question_util.get_years_of_question(ori_question)
-        mactched_pdf_names = question_util.get_match_pdf_names(ori_question, pdf_info)
-        company_abbrs = question_util.get_company_name_and_abbr_code_of_question(mactched_pdf_names, pdf_info)
+        mactched_pdf_names = question_util.get_match_pdf_names(ori_question, registry)
+        company_abbrs = question_util.get_company_name_and_abbr_code_of_question(mactched_pdf_names, registry)
 
         answer = '经查询，无法回答{}'.format(ori_question)
 
@@ -193,7 +192,7 @@ def generate_answer(model):
                     background = ''
                     tot_matched_rows = []
                     for year in years:
-                        pdf_table = load_tables_of_years(company, [year], pdf_tables, pdf_info)
+                        pdf_table = load_tables_of_years(company, [year], pdf_tables, registry)
 
                         background += '已知{}(简称:{},证券代码:{}){}年的资料如下:\n    '.format(company, abbr, code, year)
                         matched_table_rows = []
@@ -236,13 +235,13 @@ def generate_answer(model):
                         years_of_table = []
                         for year in years:
                             years_of_table.extend([year, str(int(year)-1)])
-                        pdf_table = load_tables_of_years(company, years_of_table, pdf_tables, pdf_info)
+                        pdf_table = load_tables_of_years(company, years_of_table, pdf_tables, registry)
                         pdf_table = add_growth_rate_in_table(pdf_table)
                     elif type2.is_type2_formula(ori_question):
-                        pdf_table = load_tables_of_years(company, years, pdf_tables, pdf_info)
+                        pdf_table = load_tables_of_years(company, years, pdf_tables, registry)
                     else:
                         logger.error('无法匹配, 该问题既不是增长率也不是公式计算')
-                        pdf_table = load_tables_of_years(company, years, pdf_tables, pdf_info)
+                        pdf_table = load_tables_of_years(company, years, pdf_tables, registry)
 
                     step_questions, step_keywords, variable_names, step_years, formula, question_formula = type2.get_step_questions(
                         ori_question, ''.join(question_keywords), real_comp, years[0])
@@ -342,7 +341,7 @@ def generate_answer(model):
                 else:
                     anoy_question, _ = question_util.parse_question_keywords(model, ori_question, real_comp, years)
                     logger.info('问题关键词: {}'.format(question_keywords))
-                    pdf_table = load_tables_of_years(company, years, pdf_tables, pdf_info)
+                    pdf_table = load_tables_of_years(company, years, pdf_tables, registry)
 
                     background = '***************{}{}年年报***************\n'.format(
                         real_comp, years[0])
@@ -0,0 +1,102 @@
+from bisect import bisect_left
+from collections import deque
+
+
+class KeywordAutomaton(object):
+    '''
+        Aho-Corasick automaton, finds every keyword occurring in a text in one pass
+    '''
+
+    def __init__(self, keywords) -> None:
+        self.keywords = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for keyword in keywords:
+            self.add(keyword)
+        self._build()
+
+    def add(self, keyword):
+        state = 0
+        for char in keyword:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state].append(len(self.keywords))
+        self.keywords.append(keyword)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail > 0 and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text):
+        '''
+            yield (end position, keyword index) of every occurrence
+        '''
+        state = 0
+        for pos, char in enumerate(text):
+            while state > 0 and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for idx in self._output[state]:
+                yield pos + 1, idx
+
+    def search(self, text):
+        '''
+            indexes of the keywords occurring in text
+        '''
+        return set(idx for _, idx in self.iter_matches(text))
+
+
+class KeywordLineIndex(object):
+    '''
+        sorted line numbers every keyword occurs in, so "does a keyword appear in
+        lines [start, end)" is a bisect instead of a scan over the joined text
+    '''
+
+    def __init__(self, lines) -> None:
+        self.lines = lines
+        self._occurrences = {}
+
+    def add_keywords(self, keywords):
+        '''
+            index the keywords not seen before with a single scan of all lines
+        '''
+        keywords = list(set([k for k in keywords if k not in self._occurrences]))
+        if len(keywords) == 0:
+            return
+        for keyword in keywords:
+            self._occurrences[keyword] = []
+        automaton = KeywordAutomaton([k for k in keywords if len(k) > 0])
+        for i, line in enumerate(self.lines):
+            for idx in sorted(automaton.search(line)):
+                self._occurrences[automaton.keywords[idx]].append(i)
+
+    def occurrences(self, keyword):
+        if keyword not in self._occurrences:
+            self.add_keywords([keyword])
+        return self._occurrences[keyword]
+
+    def count(self, keyword, start, end):
+        '''
+            number of lines in [start, end) containing keyword
+        '''
+        positions = self.occurrences(keyword)
+        return bisect_left(positions, end) - bisect_left(positions, start)
+
+    def contains(self, keyword, start, end):
+        if len(keyword) == 0:
+            # '' in text is always true, even for an empty window
+            return True
+        return self.count(keyword, start, end) > 0
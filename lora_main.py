@@ -10,7 +10,7 @@ from config import cfg
 from file import download_data
 from company_table import count_table_keys, build_table
 from qwen_ptuning import QwenLoRA, LoraType
-from preprocess import extract_pdf_text, extract_pdf_tables
+from preprocess import build_pdf_meta_index, extract_pdf_text, extract_pdf_tables
 from check import init_check_dir, check_text, check_tables
 from generate_answer_with_classify import do_gen_keywords
 from generate_answer_with_classify import do_classification, do_sql_generation, generate_answer, make_answer
@@ -72,6 +72,7 @@ if __name__ == '__main__':
     download_data()
 
     # 2. Parse PDFs and extract relevant data.
+    build_pdf_meta_index()
     extract_pdf_text()
     extract_pdf_tables()
 
@@ -76,8 +76,9 @@ def run_full_pipeline():
     from file import download_data
     from company_table import count_table_keys, build_table
     from chatglm_ptuning import ChatGLM_Ptuning, PtuningType
-    from preprocess import extract_pdf_text, extract_pdf_tables
-    from check import init_check_dir, check_text, check_tables
+    from preprocess import build_pdf_meta_index, ingest_pdfs, extract_pdf_tables, reextract_queued_sections
+    from preprocess import build_row_store
+    from check import init_check_dir, check_text, check_tables, validate_statements
     from generate_answer_with_classify import do_gen_keywords
     from generate_answer_with_classify import do_classification, do_sql_generation, generate_answer, make_answer
 
@@ -88,13 +89,17 @@ def run_full_pipeline():
     download_data()
 
     # 2. Parse PDFs and extract relevant data.
-    extract_pdf_text()
+    build_pdf_meta_index()
+    ingest_pdfs()
     extract_pdf_tables()
 
     # 3. Validate extracted data and detect missing items.
     init_check_dir()
     check_text(copy_error_pdf=True)
     check_tables(copy_error_pdf=True)
+    validate_statements()
+    reextract_queued_sections()
+    build_row_store()
 
     # 4. Build the wide company table from extracted fields.
     count_table_keys()
@@ -0,0 +1,131 @@
+import os
+import mmap
+import struct
+from array import array
+
+# Layout (little endian):
+#   header      magic, version, num_pages, num_lines
+#   page_ids    int32 * num_pages
+#   page_starts uint32 * (num_pages + 1), first line of every page plus the total
+#   offsets     uint64 * (num_lines + 1), byte offset of every line in the payload
+#   payload     utf-8 text of all lines, back to back
+MAGIC = b'FMPS'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+
+
+def write_page_store(path, pages):
+    '''
+        pages: iterable of (page_id, lines) in document order
+    '''
+    page_ids = []
+    page_starts = [0]
+    offsets = [0]
+    payload = bytearray()
+    for page_id, lines in pages:
+        page_ids.append(int(page_id))
+        for line in lines:
+            payload.extend(line.encode('utf-8'))
+            offsets.append(len(payload))
+        page_starts.append(len(offsets) - 1)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(page_ids), len(offsets) - 1))
+        f.write(struct.pack('<{}i'.format(len(page_ids)), *page_ids))
+        f.write(struct.pack('<{}I'.format(len(page_starts)), *page_starts))
+        f.write(struct.pack('<{}Q'.format(len(offsets)), *offsets))
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+class PageStore(object):
+    '''
+        read-only, memory mapped view of a page store; a page or a line range is
+        decoded on demand without touching the rest of the document
+    '''
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = None
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._read_index()
+        except (ValueError, struct.error) as e:
+            # a truncated store fails here instead of on the first read
+            self.close()
+            raise ValueError('{} is not a page store of version {}, {}'.format(path, VERSION, e))
+
+    def _read_index(self):
+        magic, version, num_pages, num_lines = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('bad magic or version')
+        self.num_pages = num_pages
+        self.num_lines = num_lines
+
+        offset = HEADER.size
+        self.page_ids = list(struct.unpack_from('<{}i'.format(num_pages), self._mm, offset))
+        offset += 4 * num_pages
+        self._page_starts = array('I', struct.unpack_from('<{}I'.format(num_pages + 1), self._mm, offset))
+        offset += 4 * (num_pages + 1)
+        self._offsets_pos = offset
+        self._payload_pos = offset + 8 * (num_lines + 1)
+        payload_size, = struct.unpack_from('<Q', self._mm, self._offsets_pos + 8 * num_lines)
+        if self._payload_pos + payload_size > len(self._mm):
+            raise ValueError('payload is truncated')
+        self._page_index = {page_id: i for i, page_id in enumerate(self.page_ids)}
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_lines(self, start, end):
+        '''
+            lines [start, end) of the whole document
+        '''
+        start = max(0, start)
+        end = min(self.num_lines, end)
+        if start >= end:
+            return []
+        offsets = struct.unpack_from('<{}Q'.format(end - start + 1), self._mm, self._offsets_pos + 8 * start)
+        base = self._payload_pos
+        data = self._mm[base + offsets[0]:base + offsets[-1]]
+        return [data[a - offsets[0]:b - offsets[0]].decode('utf-8', errors='ignore') \
+            for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def page_index(self, page_id):
+        return self._page_index.get(int(page_id))
+
+    def get_page_line_range(self, page_id):
+        idx = self.page_index(page_id)
+        if idx is None:
+            return None
+        return self._page_starts[idx], self._page_starts[idx + 1]
+
+    def get_page_lines(self, page_id):
+        line_range = self.get_page_line_range(page_id)
+        if line_range is None:
+            return []
+        return self.get_lines(*line_range)
+
+    def get_page_at(self, idx):
+        '''
+            page by position, in the same {'page', 'text'} form as pure_content.txt
+        '''
+        lines = self.get_lines(self._page_starts[idx], self._page_starts[idx + 1])
+        return {'page': self.page_ids[idx], 'text': '\n'.join(lines)}
+
+    def get_page(self, page_id):
+        idx = self.page_index(page_id)
+        if idx is None:
+            return None
+        return self.get_page_at(idx)
@@ -1,16 +1,87 @@
+import os
 import glob
+import time
 import pdfplumber
 import re
-from collections import defaultdict
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, Counter
+from datetime import datetime
 import json
+from loguru import logger
+
+from config import cfg
+from file import load_pdf_info, get_alltxt_path, build_alltxt_page_store, get_pdf_page_count
+from file import get_image_only_keys
+from file import load_json_manifest, save_json_manifest, update_failures
+from pool_util import watch_tasks
+
+CHECK_RE = '(?:。|；|单位：元|单位：万元|币种：人民币|\d|报告(?:全文)?(?:（修订版）|（修订稿）|（更正后）)?)$'
+
+
+class PageLayout:
+    '''
+        words of a page extracted once, "text between top and buttom" queries are
+        answered from a top-sorted index; output is the same as PDFProcessor.check_lines
+    '''
+    # every CHECK_RE match is shorter than this, so only the tail of the text is searched
+    TAIL_SIZE = 16
+
+    def __init__(self, page):
+        self.words = page.extract_words()
+        self.height = page.height
+        self.width = page.width
+        self.order = sorted(range(len(self.words)), key=lambda i: self.words[i]['top'])
+        self.sorted_tops = [self.words[i]['top'] for i in self.order]
+        self.check_re = re.compile(CHECK_RE)
+
+    def text_between(self, top, buttom):
+        words = self.words
+        if top == '' and buttom == '':
+            indices = range(len(words))
+            height_limit = self.height * 0.9
+        else:
+            lo = bisect_right(self.sorted_tops, buttom)
+            hi = len(words) if top == '' else bisect_left(self.sorted_tops, top)
+            # keep extraction order, the line joining depends on the previous word
+            indices = sorted(self.order[lo:hi])
+            height_limit = self.height * 0.85
+
+        pieces = []
+        tail = ''
+        for i in indices:
+            word = words[i]
+            if i > 0:
+                last_top = words[i-1]['top']
+                last_check = words[i-1]['x1'] - self.width * 0.85
+            else:
+                last_top = 0
+                last_check = 0
+            if abs(last_top - word['top']) <= 2:
+                piece = word['text']
+            elif last_check > 0 and (height_limit - word['top']) > 0 and not self.check_re.search(tail):
+                piece = word['text']
+            else:
+                piece = '\n' + word['text']
+            pieces.append(piece)
+            tail = (tail + piece)[-self.TAIL_SIZE:]
+        return ''.join(pieces)
+
 
 class PDFProcessor:
-    def __init__(self, filepath):
+    def __init__(self, filepath, pdf=None, stream_path=None):
+        '''
+            pdf: an already opened pdfplumber document to share with other extractors
+            stream_path: streaming mode, records are written to this file page by page
+                and the parsed layout of every page is released once it is done
+        '''
         self.filepath = filepath
-        self.pdf = pdfplumber.open(filepath)
+        self.pdf = pdf if pdf is not None else pdfplumber.open(filepath)
         self.all_text = defaultdict(dict)
         self.allrow = 0
         self.last_num = 0
+        self.num_chars = 0
+        self.num_flushed = 0
+        self.stream_path = stream_path
 
     def check_lines(self, page, top, buttom):
         lines = page.extract_words()[::]
@@ -19,7 +90,7 @@ class PDFProcessor:
         last_check = 0
         for l in range(len(lines)):
             each_line = lines[l]
-            check_re = '(?:。|；|单位：元|单位：万元|币种：人民币|\d|报告(?:全文)?(?:（修订版）|（修订稿）|（更正后）)?)$'
+            check_re = CHECK_RE
             if top == '' and buttom == '':
                 if abs(last_top - each_line['top']) <= 2:
                     text = text + each_line['text']
@@ -77,7 +148,9 @@ class PDFProcessor:
 
     def extract_text_and_tables(self, page):
         buttom = 0
+        self.num_chars += len(page.chars)
         page = page.filter(self.keep_visible_lines)
+        layout = PageLayout(page)
         tables = page.find_tables()
         if len(tables) >= 1:
             count = len(tables)
@@ -87,7 +160,7 @@ class PDFProcessor:
                 else:
                     count -= 1
                     top = table.bbox[1]
-                    text = self.check_lines(page, top, buttom)
+                    text = layout.text_between(top, buttom)
                     text_list = text.split('\n')
                     for _t in range(len(text_list)):
                         self.all_text[self.allrow] = {'page': page.page_number, 'allrow': self.allrow,
@@ -134,7 +207,7 @@ class PDFProcessor:
                         self.allrow += 1
 
                     if count == 0:
-                        text = self.check_lines(page, '', buttom)
+                        text = layout.text_between('', buttom)
                         text_list = text.split('\n')
                         for _t in range(len(text_list)):
                             self.all_text[self.allrow] = {'page': page.page_number, 'allrow': self.allrow,
@@ -142,7 +215,7 @@ class PDFProcessor:
                             self.allrow += 1
 
         else:
-            text = self.check_lines(page, '', '')
+            text = layout.text_between('', '')
             text_list = text.split('\n')
             for _t in range(len(text_list)):
                 self.all_text[self.allrow] = {'page': page.page_number, 'allrow': self.allrow,
@@ -154,30 +227,52 @@ class PDFProcessor:
         if self.last_num == 0:
             try:
                 first_text = str(self.all_text[1]['inside'])
-                end_text = str(self.all_text[len(self.all_text) - 1]['inside'])
+                end_text = str(self.all_text[self.num_records() - 1]['inside'])
                 if re.search(first_re, first_text) and not '[' in end_text:
                     self.all_text[1]['type'] = '页眉'
                     if re.search(end_re, end_text) and not '[' in end_text:
-                        self.all_text[len(self.all_text) - 1]['type'] = '页脚'
+                        self.all_text[self.num_records() - 1]['type'] = '页脚'
             except:
                 print(page.page_number)
         else:
             try:
                 first_text = str(self.all_text[self.last_num + 2]['inside'])
-                end_text = str(self.all_text[len(self.all_text) - 1]['inside'])
+                end_text = str(self.all_text[self.num_records() - 1]['inside'])
                 if re.search(first_re, first_text) and '[' not in end_text:
                     self.all_text[self.last_num + 2]['type'] = '页眉'
                 if re.search(end_re, end_text) and '[' not in end_text:
-                    self.all_text[len(self.all_text) - 1]['type'] = '页脚'
+                    self.all_text[self.num_records() - 1]['type'] = '页脚'
             except:
                 print(page.page_number)
 
-        self.last_num = len(self.all_text) - 1
+        self.last_num = self.num_records() - 1
+
+    def num_records(self):
+        return self.num_flushed + len(self.all_text)
 
+    def flush_records(self, file, upto=None):
+        '''
+            write and drop records before row upto (all of them if None); header
+            and footer detection of the next page only looks at rows >= allrow
+        '''
+        keys = [k for k in self.all_text.keys() if upto is None or k < upto]
+        for key in keys:
+            file.write(json.dumps(self.all_text.pop(key), ensure_ascii=False) + '\n')
+        self.num_flushed += len(keys)
 
     def process_pdf(self):
-        for i in range(len(self.pdf.pages)):
-            self.extract_text_and_tables(self.pdf.pages[i])
+        if self.stream_path is None:
+            for i in range(len(self.pdf.pages)):
+                self.extract_text_and_tables(self.pdf.pages[i])
+            return
+
+        with open(self.stream_path, 'w', encoding='utf-8') as file:
+            for i in range(len(self.pdf.pages)):
+                page = self.pdf.pages[i]
+                self.extract_text_and_tables(page)
+                self.flush_records(file, self.allrow)
+                page.flush_cache()
+            self.flush_records(file)
 
 
     def save_all_text(self, path):
@@ -186,19 +281,123 @@ class PDFProcessor:
                 file.write(json.dumps(self.all_text[key], ensure_ascii=False) + '\n')
 
 
-def process_all_pdfs_in_folder(folder_path):
-    file_paths = glob.glob(f'{folder_path}/*')
-    file_paths = sorted(file_paths, reverse=True)
+def compare_layout_engine(pdf_path, max_pages=None):
+    '''
+        run check_lines and PageLayout on the same queries as extract_text_and_tables,
+        count mismatching outputs and time both
+    '''
+    processor = PDFProcessor(pdf_path)
+    stats = {'pages': 0, 'queries': 0, 'mismatches': 0, 'check_lines_seconds': 0.0, 'layout_seconds': 0.0}
+    for page in processor.pdf.pages[:max_pages]:
+        page = page.filter(processor.keep_visible_lines)
+        queries = []
+        buttom = 0
+        tables = page.find_tables()
+        for table in tables:
+            if table.bbox[3] >= buttom:
+                queries.append((table.bbox[1], buttom))
+                buttom = table.bbox[3]
+        queries.append(('', buttom) if len(tables) > 0 else ('', ''))
+
+        start = time.time()
+        expected = [processor.check_lines(page, top, buttom) for top, buttom in queries]
+        stats['check_lines_seconds'] += time.time() - start
+
+        start = time.time()
+        layout = PageLayout(page)
+        actual = [layout.text_between(top, buttom) for top, buttom in queries]
+        stats['layout_seconds'] += time.time() - start
+
+        stats['pages'] += 1
+        stats['queries'] += len(queries)
+        stats['mismatches'] += len([1 for a, b in zip(expected, actual) if a != b])
+    processor.pdf.close()
+    return stats
 
-    for file_path in file_paths:
-        print(file_path)
+
+def process_pdf_to_alltxt(key, pdf_path):
+    '''
+        returns (key, status, elapsed seconds, error reason)
+    '''
+    start = time.time()
+    save_path = get_alltxt_path(key)
+    tmp_path = save_path + '.tmp'
+    try:
+        processor = PDFProcessor(pdf_path, stream_path=tmp_path)
         try:
-            processor = PDFProcessor(file_path)
             processor.process_pdf()
-            save_path = 'alltxt/' + file_path.split('/')[-1].replace('.pdf', '.txt')
-            processor.save_all_text(save_path)
-        except:
-            print('check')
+        finally:
+            processor.pdf.close()
+        os.replace(tmp_path, save_path)
+        build_alltxt_page_store(key)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        logger.error('Process {} failed, {}'.format(key, e))
+        return key, 'failed', time.time() - start, '{}: {}'.format(type(e).__name__, e)
+    logger.info('Processed {} in {:.1f}s'.format(key, time.time() - start))
+    return key, 'done', time.time() - start, None
+
+
+def _process_pdf_to_alltxt(args):
+    return process_pdf_to_alltxt(*args)
+
+
+def process_all_pdfs(pdf_paths=None, resume=True, processes=cfg.NUM_PROCESSES, save_every=50):
+    '''
+        pdf_paths: {key: pdf path}, every report of pdf_info.json by default.
+        Reports finished in an earlier run, and image only reports, are skipped.
+        A report running past cfg.REPORT_TIMEOUT or over cfg.WORKER_MEMORY_LIMIT_MB
+        is killed, failures are recorded under 'alltxt' in the failure manifest.
+    '''
+    if pdf_paths is None:
+        pdf_paths = {k: v['pdf_path'] for k, v in load_pdf_info().items()}
+    os.makedirs(os.path.join(cfg.DATA_PATH, cfg.ALLTXT_DIR), exist_ok=True)
+
+    manifest = load_json_manifest(cfg.ALLTXT_MANIFEST)
+    image_only_keys = get_image_only_keys()
+    tasks = []
+    for key, pdf_path in pdf_paths.items():
+        if key in image_only_keys:
+            continue
+        if resume and manifest.get(key, {}).get('status') == 'done' and os.path.exists(get_alltxt_path(key)):
+            continue
+        tasks.append((key, pdf_path))
+    tasks = sorted(tasks, key=lambda t: get_pdf_page_count(t[0]) or 0, reverse=True)
+    logger.info('{} of {} reports to process'.format(len(tasks), len(pdf_paths)))
+
+    status_count = Counter()
+    failures = {}
+    results = watch_tasks(_process_pdf_to_alltxt, tasks, processes, timeout=cfg.REPORT_TIMEOUT,
+        memory_limit_mb=cfg.WORKER_MEMORY_LIMIT_MB)
+    for i, (task, result, failure) in enumerate(results):
+        if failure is None:
+            key, status, elapsed, error = result
+        else:
+            key, status, elapsed, error = task[0], 'failed', failure['elapsed'], failure['reason']
+        status_count[status] += 1
+        manifest[key] = {
+            'status': status,
+            'elapsed': round(elapsed, 3),
+            'error': error,
+            'finished_at': datetime.now().isoformat(timespec='seconds')
+        }
+        if error is not None:
+            failures[key] = {'reason': error, 'elapsed': round(elapsed, 3)}
+        if (i + 1) % save_every == 0:
+            save_json_manifest(cfg.ALLTXT_MANIFEST, manifest)
+    save_json_manifest(cfg.ALLTXT_MANIFEST, manifest)
+    update_failures('alltxt', failures, [k for k, _ in tasks if k not in failures])
+
+    logger.info('alltxt finished, {} done, {} failed, {} skipped'.format(
+        status_count['done'], status_count['failed'], len(pdf_paths) - len(tasks)))
+    return dict(status_count)
+
+
+def process_all_pdfs_in_folder(folder_path, resume=True):
+    file_paths = glob.glob(f'{folder_path}/*')
+    pdf_paths = {os.path.basename(file_path): file_path for file_path in sorted(file_paths, reverse=True)}
+    return process_all_pdfs(pdf_paths, resume=resume)
 
 
 if __name__ == '__main__':
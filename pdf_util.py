@@ -1,32 +1,102 @@
 import os
+import io
 import json
 import shutil
 import tempfile
+import threading
+import subprocess
 import pdfplumber
 import camelot
 import re
+import hashlib
 import numpy as np
+import pandas as pd
+from collections import Counter
 from loguru import logger
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import resolve1
 from multiprocessing import Pool
 
 from config import cfg
+from file import get_file_md5
+
+# Bump whenever the pure_content.txt format or extraction logic changes, so
+# incremental runs re-extract every report.
+PURE_CONTENT_VERSION = 'xpdf-table-2'
+
+CAMELOT_PARAMS = {
+    'lattice': {'strip_text': '\n', 'line_tol': 6, 'line_scale': 60},
+    'stream': {'edge_tol': 100}
+}
+
+
+def get_camelot_params_hash(flavor):
+    params = dict(CAMELOT_PARAMS[flavor], flavor=flavor, version=camelot.__version__)
+    return hashlib.md5(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+
+
+class ParsedTable(object):
+    '''
+        the parts of a camelot table the pipeline uses, camelot tables and cached
+        tables are interchangeable
+        flavor is the parsing mode of the page, fallback_reason why stream replaced
+        lattice on it ('empty', 'chaos' or 'lattice_error'), None if it did not
+    '''
+
+    def __init__(self, df, page, bbox, flavor, fallback_reason=None) -> None:
+        self.df = df
+        self.page = page
+        self._bbox = bbox
+        self.flavor = flavor
+        self.fallback_reason = fallback_reason
+
+    @classmethod
+    def from_camelot(cls, table, flavor):
+        return cls(table.df, int(table.page), tuple(table._bbox), flavor)
+
+    def to_json(self):
+        return {'rows': self.df.values.tolist(), 'bbox': list(self._bbox)}
+
+    @classmethod
+    def from_json(cls, item, page, flavor):
+        return cls(pd.DataFrame(item['rows']), page, tuple(item['bbox']), flavor)
+
+
+def get_pdftotext_path():
+    return os.path.join(cfg.XPDF_PATH, 'pdftotext')
 
 
 class PdfExtractor(object):
 
-    def __init__(self, path) -> None:
+    def __init__(self, path, table_cache=True) -> None:
+        '''
+            table_cache: reuse camelot results stored under cfg.TABLE_CACHE_DIR
+        '''
         self.path = path
+        self.table_cache = table_cache
+        self._md5 = None
+        # number of pages parsed by each path of extract_table_of_pages
+        self.page_decisions = Counter()
 
-    def extract_pure_content_and_save(self, save_path, use_xpdf=True):
-        try:
-            pdf = pdfplumber.open(self.path)
-        except Exception as e:
-            print(e)
-            return
-
+    def extract_pure_content_and_save(self, save_path, use_xpdf=True, expected_pages=None,
+            first_page=None, last_page=None, timeout=None):
+        '''
+            first_page/last_page (1-based, inclusive) restrict extraction to a page range
+            timeout: seconds pdftotext may run
+        '''
         if not use_xpdf:
+            try:
+                pdf = pdfplumber.open(self.path)
+            except Exception as e:
+                print(e)
+                return
+            pages = pdf.pages
+            if first_page is not None or last_page is not None:
+                pages = pages[(first_page or 1)-1:last_page]
             with open(save_path, 'w', encoding='utf-8') as f:
-                for page in pdf.pages:
+                for page in pages:
                     text = page.extract_text()
                     line = {
                         'page': page.page_number,
@@ -34,69 +104,247 @@ class PdfExtractor(object):
                     }
                     # print(text)
                     f.write(json.dumps(line, ensure_ascii=True) + '\n')
+            pdf.close()
         else:
-            os.chdir(cfg.XPDF_PATH)
-            cmd = './pdftotext -table -enc UTF-8 "{}" "{}"'.format(
-                    self.path, save_path)
-            os.system(cmd)
-            with open(save_path, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
-                pages = '\n'.join(lines).split('\x0c')
-                
-            if len(pdf.pages) != len(pages) - 1:
-                logger.error('{} {} does not match for {}'.format(len(pdf.pages), len(pages), self.path))
+            num_pages = 0
             with open(save_path, 'w', encoding='utf-8') as f:
-                for idx, page in enumerate(pages):
-                    lines = page.split('\n')
+                for page_id, page_text in self.iter_xpdf_pages(first_page, last_page, timeout=timeout):
+                    lines = page_text.split('\n')
                     lines = [line for line in lines if len(line.strip()) > 0]
                     page_block = {
-                        'page': idx+1,
+                        'page': page_id,
                         'text': '\n'.join(lines)
                     }
                     f.write(json.dumps(page_block, ensure_ascii=False) + '\n')
-        pdf.close()
+                    num_pages += 1
+
+            if expected_pages is not None and expected_pages != num_pages:
+                logger.error('{} {} does not match for {}'.format(expected_pages, num_pages, self.path))
+
+    def read_metadata(self):
+        '''
+            walk the page tree only, no content stream is parsed
+        '''
+        with open(self.path, 'rb') as f:
+            doc = PDFDocument(PDFParser(f))
+            return self.pages_metadata(PDFPage.create_pages(doc))
+
+    @staticmethod
+    def pages_metadata(pages):
+        '''
+            pages: pdfminer PDFPage objects, e.g. [p.page_obj for p in pdfplumber_pdf.pages]
+        '''
+        num_pages = 0
+        num_font_pages = 0
+        for page in pages:
+            num_pages += 1
+            fonts = resolve1(page.resources.get('Font')) if page.resources else None
+            if fonts:
+                num_font_pages += 1
+        return {
+            'page_count': num_pages,
+            'font_pages': num_font_pages,
+            'has_text_layer': num_font_pages > 0
+        }
+
+    def probe_text_layer(self, num_pages=cfg.TEXT_PROBE_PAGES, min_chars=cfg.TEXT_PROBE_MIN_CHARS):
+        '''
+            count the chars of a few pages spread over the report, scanned reports
+            often keep a font on the cover only, so the font pages of
+            pages_metadata alone cannot tell them apart
+        '''
+        with pdfplumber.open(self.path) as pdf:
+            page_count = len(pdf.pages)
+            page_idxs = sorted(set(int(i * page_count / num_pages) for i in range(min(num_pages, page_count))))
+            num_chars = [len(pdf.pages[idx].chars) for idx in page_idxs]
+        mean_chars = sum(num_chars) / len(num_chars) if len(num_chars) > 0 else 0
+        return {
+            'probe_pages': [idx + 1 for idx in page_idxs],
+            'probe_chars': round(mean_chars, 1),
+            'image_only': mean_chars < min_chars
+        }
+
+    def iter_xpdf_pages(self, first_page=None, last_page=None, chunk_size=1 << 16, timeout=None):
+        '''
+            run pdftotext through a pipe and yield (page_id, text) as pages arrive;
+            pdftotext is killed and TimeoutError raised after timeout seconds
+        '''
+        cmd = [get_pdftotext_path(), '-table', '-enc', 'UTF-8']
+        if first_page is not None:
+            cmd.extend(['-f', str(first_page)])
+        if last_page is not None:
+            cmd.extend(['-l', str(last_page)])
+        cmd.extend([self.path, '-'])
+
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        timer = None
+        killed = []
+        if timeout is not None:
+            def kill():
+                killed.append(True)
+                proc.kill()
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+        reader = io.TextIOWrapper(proc.stdout, encoding='utf-8', errors='ignore')
+        page_id = first_page if first_page is not None else 1
+        buffer = []
+        try:
+            for chunk in iter(lambda: reader.read(chunk_size), ''):
+                parts = chunk.split('\x0c')
+                for part in parts[:-1]:
+                    buffer.append(part)
+                    yield page_id, ''.join(buffer)
+                    page_id += 1
+                    buffer = []
+                buffer.append(parts[-1])
+        finally:
+            reader.close()
+            proc.wait()
+            if timer is not None:
+                timer.cancel()
+        if len(killed) > 0:
+            raise TimeoutError('pdftotext killed after {}s for {}'.format(timeout, self.path))
+        # pdftotext ends every page with a form feed, anything left is a truncated page
+        tail = ''.join(buffer)
+        if len(tail.strip()) > 0:
+            yield page_id, tail
+        if proc.returncode != 0:
+            logger.warning('pdftotext exited with {} for {}'.format(proc.returncode, self.path))
+
+    def get_table_cache_path(self, page_id, flavor):
+        if self._md5 is None:
+            self._md5 = get_file_md5(self.path)
+        return os.path.join(cfg.DATA_PATH, cfg.TABLE_CACHE_DIR, self._md5,
+            '{}-{}-{}.json'.format(flavor, get_camelot_params_hash(flavor), page_id))
+
+    def load_cached_tables(self, page_id, flavor):
+        cache_path = self.get_table_cache_path(page_id, flavor)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except Exception as e:
+            logger.warning('Unable to load {}, {}'.format(cache_path, e))
+            return None
+        return [ParsedTable.from_json(item, page_id, flavor) for item in items]
+
+    def save_cached_tables(self, page_id, flavor, tables):
+        cache_path = self.get_table_cache_path(page_id, flavor)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([t.to_json() for t in tables], f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+
+    def read_camelot(self, page_ids, flavor='lattice'):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if not self.path.endswith('.pdf'):
+                temp_path = os.path.join(temp_dir, '{}.pdf'.format(os.path.basename(self.path)))
+                shutil.copy(self.path, temp_path)
+            else:
+                temp_path = self.path
+            tables = camelot.read_pdf(temp_path,
+                pages=','.join(map(str, page_ids)),
+                flavor=flavor, **CAMELOT_PARAMS[flavor])
+            return [ParsedTable.from_camelot(t, flavor) for t in tables]
+
+    def read_tables(self, page_ids, flavor='lattice'):
+        '''
+            one camelot pass with the settings used by extract_table_of_pages, errors are not caught;
+            pages found in the table cache are not parsed again
+        '''
+        page_ids = sorted(set(page_ids))
+        if not self.table_cache:
+            return self.read_camelot(page_ids, flavor)
+
+        page_tables = {}
+        for page_id in page_ids:
+            cached = self.load_cached_tables(page_id, flavor)
+            if cached is not None:
+                page_tables[page_id] = cached
+        missing_pages = [p for p in page_ids if p not in page_tables]
+        if len(missing_pages) > 0:
+            tables = self.read_camelot(missing_pages, flavor)
+            for page_id in missing_pages:
+                page_tables[page_id] = [t for t in tables if t.page == page_id]
+                self.save_cached_tables(page_id, flavor, page_tables[page_id])
+        return [t for page_id in page_ids for t in page_tables[page_id]]
+
+    @staticmethod
+    def count_chaos(tables):
+        '''
+            max number of dots in a cell, lattice mode merges whole columns of
+            numbers into one cell when a table has no inner lines
+        '''
+        num_chaos = 0
+        for table in tables:
+            for _, row in table.df.iterrows():
+                for v in row.values:
+                    point_num = list(v).count('.')
+                    num_chaos = max(point_num, num_chaos)
+        return num_chaos
 
-    def extract_table_of_pages(self, page_ids: list):
+    def extract_table_of_pages(self, page_ids: list, flavor='auto'):
         '''
             this method is slow
+            flavor: 'auto' tries lattice and falls back to stream, or force 'lattice'/'stream'
+            in 'auto' mode the decision is made per page, stream only re-parses the
+            pages where lattice finds no table or chaos tables
         '''
         if True:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                if not self.path.endswith('.pdf'):
-                    temp_path = os.path.join(temp_dir, '{}.pdf'.format(os.path.basename(self.path)))
-                    shutil.copy(self.path, temp_path)
+            page_ids = sorted(set(page_ids))
+            if flavor == 'stream':
+                self.page_decisions['stream'] += len(page_ids)
+                return self.read_tables(page_ids, 'stream')
+
+            tables = []
+            failed_pages = set()
+            try:
+                tables = self.read_tables(page_ids, 'lattice')
+            except IndexError:
+                # find the pages lattice fails on instead of giving up the whole range
+                if len(page_ids) > 1:
+                    for page_id in page_ids:
+                        try:
+                            tables.extend(self.read_tables([page_id], 'lattice'))
+                        except IndexError:
+                            failed_pages.add(page_id)
+                else:
+                    failed_pages = set(page_ids)
+            if flavor == 'lattice':
+                self.page_decisions['lattice'] += len(page_ids)
+                return tables
+
+            # check chaos tables
+            fallback_reasons = {}
+            for page_id in page_ids:
+                page_tables = [t for t in tables if t.page == page_id]
+                if page_id in failed_pages:
+                    fallback_reasons[page_id] = 'lattice_error'
+                elif len(page_tables) == 0:
+                    fallback_reasons[page_id] = 'empty'
+                elif self.count_chaos(page_tables) > 5:
+                    fallback_reasons[page_id] = 'chaos'
                 else:
-                    temp_path = self.path
-                try:
-                    tables = camelot.read_pdf(temp_path,
-                        strip_text='\n',
-                        pages=','.join(map(str, page_ids)),
-                        line_tol=6,
-                        line_scale=60)
-                except IndexError:
-                    tables = []
-                
-                # check chaos tables
-                num_chaos = 0
+                    self.page_decisions['lattice'] += 1
+            for reason in fallback_reasons.values():
+                self.page_decisions['stream:{}'.format(reason)] += 1
+
+            if len(fallback_reasons) > 0:
+                stream_tables = self.read_tables(list(fallback_reasons.keys()), 'stream')
+                for table in stream_tables:
+                    table.fallback_reason = fallback_reasons[table.page]
+                tables = [t for t in tables if t.page not in fallback_reasons] + stream_tables
+                tables = sorted(tables, key=lambda t: t.page)
+            if False:
                 for table in tables:
+                    print(table.page)
+                    import matplotlib.pyplot as plt
+                    camelot.plot(table, kind='grid').show()
+                    plt.show()
                     for _, row in table.df.iterrows():
-                        for v in row.values:
-                            point_num = list(v).count('.')
-                            num_chaos = max(point_num, num_chaos)
-                # print(num_chaos, '--')
-
-                if len(tables) == 0 or num_chaos > 5:
-                    tables = camelot.read_pdf(temp_path,
-                        pages=','.join(map(str, page_ids)),
-                        flavor='stream', edge_tol=100)
-                if False:
-                    for table in tables:
-                        print(table.page)
-                        import matplotlib.pyplot as plt
-                        camelot.plot(table, kind='grid').show()
-                        plt.show()
-                        for _, row in table.df.iterrows():
-                            print(row.values)
+                        print(row.values)
         else:
             
             tables = camelot.read_pdf(self.path,
@@ -113,22 +361,28 @@ class PdfExtractor(object):
         return tables
 
     def extract_table_of_pages_pdfplumber(self, page_ids: list):
+        '''
+            ruling line based tables from pdfplumber, no page rendering; bbox is
+            converted to camelot's bottom-left origin so both engines sort the same
+        '''
         pdf = pdfplumber.open(self.path)
         
         tables = []
-        for i, page in enumerate(pdf.pages):
-            if page.page_number not in page_ids:
+        for page_id in sorted(set(page_ids)):
+            if page_id < 1 or page_id > len(pdf.pages):
                 continue
+            raw_page = pdf.pages[page_id-1]
+            height = raw_page.height
 
-            page = page.filter(self.keep_visible_lines)
+            page = raw_page.filter(self.keep_visible_lines)
             
             edges = self.curves_to_edges(page.curves + page.edges)
             if len(edges) > 0:
                 table_settings = {
                     "vertical_strategy": "explicit",
                     "horizontal_strategy": "explicit",
-                    "explicit_vertical_lines": self.curves_to_edges(page.curves + page.edges),
-                    "explicit_horizontal_lines": self.curves_to_edges(page.curves + page.edges),
+                    "explicit_vertical_lines": edges,
+                    "explicit_horizontal_lines": edges,
                     "intersection_y_tolerance": 3,
                     'snap_tolerance': 3,
                 }
@@ -141,12 +395,29 @@ class PdfExtractor(object):
             
             # Get the bounding boxes of the tables on the page.
             plumber_tables = page.find_tables(table_settings=table_settings)
-            tables.extend([self.get_text(t) for t in plumber_tables])
-
-        for table in tables:
-            print(table)
+            for plumber_table in plumber_tables:
+                rows = plumber_table.extract()
+                rows = [[(t or '').replace('\n', '') for t in row] for row in rows]
+                if len(rows) == 0:
+                    continue
+                x0, top, x1, bottom = plumber_table.bbox
+                tables.append(ParsedTable(pd.DataFrame(rows), page_id,
+                    (x0, height-bottom, x1, height-top), 'pdfplumber'))
+            raw_page.flush_cache()
+        pdf.close()
+        self.page_decisions['pdfplumber'] += len(set(page_ids))
 
         return tables
+
+    def extract_tables(self, page_ids, engine='camelot'):
+        '''
+            engine: 'camelot' or 'pdfplumber'
+        '''
+        if engine == 'pdfplumber':
+            return self.extract_table_of_pages_pdfplumber(page_ids)
+        if engine == 'camelot':
+            return self.extract_table_of_pages(page_ids)
+        raise ValueError('Unknown table engine {}'.format(engine))
         
 
     @staticmethod
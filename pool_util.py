@@ -0,0 +1,123 @@
+import time
+import resource
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+from loguru import logger
+
+
+def limit_worker_memory(limit_mb):
+    '''
+        pool initializer, allocations beyond limit_mb raise MemoryError in the
+        worker instead of getting the whole machine OOM killed
+    '''
+    if limit_mb is None:
+        return
+    limit = int(limit_mb) * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ValueError, OSError) as e:
+        logger.warning('Unable to limit worker memory to {}MB, {}'.format(limit_mb, e))
+
+
+def get_peak_rss_mb(children=False):
+    '''
+        peak RSS of this process, or with children of its largest waited for
+        subprocess (e.g. pdftotext); ru_maxrss is in KB on linux
+    '''
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _watched_worker(func, task, conn, memory_limit_mb):
+    limit_worker_memory(memory_limit_mb)
+    try:
+        result = func(task)
+        conn.send(('ok', result))
+    except MemoryError as e:
+        conn.send(('memory', 'MemoryError: {}'.format(e)))
+    except Exception as e:
+        conn.send(('error', '{}: {}'.format(type(e).__name__, e)))
+    finally:
+        conn.close()
+
+
+def watch_tasks(func, tasks, processes, timeout=None, memory_limit_mb=None, retry_func=None, prepare_task=None):
+    '''
+        run func(task) for every task in a forked worker of its own, at most
+        `processes` at a time, and yield (task, result, failure) as tasks finish.
+        A worker running longer than timeout seconds is killed, memory is capped
+        with limit_worker_memory, and a failed task is tried once more with
+        retry_func (e.g. an alternate engine) when given.
+        prepare_task(task), when given, runs in the parent right before a task is
+        started and its result is what the worker receives, so arguments can
+        depend on the results yielded so far.
+        failure is None on success, otherwise {'reason', 'elapsed', 'attempts'}
+    '''
+    ctx = multiprocessing.get_context('fork')
+    pending = deque([(task, func, 1, 0.0, []) for task in tasks])
+    running = {}
+
+    def finish(task, attempt_func, attempt, elapsed, reasons, status, value):
+        if status == 'ok':
+            return [(task, value, None)]
+        reason = '{}: {}'.format(status, value) if status != 'timeout' else 'timeout after {}s'.format(timeout)
+        reasons = reasons + ['{}: {}'.format(attempt_func.__name__, reason)]
+        if attempt == 1 and retry_func is not None:
+            logger.warning('Task {} failed ({}), retry with {}'.format(task, reason, retry_func.__name__))
+            pending.append((task, retry_func, attempt + 1, elapsed, reasons))
+            return []
+        logger.error('Task {} failed ({})'.format(task, reason))
+        return [(task, None, {'reason': '; '.join(reasons), 'elapsed': round(elapsed, 3), 'attempts': attempt})]
+
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < processes:
+                task, attempt_func, attempt, elapsed, reasons = pending.popleft()
+                recv_conn, send_conn = ctx.Pipe(duplex=False)
+                process = ctx.Process(target=_watched_worker,
+                    args=(attempt_func, task if prepare_task is None else prepare_task(task),
+                        send_conn, memory_limit_mb), daemon=True)
+                process.start()
+                send_conn.close()
+                running[recv_conn] = (process, task, attempt_func, attempt, elapsed, reasons, time.time())
+
+            wait_timeout = None
+            if timeout is not None:
+                first_deadline = min([item[-1] for item in running.values()]) + timeout
+                wait_timeout = max(0, first_deadline - time.time())
+            finished = []
+            for conn in wait(list(running.keys()), timeout=wait_timeout):
+                process, task, attempt_func, attempt, elapsed, reasons, start = running.pop(conn)
+                try:
+                    status, value = conn.recv()
+                except EOFError:
+                    status, value = None, None
+                conn.close()
+                process.join()
+                if status is None:
+                    status, value = 'crash', 'worker exited with code {}'.format(process.exitcode)
+                finished.extend(finish(task, attempt_func, attempt, elapsed + time.time() - start, reasons, status, value))
+
+            if timeout is not None:
+                now = time.time()
+                for conn, (process, task, attempt_func, attempt, elapsed, reasons, start) in list(running.items()):
+                    if now - start < timeout:
+                        continue
+                    running.pop(conn)
+                    process.kill()
+                    process.join()
+                    conn.close()
+                    finished.extend(finish(task, attempt_func, attempt, elapsed + now - start, reasons, 'timeout', None))
+
+            for item in finished:
+                yield item
+    finally:
+        for conn, item in running.items():
+            item[0].kill()
+            item[0].join()
+            conn.close()
+
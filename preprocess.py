@@ -1,34 +1,269 @@
 import os
 import json
+import time
 import shutil
+import threading
+import pdfplumber
+import numpy as np
+from functools import partial
+from datetime import datetime
+from collections import Counter
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from loguru import logger
 from config import cfg
-from file import load_pdf_info
-from pdf_util import PdfExtractor
-from financial_state import (extract_basic_info, extract_employee_info,
-    extract_cbs_info, extract_cscf_info, extract_cis_info, extract_dev_info, merge_info)
+from file import load_pdf_info, get_pdf_text_path, get_file_md5, get_pdf_page_count
+from file import load_json_manifest, save_json_manifest
+from file import build_pdf_page_store, get_pdf_page_store_path
+from file import get_alltxt_path, build_alltxt_page_store
+from pdf_util import PdfExtractor, PURE_CONTENT_VERSION, get_pdftotext_path
+from pdf2txt import PDFProcessor
+from file import update_failures, get_unit, get_image_only_keys
+from file import load_total_tables, report_to_rows, save_missing_units
+from pool_util import watch_tasks
+from financial_state import SECTIONS, extract_all_info, extract_all_info_fallback, merge_info
+from financial_state import load_section_hints, update_section_hints
+from financial_state import parse_sections, save_sections, tables_to_text, get_alternate_engine
+from check import statement_rows, check_statements
+from table_store import text_to_lines
+from row_store import get_row_store
+from report_registry import get_report_registry
 
 
 def setup_xpdf():
-    os.chdir(cfg.XPDF_PATH)
-    cmd = 'chmod +x pdftotext'
-    os.system(cmd)
+    pdftotext_path = get_pdftotext_path()
+    if not os.path.exists(pdftotext_path):
+        logger.warning('pdftotext not exists: {}'.format(pdftotext_path))
+        return
+    os.chmod(pdftotext_path, os.stat(pdftotext_path).st_mode | 0o111)
 
 
-def extract_pure_content(idx, key, pdf_path):
-    logger.info('Extract text for {}:{}'.format(idx, key))
+def extract_pure_content(idx, key, pdf_path, first_page=None, last_page=None, save_path=None, use_xpdf=True):
+    '''
+        extract the whole report, or only pages [first_page, last_page] into save_path;
+        pdftotext is killed after cfg.REPORT_TIMEOUT seconds
+    '''
+    if first_page is None:
+        logger.info('Extract text for {}:{}'.format(idx, key))
+    else:
+        logger.info('Extract text for {}:{} pages {}-{}'.format(idx, key, first_page, last_page))
     save_dir = os.path.join(cfg.DATA_PATH, cfg.PDF_TEXT_DIR)
     key_dir = os.path.join(save_dir, key)
     if not os.path.exists(key_dir):
-        os.mkdir(key_dir)
-    save_path = os.path.join(key_dir, 'pure_content.txt')
+        os.makedirs(key_dir, exist_ok=True)
+    if save_path is None:
+        save_path = os.path.join(key_dir, 'pure_content.txt')
     if os.path.exists(save_path):
         os.remove(save_path)
-    PdfExtractor(pdf_path).extract_pure_content_and_save(save_path)
+    if first_page is None:
+        expected_pages = get_pdf_page_count(key)
+    else:
+        expected_pages = last_page - first_page + 1
+    PdfExtractor(pdf_path).extract_pure_content_and_save(save_path, use_xpdf=use_xpdf,
+        expected_pages=expected_pages, first_page=first_page, last_page=last_page,
+        timeout=cfg.REPORT_TIMEOUT)
 
 
-def extract_pdf_text(extract_func=extract_pure_content):
+def read_pdf_meta(key, pdf_path, entry):
+    try:
+        pdf_stat = os.stat(pdf_path)
+    except OSError as e:
+        logger.error('Unable to read {}, {}'.format(pdf_path, e))
+        return key, None
+    if entry is not None and entry.get('size') == pdf_stat.st_size and entry.get('mtime') == pdf_stat.st_mtime \
+            and 'image_only' in entry:
+        return key, entry
+
+    try:
+        meta = PdfExtractor(pdf_path).read_metadata()
+        meta.update(probe_text_layer(pdf_path, meta))
+    except Exception as e:
+        logger.error('Unable to parse {}, {}'.format(pdf_path, e))
+        meta = {'page_count': None, 'error': str(e)}
+    meta.update({
+        'size': pdf_stat.st_size,
+        'mtime': pdf_stat.st_mtime,
+        'md5': get_file_md5(pdf_path)
+    })
+    return key, meta
+
+
+def probe_text_layer(pdf_path, meta=None):
+    '''
+        meta: pages_metadata of the report, a report without any font page is
+        image only without opening its pages
+    '''
+    if meta is not None and not meta['has_text_layer']:
+        return {'probe_pages': [], 'probe_chars': 0, 'image_only': True}
+    return PdfExtractor(pdf_path).probe_text_layer()
+
+
+def probe_report(key, pdf_path):
+    try:
+        return key, probe_text_layer(pdf_path)
+    except Exception as e:
+        logger.error('Unable to probe {}, {}'.format(pdf_path, e))
+        return key, None
+
+
+def update_ocr_queue(pdf_info, meta_index):
+    '''
+        image only reports, kept for an optional offline OCR pass
+    '''
+    queue = load_json_manifest(cfg.OCR_QUEUE)
+    new_queue = {}
+    for key, meta in meta_index.items():
+        if key not in pdf_info or not meta.get('image_only', False):
+            continue
+        new_queue[key] = queue.get(key, {
+            'pdf_path': pdf_info[key]['pdf_path'],
+            'page_count': meta.get('page_count'),
+            'probe_chars': meta.get('probe_chars'),
+            'queued_at': datetime.now().isoformat(timespec='seconds')
+        })
+    save_json_manifest(cfg.OCR_QUEUE, new_queue)
+    return new_queue
+
+
+def build_pdf_meta_index(incremental=True):
+    '''
+        page count, text layer presence, size and hash of every report,
+        saved next to pdf_info.json
+    '''
+    pdf_info = load_pdf_info()
+    meta_index = load_json_manifest(cfg.PDF_META_INDEX) if incremental else {}
+
+    tasks = [(k, v['pdf_path'], meta_index.get(k)) for k, v in pdf_info.items()]
+    with Pool(processes=cfg.NUM_PROCESSES) as pool:
+        results = pool.starmap(read_pdf_meta, tasks)
+
+    meta_index = {key: meta for key, meta in results if meta is not None}
+    save_json_manifest(cfg.PDF_META_INDEX, meta_index)
+    ocr_queue = update_ocr_queue(pdf_info, meta_index)
+
+    num_no_text = len([m for m in meta_index.values() if not m.get('has_text_layer', False)])
+    logger.info('Indexed {} of {} reports, {} without text layer, {} image only'.format(
+        len(meta_index), len(pdf_info), num_no_text, len(ocr_queue)))
+
+
+def is_pure_content_up_to_date(pdf_path, save_path, entry, pdf_stat):
+    '''
+        returns (up_to_date, pdf_md5), pdf_md5 is None if it was not computed
+    '''
+    if entry is None or entry.get('version') != PURE_CONTENT_VERSION:
+        return False, None
+    if not os.path.exists(save_path):
+        return False, None
+    pdf_md5 = None
+    if entry['size'] != pdf_stat.st_size or entry['mtime'] != pdf_stat.st_mtime:
+        # touched or copied, only the content hash tells whether it changed
+        pdf_md5 = get_file_md5(pdf_path)
+        if pdf_md5 != entry['md5']:
+            return False, pdf_md5
+    if get_file_md5(save_path) != entry['output_md5']:
+        return False, pdf_md5
+    return True, pdf_md5
+
+
+def check_pure_content(key, pdf_path, entry):
+    '''
+        returns (key, status, entry), status is 'skipped', 'stale' or 'failed';
+        for stale reports entry holds the fingerprint of the current pdf
+    '''
+    save_path = get_pdf_text_path(key)
+    try:
+        pdf_stat = os.stat(pdf_path)
+        up_to_date, pdf_md5 = is_pure_content_up_to_date(pdf_path, save_path, entry, pdf_stat)
+        if up_to_date:
+            return key, 'skipped', dict(entry, size=pdf_stat.st_size, mtime=pdf_stat.st_mtime)
+        if pdf_md5 is None:
+            pdf_md5 = get_file_md5(pdf_path)
+    except OSError as e:
+        logger.error('Unable to read {}, {}'.format(pdf_path, e))
+        return key, 'failed', None
+
+    entry = {
+        'size': pdf_stat.st_size,
+        'mtime': pdf_stat.st_mtime,
+        'md5': pdf_md5,
+        'version': PURE_CONTENT_VERSION
+    }
+    return key, 'stale', entry
+
+
+def split_page_ranges(page_count, shard_pages=cfg.SHARD_PAGES):
+    if page_count is None or page_count <= shard_pages:
+        return [(None, None)]
+    return [(first, min(first + shard_pages - 1, page_count)) \
+        for first in range(1, page_count + 1, shard_pages)]
+
+
+def get_pure_content_part_path(key, first_page, last_page):
+    return '{}.{}-{}.part'.format(get_pdf_text_path(key), first_page, last_page)
+
+
+def extract_text_task(task):
+    '''
+        returns (key, first_page, error reason or None, elapsed seconds)
+    '''
+    idx, key, pdf_path, first_page, last_page, save_path, extract_func = task
+    start = time.time()
+    try:
+        extract_func(idx, key, pdf_path, first_page, last_page, save_path)
+    except Exception as e:
+        logger.error('Extract text failed for {} pages {}-{}, {}'.format(key, first_page, last_page, e))
+        return key, first_page, '{}: {}'.format(type(e).__name__, e), time.time() - start
+    if not os.path.exists(save_path) or os.path.getsize(save_path) == 0:
+        return key, first_page, 'empty output', time.time() - start
+    return key, first_page, None, time.time() - start
+
+
+def stitch_pure_content(key, part_paths):
+    save_path = get_pdf_text_path(key)
+    tmp_path = save_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        for part_path in part_paths:
+            with open(part_path, 'rb') as f:
+                shutil.copyfileobj(f, out)
+    os.replace(tmp_path, save_path)
+    for part_path in part_paths:
+        os.remove(part_path)
+
+
+def extract_pure_content_sharded(idx, key, pdf_path):
+    '''
+        extract_pure_content of a whole report; reports longer than cfg.SHARD_PAGES
+        are split into page ranges that run side by side (pdftotext is a subprocess)
+        and are stitched like extract_pdf_text does
+    '''
+    page_ranges = split_page_ranges(get_pdf_page_count(key))
+    if len(page_ranges) == 1:
+        extract_pure_content(idx, key, pdf_path)
+        return
+    part_paths = [get_pure_content_part_path(key, first_page, last_page) for first_page, last_page in page_ranges]
+    tasks = [(idx, key, pdf_path, first_page, last_page, part_path, extract_pure_content) \
+        for (first_page, last_page), part_path in zip(page_ranges, part_paths)]
+    with ThreadPool(processes=len(tasks)) as pool:
+        results = pool.map(extract_text_task, tasks)
+    errors = ['pages from {}: {}'.format(first_page, error) for _, first_page, error, _ in results if error is not None]
+    if len(errors) > 0:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        raise RuntimeError('; '.join(errors))
+    stitch_pure_content(key, part_paths)
+
+
+def extract_pdf_text(extract_func=extract_pure_content, incremental=True, use_threads=True):
+    '''
+        xpdf runs as a subprocess, so the work is mostly I/O bound and a
+        thread pool (use_threads=True) avoids forking heavy worker processes.
+        Reports longer than cfg.SHARD_PAGES are split into page ranges, and all
+        tasks run longest first so a few huge reports do not become stragglers.
+        Failed page ranges are retried once with pdfplumber text in watched workers
+        (cfg.REPORT_TIMEOUT, cfg.WORKER_MEMORY_LIMIT_MB), reports still failing or
+        killed are recorded under 'text' in the failure manifest.
+    '''
     setup_xpdf()
 
     save_dir = os.path.join(cfg.DATA_PATH, cfg.PDF_TEXT_DIR)
@@ -36,36 +271,436 @@ def extract_pdf_text(extract_func=extract_pure_content):
        os.mkdir(save_dir)
 
     pdf_info = load_pdf_info()
+    manifest = load_json_manifest(cfg.PURE_CONTENT_MANIFEST)
+    image_only_keys = get_image_only_keys()
+    pdf_info = dict((k, v) for k, v in pdf_info.items() if k not in image_only_keys)
+
+    pool_cls = ThreadPool if use_threads else Pool
+    with pool_cls(processes=cfg.NUM_PROCESSES) as pool:
+        checks = pool.starmap(check_pure_content,
+            [(k, v['pdf_path'], manifest.get(k) if incremental else None) for k, v in pdf_info.items()])
+
+        status_count = Counter()
+        stale_entries = {}
+        for key, status, entry in checks:
+            if status == 'stale':
+                stale_entries[key] = entry
+                continue
+            status_count[status] += 1
+            if entry is None:
+                manifest.pop(key, None)
+            else:
+                manifest[key] = entry
 
+        tasks = []
+        key_parts = {}
+        for idx, key in enumerate(pdf_info.keys()):
+            if key not in stale_entries:
+                continue
+            page_count = get_pdf_page_count(key)
+            page_ranges = split_page_ranges(page_count)
+            key_parts[key] = {}
+            for first_page, last_page in page_ranges:
+                if len(page_ranges) == 1:
+                    save_path = get_pdf_text_path(key)
+                    num_pages = page_count or 0
+                else:
+                    save_path = get_pure_content_part_path(key, first_page, last_page)
+                    num_pages = last_page - first_page + 1
+                key_parts[key][first_page] = save_path
+                tasks.append((num_pages, (idx, key, pdf_info[key]['pdf_path'],
+                    first_page, last_page, save_path, extract_func)))
+        tasks = [task for _, task in sorted(tasks, key=lambda t: t[0], reverse=True)]
+
+        errors = {}
+        for key, first_page, error, elapsed in pool.imap_unordered(extract_text_task, tasks):
+            if error is not None:
+                errors[(key, first_page)] = (error, elapsed)
+
+    # one retry of the failed page ranges without pdftotext; pdfplumber is where
+    # reports hang or blow up memory, so the retry runs in watched workers
+    retry_tasks = [task[:-1] + (partial(task[-1], use_xpdf=False),) \
+        for task in tasks if (task[1], task[3]) in errors]
+    results = watch_tasks(extract_text_task, retry_tasks, cfg.NUM_PROCESSES, timeout=cfg.REPORT_TIMEOUT,
+        memory_limit_mb=cfg.WORKER_MEMORY_LIMIT_MB)
+    for task, result, failure in results:
+        if failure is None:
+            key, first_page, error, elapsed = result
+        else:
+            key, first_page, error, elapsed = task[1], task[3], failure['reason'], failure['elapsed']
+        if error is None:
+            errors.pop((key, first_page))
+            continue
+        first_error, first_elapsed = errors[(key, first_page)]
+        errors[(key, first_page)] = ('{}; retry: {}'.format(first_error, error), first_elapsed + elapsed)
+
+    failures = {}
+    for (key, first_page), (error, elapsed) in errors.items():
+        reason = error if first_page is None else 'pages from {}: {}'.format(first_page, error)
+        if key in failures:
+            reason = failures[key]['reason'] + '; ' + reason
+            elapsed += failures[key]['elapsed']
+        failures[key] = {'reason': reason, 'elapsed': round(elapsed, 3)}
+    failed_keys = set(failures)
+
+    for key, entry in stale_entries.items():
+        parts = key_parts[key]
+        part_paths = [parts[first_page] for first_page in sorted(parts, key=lambda p: p or 0)]
+        if key in failed_keys:
+            status_count['failed'] += 1
+            manifest.pop(key, None)
+            for part_path in part_paths:
+                if part_path != get_pdf_text_path(key) and os.path.exists(part_path):
+                    os.remove(part_path)
+            continue
+        if len(part_paths) > 1:
+            stitch_pure_content(key, part_paths)
+        entry['output_md5'] = get_file_md5(get_pdf_text_path(key))
+        manifest[key] = entry
+        status_count['extracted'] += 1
+    save_json_manifest(cfg.PURE_CONTENT_MANIFEST, manifest)
+    update_failures('text', failures, [k for k in stale_entries if k not in failed_keys])
+
+    store_keys = [k for k in pdf_info.keys() if k in manifest and \
+        (k in stale_entries or not os.path.exists(get_pdf_page_store_path(k)))]
     with Pool(processes=cfg.NUM_PROCESSES) as pool:
-        results = pool.starmap(extract_func, [(i, k, v['pdf_path']) for i, (k, v) in enumerate(pdf_info.items())])
+        pool.map(build_pdf_page_store, store_keys)
+
+    logger.info('Extract text finished, {} skipped, {} extracted, {} failed'.format(
+        status_count['skipped'], status_count['extracted'], status_count['failed']))
+    return dict(status_count)
+
+
+def ingest_report(idx, key, pdf_path):
+    '''
+        produce pure_content, alltxt and page metadata of one report while opening it
+        once: pdftotext streams in a background thread (it is a subprocess), page
+        range shards side by side for long reports, and a single pdfplumber document
+        serves both the metadata and PDFProcessor.
+        returns (key, meta, text error, alltxt error, elapsed seconds)
+    '''
+    logger.info('Ingest {}:{}'.format(idx, key))
+    start = time.time()
+    os.makedirs(os.path.dirname(get_pdf_text_path(key)), exist_ok=True)
+    os.makedirs(os.path.dirname(get_alltxt_path(key)), exist_ok=True)
+
+    text_errors = []
+    def extract_text():
+        try:
+            extract_pure_content_sharded(idx, key, pdf_path)
+        except Exception as e:
+            text_errors.append(e)
+    text_thread = threading.Thread(target=extract_text)
+    text_thread.start()
+
+    meta = None
+    alltxt_error = None
+    alltxt_path = get_alltxt_path(key)
+    tmp_path = alltxt_path + '.tmp'
+    try:
+        pdf = pdfplumber.open(pdf_path)
+        try:
+            meta = PdfExtractor.pages_metadata([page.page_obj for page in pdf.pages])
+            processor = PDFProcessor(pdf_path, pdf=pdf, stream_path=tmp_path)
+            processor.process_pdf()
+            meta['text_chars'] = processor.num_chars
+        finally:
+            pdf.close()
+        os.replace(tmp_path, alltxt_path)
+        build_alltxt_page_store(key)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        alltxt_error = '{}: {}'.format(type(e).__name__, e)
+        logger.error('Ingest alltxt of {} failed, {}'.format(key, alltxt_error))
+    text_thread.join()
+
+    text_error = None
+    text_path = get_pdf_text_path(key)
+    if len(text_errors) > 0:
+        text_error = '{}: {}'.format(type(text_errors[0]).__name__, text_errors[0])
+    elif not os.path.exists(text_path) or os.path.getsize(text_path) == 0:
+        text_error = 'empty output'
+    else:
+        build_pdf_page_store(key)
+    if text_error is not None:
+        logger.error('Ingest text of {} failed, {}'.format(key, text_error))
+    return key, meta, text_error, alltxt_error, time.time() - start
+
+
+def _ingest_report(args):
+    return ingest_report(*args)
+
+
+def ingest_pdfs(incremental=True, processes=cfg.NUM_PROCESSES):
+    '''
+        one pass over every report that writes pure_content.txt, alltxt and the page
+        metadata index, keeping the manifests of extract_pdf_text and process_all_pdfs
+        up to date so either stage can still run on its own.
+        Every report runs in a watched worker: one stuck past cfg.REPORT_TIMEOUT or
+        over cfg.WORKER_MEMORY_LIMIT_MB is killed and recorded in the failure manifest.
+        Reports the text layer probe tags image_only are only queued in cfg.OCR_QUEUE
+    '''
+    setup_xpdf()
+    pdf_info = load_pdf_info()
+    text_manifest = load_json_manifest(cfg.PURE_CONTENT_MANIFEST)
+    alltxt_manifest = load_json_manifest(cfg.ALLTXT_MANIFEST)
+    meta_index = load_json_manifest(cfg.PDF_META_INDEX)
+
+    with ThreadPool(processes=processes) as pool:
+        checks = pool.starmap(check_pure_content,
+            [(k, v['pdf_path'], text_manifest.get(k) if incremental else None) for k, v in pdf_info.items()])
+
+    # a few sampled pages tell image only reports apart before any heavy work
+    probe_keys = [key for key, status, _ in checks \
+        if status != 'failed' and 'image_only' not in meta_index.get(key, {})]
+    with Pool(processes=processes) as pool:
+        probes = pool.starmap(probe_report, [(k, pdf_info[k]['pdf_path']) for k in probe_keys])
+    for key, probe in probes:
+        if probe is not None:
+            meta_index[key] = dict(meta_index.get(key, {}), **probe)
+
+    status_count = Counter()
+    fingerprints = {}
+    tasks = []
+    for idx, (key, status, entry) in enumerate(checks):
+        alltxt_done = alltxt_manifest.get(key, {}).get('status') == 'done' and \
+            os.path.exists(get_alltxt_path(key))
+        if status == 'skipped' and alltxt_done:
+            status_count['skipped'] += 1
+            text_manifest[key] = entry
+            continue
+        if status == 'failed':
+            status_count['failed'] += 1
+            continue
+        if meta_index.get(key, {}).get('image_only', False):
+            status_count['image_only'] += 1
+            continue
+        if status == 'skipped':
+            entry = dict((k, v) for k, v in entry.items() if k != 'output_md5')
+        fingerprints[key] = entry
+        tasks.append((idx, key, pdf_info[key]['pdf_path']))
+    tasks = sorted(tasks, key=lambda t: get_pdf_page_count(t[1]) or 0, reverse=True)
+
+    text_failures = {}
+    alltxt_failures = {}
+    results = watch_tasks(_ingest_report, tasks, processes, timeout=cfg.REPORT_TIMEOUT,
+        memory_limit_mb=cfg.WORKER_MEMORY_LIMIT_MB)
+    for task, result, failure in results:
+        if failure is None:
+            key, meta, text_error, alltxt_error, elapsed = result
+        else:
+            # killed or crashed, nothing the worker wrote can be trusted
+            key, meta, elapsed = task[1], None, failure['elapsed']
+            text_error = alltxt_error = failure['reason']
+        entry = fingerprints[key]
+        alltxt_manifest[key] = {
+            'status': 'done' if alltxt_error is None else 'failed',
+            'elapsed': round(elapsed, 3),
+            'error': alltxt_error,
+            'finished_at': datetime.now().isoformat(timespec='seconds')
+        }
+        if meta is not None:
+            meta.update({'size': entry['size'], 'mtime': entry['mtime'], 'md5': entry['md5']})
+            meta_index[key] = dict(meta_index.get(key, {}), **meta)
+        if text_error is None:
+            text_manifest[key] = dict(entry, output_md5=get_file_md5(get_pdf_text_path(key)))
+        else:
+            text_manifest.pop(key, None)
+            text_failures[key] = {'reason': text_error, 'elapsed': round(elapsed, 3)}
+        if alltxt_error is not None:
+            alltxt_failures[key] = {'reason': alltxt_error, 'elapsed': round(elapsed, 3)}
+        if text_error is None and alltxt_error is None:
+            status_count['ingested'] += 1
+        else:
+            status_count['failed'] += 1
+
+    save_json_manifest(cfg.PURE_CONTENT_MANIFEST, text_manifest)
+    save_json_manifest(cfg.ALLTXT_MANIFEST, alltxt_manifest)
+    update_failures('text', text_failures, [k for k in fingerprints if k not in text_failures])
+    update_failures('alltxt', alltxt_failures, [k for k in fingerprints if k not in alltxt_failures])
+    save_json_manifest(cfg.PDF_META_INDEX, meta_index)
+    update_ocr_queue(pdf_info, meta_index)
+    logger.info('Ingest finished, {} skipped, {} ingested, {} failed, {} image only'.format(
+        status_count['skipped'], status_count['ingested'], status_count['failed'], status_count['image_only']))
+    return dict(status_count)
+
+
+def sort_keys_by_pages(keys):
+    '''
+        longest reports first, so they do not end up as stragglers
+    '''
+    return sorted(keys, key=lambda k: get_pdf_page_count(k) or 0, reverse=True)
+
+
+def _extract_all_info(args):
+    return extract_all_info(*args)
+
+
+def _extract_all_info_fallback(args):
+    return extract_all_info_fallback(*args)
+
+
+def log_hint_stats(report_results):
+    '''
+        report_results: [(hint outcomes of the report, elapsed seconds)]. The time
+        saved is only an estimate: the mean time of the reports searched without
+        hints minus that of the reports whose hints all hit, not the same reports
+        timed both ways
+    '''
+    hint_count = Counter([h for hints, _ in report_results for h in hints if h is not None])
+    num_hinted = hint_count['hit'] + hint_count['miss']
+    hit_seconds = [e for hints, e in report_results if len(hints) > 0 and set(hints) == set(['hit'])]
+    cold_seconds = [e for hints, e in report_results if set(hints) == set([None])]
+    saved = None
+    if len(hit_seconds) > 0 and len(cold_seconds) > 0:
+        saved = (np.mean(cold_seconds) - np.mean(hit_seconds)) * len(hit_seconds)
+    logger.info('Section hints: {} hits, {} misses, hit rate {}, {} reports all hit, '
+        'estimated {} seconds saved (unhinted vs hinted report means)'.format(
+        hint_count['hit'], hint_count['miss'],
+        '{:.1%}'.format(hint_count['hit'] / num_hinted) if num_hinted > 0 else 'n/a',
+        len(hit_seconds), '{:.1f}'.format(saved) if saved is not None else 'n/a'))
+    return {'hits': hint_count['hit'], 'misses': hint_count['miss'], 'estimated_seconds_saved': saved}
 
 
 def extract_pdf_tables():
+    '''
+        a report failing or running past cfg.REPORT_TIMEOUT is retried once with
+        cfg.FALLBACK_TABLE_ENGINE, reports failing both are recorded under 'tables'
+        in the failure manifest.
+        Sections are searched near where they were found in the company's earlier
+        reports first, the locations found are saved back as hints. Hints are
+        updated as every report finishes, and one report of every company is
+        scheduled before the others, so a first run already benefits from them
+    '''
     pdf_info = load_pdf_info()
-    pdf_keys = list(pdf_info.keys())
+    image_only_keys = get_image_only_keys()
+    pdf_keys = sort_keys_by_pages([k for k in pdf_info.keys() if k not in image_only_keys])
+    section_hints = load_section_hints()
 
-    # basic_info
-    with Pool(processes=cfg.NUM_PROCESSES) as pool:
-        results = pool.map(extract_basic_info, pdf_keys)
-    merge_info('basic_info')
-    # # employee_info
-    with Pool(processes=cfg.NUM_PROCESSES) as pool:
-        results = pool.map(extract_employee_info, pdf_keys)
-    merge_info('employee_info')
-    # cbs_info
-    with Pool(processes=cfg.NUM_PROCESSES) as pool:
-        results = pool.map(extract_cbs_info, pdf_keys)
-    merge_info('cbs_info')
-    # cscf_info
-    with Pool(processes=cfg.NUM_PROCESSES) as pool:
-        results = pool.map(extract_cscf_info, pdf_keys)
-    merge_info('cscf_info')
-    # cis_info
-    with Pool(processes=cfg.NUM_PROCESSES) as pool:
-        results = pool.map(extract_cis_info, pdf_keys)
-    merge_info('cis_info')
-    # dev_info
+    # the longest report of every company first, then the next of every company...
+    company_rank = Counter()
+    ranks = {}
+    for key in pdf_keys:
+        code = pdf_info[key].get('code')
+        ranks[key] = company_rank[code]
+        company_rank[code] += 1
+    pdf_keys = sorted(pdf_keys, key=lambda k: ranks[k])
+
+    def with_hints(key):
+        # resolved when the task starts, so it sees the reports finished so far
+        return key, section_hints.get(pdf_info[key].get('code'), {})
+
+    # all six sections of a report in one task, sharing the page text and camelot passes
+    failures = {}
+    report_results = []
+    results = watch_tasks(_extract_all_info, pdf_keys, cfg.NUM_PROCESSES, timeout=cfg.REPORT_TIMEOUT,
+        memory_limit_mb=cfg.WORKER_MEMORY_LIMIT_MB, retry_func=_extract_all_info_fallback,
+        prepare_task=with_hints)
+    for key, result, failure in results:
+        if failure is not None:
+            failures[key] = failure
+            continue
+        code = pdf_info[key].get('code')
+        if code is not None:
+            update_section_hints(section_hints, code, key, result['sections'])
+        report_results.append(([s['hint'] for s in result['sections'].values()], result['elapsed']))
+    save_json_manifest(cfg.SECTION_HINTS, section_hints)
+    update_failures('tables', failures, [k for k in pdf_keys if k not in failures])
+    logger.info('Extract tables finished, {} of {} reports failed'.format(len(failures), len(pdf_keys)))
+    log_hint_stats(report_results)
+
+    for table_name in SECTIONS.keys():
+        merge_info(table_name)
+
+
+def reextract_report(key, names):
+    '''
+        parse the queued sections again with their alternate table engine, the new
+        tables replace the stored ones only when they pass validation.
+        returns the reasons the new tables still fail
+    '''
+    section_tables = {}
+    for name in names:
+        section_tables.update(parse_sections(key, [name], get_alternate_engine(name)))
+    lines = {name: text_to_lines(tables_to_text(tables)) for name, tables in section_tables.items()}
+    records = [(key, name, line) for name in names for line in lines[name]]
+    units = {key: get_unit(key, lines['cbs_info'])} if 'cbs_info' in lines else None
+    checks = check_statements(statement_rows(records), units)
+    reasons = checks['reasons'][key] if key in checks.index else ['missing: 资产总计']
+    if len(reasons) == 0:
+        save_sections(key, section_tables)
+    return reasons
+
+
+def _reextract_report(args):
+    return reextract_report(*args)
+
+
+def reextract_queued_sections():
+    '''
+        re-extract only the reports and sections check.validate_statements queued,
+        each alternate engine is tried once per report
+    '''
+    queue = load_json_manifest(cfg.REEXTRACT_QUEUE)
+    tasks = []
+    for key, entry in queue.items():
+        engines = set(get_alternate_engine(name) for name in entry['sections'])
+        if not engines.issubset(entry['tried']):
+            tasks.append((key, entry['sections']))
+
+    num_fixed = 0
+    results = watch_tasks(_reextract_report, tasks, cfg.NUM_PROCESSES, timeout=cfg.REPORT_TIMEOUT,
+        memory_limit_mb=cfg.WORKER_MEMORY_LIMIT_MB)
+    for (key, names), reasons, failure in results:
+        entry = queue[key]
+        entry['tried'] = sorted(set(entry['tried'] + [get_alternate_engine(name) for name in names]))
+        if failure is not None:
+            entry['error'] = failure['reason']
+        elif len(reasons) == 0:
+            queue.pop(key)
+            num_fixed += 1
+        else:
+            entry['reasons'] = reasons
+    save_json_manifest(cfg.REEXTRACT_QUEUE, queue)
+    logger.info('Re-extracted {} reports, {} fixed, {} still queued'.format(len(tasks), num_fixed, len(queue)))
+    return num_fixed
+
+
+def report_rows_task(key, year, signature):
+    return key, year, signature, report_to_rows(key, year, load_total_tables())
+
+
+def _report_rows_task(args):
+    return report_rows_task(*args)
+
+
+def build_row_store(incremental=True):
+    '''
+        parse the tables of every report once into the normalized row store that
+        load_tables_of_years reads; only reports whose table store signature
+        changed since they were parsed are parsed again
+    '''
+    registry = get_report_registry()
+    table_store = load_total_tables()
+    row_store = get_row_store()
+    # units are part of the signatures, rows are never parsed with a unit the store lacks
+    save_missing_units(table_store)
+    signatures = table_store.get_report_signatures()
+    stored_signatures = row_store.get_signatures() if incremental else {}
+
+    tasks = []
+    for key, v in registry.items():
+        signature = signatures.get(key)
+        if key not in stored_signatures or stored_signatures[key] != signature:
+            tasks.append((key, v['year'].replace('年', '').replace(' ', ''), signature))
+    removed = [k for k in row_store.keys() if k not in registry]
+    row_store.delete(removed)
+
+    num_rows = 0
     with Pool(processes=cfg.NUM_PROCESSES) as pool:
-        results = pool.map(extract_dev_info, pdf_keys)
-    merge_info('dev_info')
+        for key, year, signature, rows in pool.imap_unordered(_report_rows_task, tasks):
+            row_store.put_report(key, registry.get(key)['company'], year, rows, signature)
+            num_rows += len(rows)
+    logger.info('Row store: {} reports parsed into {} rows, {} removed, {} unchanged'.format(
+        len(tasks), num_rows, len(removed), len(registry) - len(tasks)))
@@ -42,35 +42,17 @@ def get_years_of_question(question):
     return years
 
 
-def get_match_company_names(question, pdf_info):
+def get_match_company_names(question, registry):
     question = re.sub('[\(\)（）]', '', question)
+    return registry.match_report_names(question)
 
-    matched_companys = []
-    for k, v in pdf_info.items():
-        company = v['company']
-        abbr = v['abbr']
-        if company in question:
-            matched_companys.append(company)
-        if abbr in question:
-            matched_companys.append(abbr)
-    return matched_companys
 
-
-def get_match_pdf_names(question, pdf_info):
+def get_match_pdf_names(question, registry):
     def get_matching_substrs(a, b):
         return ''.join(set(a).intersection(b))
     
     years = get_years_of_question(question)
-    match_keys = []
-    for k, v in pdf_info.items():
-        company = v['company']
-        abbr = v['abbr']
-        year = v['year'].replace('年', '').replace(' ', '')
-        if company in question and year in years:
-            match_keys.append(k)
-        if abbr in question and year in years:
-            match_keys.append(k)
-    match_keys = list(set(match_keys))
+    match_keys = list(registry.match_reports(question, years))
     # The year has already been fully matched above, so remove it here.
     overlap_len = [len(get_matching_substrs(x, re.sub('\d?', '', question))) for x in match_keys]
     match_keys = sorted(zip(match_keys, overlap_len), key=lambda x: x[1], reverse=True)
@@ -89,10 +71,11 @@ def get_match_pdf_names(question, pdf_info):
     return match_keys
 
 
-def get_company_name_and_abbr_code_of_question(pdf_keys, pdf_info):
+def get_company_name_and_abbr_code_of_question(pdf_keys, registry):
     company_names = []
     for pdf_key in pdf_keys:
-        company_names.append((pdf_info[pdf_key]['company'], pdf_info[pdf_key]['abbr'], pdf_info[pdf_key]['code']))
+        item = registry.get(pdf_key)
+        company_names.append((item['company'], item['abbr'], item['code']))
     return company_names
 
 
@@ -51,6 +51,25 @@ def sep_numbers(line):
     return new_line
 
 
+UNIT_SCALES = [('百万', 1000000), ('万', 10000), ('千', 1000)]
+
+
+def detect_unit(lines):
+    '''
+        (unit, scale text, evidence line) of the first 单位/人民币 marker in lines,
+        (1, None, None) when there is none
+    '''
+    for line in lines:
+        re_unit = re.findall('单位\s*[:：；].{0,3}元', line) + re.findall('人民币.{0,3}元', line)
+        if len(re_unit) == 0:
+            continue
+        for scale, unit in UNIT_SCALES:
+            if scale in re_unit[0]:
+                return unit, re_unit[0], line.strip()
+        return 1, re_unit[0], line.strip()
+    return 1, None, None
+
+
 def is_header_footer(line):
     line = line.replace(' ', '')
     if re.findall('\d{4}年?年度报告', line):
@@ -0,0 +1,133 @@
+import os
+import json
+from config import cfg
+from keyword_util import KeywordAutomaton
+
+
+def normalize_year(year):
+    return year.replace('年', '').replace(' ', '')
+
+
+class ReportRegistry(object):
+    '''
+        every report of pdf_info.json with hash indexes by key, company,
+        (company, year), (abbr, year) and stock code; the index values are report keys in
+        pdf_info.json order, so the last one is the report a linear scan would
+        have picked last. Do not modify the items
+    '''
+
+    def __init__(self, pdf_info, mtime=None) -> None:
+        self.reports = pdf_info
+        self.mtime = mtime
+        self.by_company = {}
+        self.by_company_year = {}
+        self.by_abbr_year = {}
+        self.by_code = {}
+        self.by_name = {}
+        self.positions = {}
+        for key, v in pdf_info.items():
+            self.positions[key] = len(self.positions)
+            year = normalize_year(v['year'])
+            self.by_company.setdefault(v['company'], []).append(key)
+            self.by_company_year.setdefault((v['company'], year), []).append(key)
+            self.by_abbr_year.setdefault((v['abbr'], year), []).append(key)
+            self.by_code.setdefault(v['code'], []).append(key)
+            for name in [v['company'], v['abbr']]:
+                self.by_name.setdefault(name, []).append(key)
+        self._automaton = None
+
+    @classmethod
+    def load(cls, path):
+        mtime = os.path.getmtime(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), mtime)
+
+    def __contains__(self, key):
+        return key in self.reports
+
+    def __len__(self):
+        return len(self.reports)
+
+    def get(self, key):
+        return self.reports[key]
+
+    def keys(self):
+        return self.reports.keys()
+
+    def items(self):
+        return self.reports.items()
+
+    def get_pdf_path(self, key):
+        return self.reports[key]['pdf_path']
+
+    def keys_of_company_year(self, company, year):
+        return self.by_company_year.get((company, normalize_year(year)), [])
+
+    def keys_of_abbr_year(self, abbr, year):
+        return self.by_abbr_year.get((abbr, normalize_year(year)), [])
+
+    def keys_of_code(self, code):
+        return self.by_code.get(code, [])
+
+    def find(self, company, year):
+        '''
+            key of the last report of company whose year field contains year,
+            like year in v['year'] of a scan over pdf_info.json; None if there is none
+        '''
+        keys = [key for key in self.by_company.get(company, []) if year in self.reports[key]['year']]
+        return keys[-1] if len(keys) > 0 else None
+
+    def match_names(self, text):
+        '''
+            company names and abbrs occurring in text, found in one pass; an empty
+            name occurs in every text, like '' in text
+        '''
+        if self._automaton is None:
+            self._automaton = KeywordAutomaton([name for name in self.by_name.keys() if len(name) > 0])
+        names = set(self._automaton.keywords[idx] for idx in self._automaton.search(text))
+        if '' in self.by_name:
+            names.add('')
+        return names
+
+    def match_report_names(self, text):
+        '''
+            [company or abbr] occurring in text, once per report and in the order
+            of a scan over pdf_info.json (company before abbr of a report)
+        '''
+        matched = []
+        for name in self.match_names(text):
+            for key in self.by_name[name]:
+                v = self.reports[key]
+                if v['company'] == name:
+                    matched.append((self.positions[key], 0, name))
+                if v['abbr'] == name:
+                    matched.append((self.positions[key], 1, name))
+        return [name for _, _, name in sorted(set(matched))]
+
+    def match_reports(self, text, years):
+        '''
+            keys of the reports of years whose company or abbr occurs in text
+        '''
+        years = set(normalize_year(year) for year in years)
+        keys = set()
+        for name in self.match_names(text):
+            for key in self.by_name[name]:
+                if normalize_year(self.reports[key]['year']) in years:
+                    keys.add(key)
+        return keys
+
+
+_registry = {'path': None, 'registry': None}
+
+
+def get_report_registry():
+    '''
+        the process-wide ReportRegistry of cfg.DATA_PATH, reloaded when
+        pdf_info.json changes
+    '''
+    path = os.path.join(cfg.DATA_PATH, 'pdf_info.json')
+    registry = _registry['registry']
+    if registry is None or _registry['path'] != path or registry.mtime != os.path.getmtime(path):
+        _registry['registry'] = ReportRegistry.load(path)
+        _registry['path'] = path
+    return _registry['registry']
@@ -0,0 +1,116 @@
+import os
+import re
+import sqlite3
+from config import cfg
+
+
+def row_value_to_number(text_value):
+    '''
+        numeric value of a row value like '1234.00元' or '167人', None for text
+    '''
+    match = re.fullmatch('(-?\d+(\.\d+)?)[元人]?', text_value)
+    return float(match.group(1)) if match is not None else None
+
+
+class RowStore(object):
+    '''
+        normalized rows of every report in one SQLite file: (report key, company,
+        report year, table, row year, canonical row name, numeric value, unit,
+        text value, source page), in the order the row parsers produced them.
+        Every report remembers the table store signature of the tables its rows
+        were parsed from, rows of a report whose tables changed since are stale
+    '''
+
+    def __init__(self, path=None) -> None:
+        self.path = path or os.path.join(cfg.DATA_PATH, cfg.ROW_STORE)
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # a connection must not cross a fork, every worker opens its own
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._pid = os.getpid()
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS reports (
+                report_key TEXT PRIMARY KEY,
+                company TEXT,
+                year TEXT,
+                signature TEXT)''')
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(reports)')]
+            if 'signature' not in columns:
+                # stores written before signatures were tracked, all of them stale
+                self._conn.execute('ALTER TABLE reports ADD COLUMN signature TEXT')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS rows (
+                report_key TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                company TEXT,
+                year TEXT,
+                table_name TEXT NOT NULL,
+                row_year TEXT NOT NULL,
+                row_name TEXT NOT NULL,
+                value REAL,
+                unit INTEGER,
+                text_value TEXT NOT NULL,
+                page INTEGER,
+                PRIMARY KEY (report_key, position))''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS rows_company_year ON rows (company, year)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS rows_row_name ON rows (row_name)')
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def put_report(self, key, company, year, rows, signature):
+        '''
+            rows: [(table name, row year, row name, text value, unit, page)] of one
+            report, replacing the rows stored for it; signature: table store
+            signature of the tables they were parsed from
+        '''
+        with self.conn:
+            self.conn.execute('DELETE FROM rows WHERE report_key = ?', (key,))
+            self.conn.execute('INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)', (key, company, year, signature))
+            self.conn.executemany('INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                (key, position, company, year, table_name, row_year, row_name,
+                    row_value_to_number(text_value), unit, text_value, page)
+                for position, (table_name, row_year, row_name, text_value, unit, page) in enumerate(rows)])
+
+    def delete(self, keys):
+        with self.conn:
+            for key in keys:
+                self.conn.execute('DELETE FROM rows WHERE report_key = ?', (key,))
+                self.conn.execute('DELETE FROM reports WHERE report_key = ?', (key,))
+
+    def keys(self):
+        return [key for key, in self.conn.execute('SELECT report_key FROM reports')]
+
+    def get_signatures(self):
+        return dict(self.conn.execute('SELECT report_key, signature FROM reports').fetchall())
+
+    def get_report_rows(self, key, signature):
+        '''
+            [(table name, row year, row name, text value)] of one report in parser
+            order, None if the report was never built or its signature differs
+        '''
+        row = self.conn.execute('SELECT signature FROM reports WHERE report_key = ?', (key,)).fetchone()
+        if row is None or row[0] != signature:
+            return None
+        return self.conn.execute('''SELECT table_name, row_year, row_name, text_value FROM rows
+            WHERE report_key = ? ORDER BY position''', (key,)).fetchall()
+
+
+_stores = {}
+
+
+def get_row_store(path=None):
+    '''
+        the shared RowStore of path, cfg.ROW_STORE under cfg.DATA_PATH by default
+    '''
+    path = path or os.path.join(cfg.DATA_PATH, cfg.ROW_STORE)
+    if path not in _stores:
+        _stores[path] = RowStore(path)
+    return _stores[path]
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Benchmark the PDF extraction engines on a sample of annual reports.
+
+Usage:
+  python scripts/benchmark_extraction.py --sample 5 --output bench.json
+  python scripts/benchmark_extraction.py --engines xpdf pdf2txt --seed 1
+
+Every (engine, report) run happens in a freshly spawned child process, so the
+peak RSS reported for a run belongs to that engine alone and not to what the
+parent had loaded before forking. The peak RSS of a run adds the peak of the
+largest subprocess it waited for (pdftotext for xpdf) to the peak of the
+Python process, an upper bound of their combined footprint. Text engines process whole
+reports; table engines only process --table-pages pages spread evenly over
+each report, because camelot is far too slow to run on every page.
+
+The JSON report contains, per engine, pages/sec, peak RSS and p50/p95
+per-report latency, together with the machine and git commit it was run on,
+so results can be compared across commits and machines.
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import cfg  # noqa: E402
+
+TEXT_ENGINES = ["xpdf", "pdfplumber_text", "pdf2txt"]
+TABLE_ENGINES = ["camelot_lattice", "camelot_stream", "pdfplumber_tables"]
+ENGINES = TEXT_ENGINES + TABLE_ENGINES
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark PDF extraction engines.")
+    parser.add_argument(
+        "--pdf-dir",
+        default=os.path.join(cfg.DATA_PATH, "pdf_docs"),
+        help="Directory holding the reports (default: <DATA_PATH>/pdf_docs).",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=5,
+        help="Number of reports to benchmark, 0 for all (default: 5).",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed of the report sample (default: 0).",
+    )
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        choices=ENGINES,
+        default=ENGINES,
+        help="Engines to run (default: all).",
+    )
+    parser.add_argument(
+        "--table-pages",
+        type=int,
+        default=10,
+        help="Pages per report given to the table engines (default: 10).",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Write the JSON report here instead of stdout.",
+    )
+    return parser.parse_args()
+
+
+def list_reports(pdf_dir, sample, seed):
+    paths = sorted(p for p in glob.glob(os.path.join(pdf_dir, "*")) if os.path.isfile(p))
+    if 0 < sample < len(paths):
+        paths = sorted(random.Random(seed).sample(paths, sample))
+    return paths
+
+
+def spread_pages(page_count, num_pages):
+    if num_pages <= 0 or num_pages >= page_count:
+        return list(range(1, page_count + 1))
+    step = page_count / num_pages
+    return sorted(set(int(i * step) + 1 for i in range(num_pages)))
+
+
+def run_engine(engine, pdf_path, page_ids):
+    from pdf_util import PdfExtractor
+
+    # the table cache would turn repeated runs into json loads
+    extractor = PdfExtractor(pdf_path, table_cache=False)
+    with tempfile.TemporaryDirectory() as temp_dir, contextlib.redirect_stdout(io.StringIO()):
+        if engine == "xpdf":
+            extractor.extract_pure_content_and_save(os.path.join(temp_dir, "pure_content.txt"))
+        elif engine == "pdfplumber_text":
+            extractor.extract_pure_content_and_save(os.path.join(temp_dir, "pure_content.txt"), use_xpdf=False)
+        elif engine == "pdf2txt":
+            from pdf2txt import PDFProcessor
+
+            processor = PDFProcessor(pdf_path, stream_path=os.path.join(temp_dir, "all.txt"))
+            processor.process_pdf()
+            processor.pdf.close()
+        elif engine == "camelot_lattice":
+            extractor.extract_table_of_pages(page_ids, flavor="lattice")
+        elif engine == "camelot_stream":
+            extractor.extract_table_of_pages(page_ids, flavor="stream")
+        elif engine == "pdfplumber_tables":
+            extractor.extract_table_of_pages_pdfplumber(page_ids)
+
+
+def benchmark_task(task):
+    engine, pdf_path, page_ids = task
+    from pool_util import get_peak_rss_mb
+
+    start = time.time()
+    error = None
+    try:
+        run_engine(engine, pdf_path, page_ids)
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    return {
+        "engine": engine,
+        "report": os.path.basename(pdf_path),
+        "pages": len(page_ids),
+        "seconds": time.time() - start,
+        "peak_rss_mb": get_peak_rss_mb() + get_peak_rss_mb(children=True),
+        "subprocess_peak_rss_mb": get_peak_rss_mb(children=True),
+        "error": error,
+    }
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[idx]
+
+
+def summarize(runs):
+    ok_runs = [r for r in runs if r["error"] is None]
+    seconds = [r["seconds"] for r in ok_runs]
+    pages = sum(r["pages"] for r in ok_runs)
+    return {
+        "reports": len(runs),
+        "failed": len(runs) - len(ok_runs),
+        "pages": pages,
+        "seconds": sum(seconds),
+        "pages_per_sec": pages / sum(seconds) if sum(seconds) > 0 else None,
+        "peak_rss_mb": max([r["peak_rss_mb"] for r in ok_runs], default=None),
+        "p50_seconds": percentile(seconds, 50),
+        "p95_seconds": percentile(seconds, 95),
+    }
+
+
+def get_git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True)
+        commit = out.stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_machine():
+    return {
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def main():
+    args = parse_args()
+
+    from pdf_util import PdfExtractor
+
+    reports = list_reports(args.pdf_dir, args.sample, args.seed)
+    if len(reports) == 0:
+        print(f"No reports found under {args.pdf_dir}", file=sys.stderr)
+        return 2
+
+    tasks = []
+    for pdf_path in reports:
+        page_count = PdfExtractor(pdf_path).read_metadata()["page_count"]
+        for engine in args.engines:
+            if engine in TABLE_ENGINES:
+                page_ids = spread_pages(page_count, args.table_pages)
+            else:
+                page_ids = list(range(1, page_count + 1))
+            tasks.append((engine, pdf_path, page_ids))
+
+    runs = []
+    # one spawned child per run, a forked one would inherit the ru_maxrss of this
+    # process (camelot and pdfplumber imported, metadata read) or of a previous engine
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=1, maxtasksperchild=1) as pool:
+        for run in pool.imap(benchmark_task, tasks):
+            status = "failed, " + run["error"] if run["error"] else "{:.2f}s".format(run["seconds"])
+            print(f"{run['engine']:<18} {run['report']} {run['pages']} pages {status}", file=sys.stderr)
+            runs.append(run)
+
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": get_git_commit(),
+        "machine": get_machine(),
+        "config": {
+            "pdf_dir": args.pdf_dir,
+            "sample": args.sample,
+            "seed": args.seed,
+            "table_pages": args.table_pages,
+            "reports": [os.path.basename(p) for p in reports],
+        },
+        "engines": {engine: summarize([r for r in runs if r["engine"] == engine]) for engine in args.engines},
+        "runs": runs,
+    }
+
+    text = json.dumps(result, ensure_ascii=False, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
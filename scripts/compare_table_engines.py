@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Compare the pdfplumber and text layout table engines with camelot on statements.
+
+Usage:
+  python scripts/compare_table_engines.py --sample 20 --output engines.json
+  python scripts/compare_table_engines.py --tables cbs_info --processes 8
+
+Every engine parses the same located pages of every sampled report through
+financial_state.parse_sections. The resulting rows are turned into
+(year, row name, value) tuples the same way the QA pipeline reads them. The
+report gives the per-report time of each engine and how many camelot rows the
+other engines reproduce for every statement. A statement can be switched to a
+faster engine with cfg.SECTION_TABLE_ENGINES once its rows match.
+
+Nothing under data/pdf_docs is written; pure_content.txt must already exist.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ENGINES = ["camelot", "pdfplumber", "text"]
+BASELINE = "camelot"
+TABLES = ["cbs_info", "cis_info", "cscf_info"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare table engines on cbs/cis/cscf rows.")
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        choices=ENGINES,
+        default=ENGINES,
+        help="Engines to run, camelot is always included as the baseline (default: all).",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=20,
+        help="Number of reports from pdf_info.json, 0 for all (default: 20).",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed of the report sample (default: 0).",
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        choices=TABLES,
+        default=TABLES,
+        help="Statements to compare (default: all).",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=4,
+        help="Reports compared in parallel (default: 4).",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Write the JSON report here instead of stdout.",
+    )
+    return parser.parse_args()
+
+
+def table_rows(key, table_name, year, tables):
+    import re_util
+    from file import fs_info_to_tuple, find_table_unit
+    from financial_state import tables_to_text
+
+    lines = tables_to_text(tables).splitlines(keepends=True)
+    lines = [re_util.sep_numbers(line) for line in lines]
+    # detected here, the unit saved in the table store must not be touched
+    unit = find_table_unit(key, lines)[0]
+    return sorted(set(fs_info_to_tuple(key, table_name, year, lines, unit=unit)))
+
+
+def compare_report(task):
+    key, year, table_names, engines = task
+    from financial_state import parse_sections
+
+    result = {"key": key, "engines": {}, "tables": {}}
+    rows = {}
+    for engine in engines:
+        start = time.time()
+        error = None
+        rows[engine] = {name: [] for name in table_names}
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                section_tables = parse_sections(key, table_names, engine=engine)
+                for name in table_names:
+                    rows[engine][name] = table_rows(key, name, year, section_tables[name])
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        result["engines"][engine] = {"seconds": time.time() - start, "error": error}
+
+    for name in table_names:
+        baseline_rows = set(map(tuple, rows[BASELINE][name]))
+        result["tables"][name] = {"{}_rows".format(BASELINE): len(baseline_rows)}
+        for engine in engines:
+            if engine == BASELINE:
+                continue
+            engine_rows = set(map(tuple, rows[engine][name]))
+            result["tables"][name][engine] = {
+                "rows": len(engine_rows),
+                "matched_rows": len(baseline_rows & engine_rows),
+                "exact": baseline_rows == engine_rows,
+                "missing": sorted(baseline_rows - engine_rows)[:20],
+                "extra": sorted(engine_rows - baseline_rows)[:20],
+            }
+    return result
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[idx]
+
+
+def summarize(results, table_names, engines):
+    summary = {"engines": {}, "tables": {}}
+    for engine in engines:
+        seconds = [r["engines"][engine]["seconds"] for r in results if r["engines"][engine]["error"] is None]
+        summary["engines"][engine] = {
+            "failed": sum(1 for r in results if r["engines"][engine]["error"] is not None),
+            "seconds": sum(seconds),
+            "p50_seconds": percentile(seconds, 50),
+            "p95_seconds": percentile(seconds, 95),
+        }
+    for name in table_names:
+        items = [r["tables"][name] for r in results if r["tables"][name]["{}_rows".format(BASELINE)] > 0]
+        baseline_rows = sum(t["{}_rows".format(BASELINE)] for t in items)
+        summary["tables"][name] = {"reports": len(items)}
+        for engine in engines:
+            if engine == BASELINE:
+                continue
+            num_exact = sum(1 for t in items if t[engine]["exact"])
+            summary["tables"][name][engine] = {
+                "exact_reports": num_exact,
+                "exact_ratio": num_exact / len(items) if items else None,
+                "row_recall": sum(t[engine]["matched_rows"] for t in items) / baseline_rows if baseline_rows else None,
+            }
+    return summary
+
+
+def main():
+    args = parse_args()
+
+    from file import load_pdf_info, get_pdf_text_path
+
+    pdf_info = load_pdf_info()
+    keys = sorted(k for k in pdf_info.keys() if os.path.exists(get_pdf_text_path(k)))
+    if 0 < args.sample < len(keys):
+        keys = sorted(random.Random(args.seed).sample(keys, args.sample))
+    if len(keys) == 0:
+        print("No report with pure_content.txt found", file=sys.stderr)
+        return 2
+
+    engines = [BASELINE] + [e for e in args.engines if e != BASELINE]
+    tasks = [(key, pdf_info[key]["year"].replace("年", ""), args.tables, engines) for key in keys]
+    results = []
+    with Pool(processes=args.processes) as pool:
+        for result in pool.imap_unordered(compare_report, tasks):
+            timing = " ".join("{} {:.2f}s".format(e, result["engines"][e]["seconds"]) for e in engines)
+            print(f"{result['key']} {timing}", file=sys.stderr)
+            results.append(result)
+    results = sorted(results, key=lambda r: r["key"])
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "tables": args.tables,
+        "engines": engines,
+        "summary": summarize(results, args.tables, engines),
+        "reports": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+import io
+import os
+import json
+import hashlib
+import sqlite3
+from config import cfg
+
+TABLE_NAMES = ['basic_info', 'employee_info', 'cbs_info', 'cscf_info', 'cis_info', 'dev_info']
+# tables whose values are scaled by the unit printed above the statement
+STATEMENT_NAMES = ['cbs_info', 'cscf_info', 'cis_info']
+
+
+def text_to_lines(text):
+    '''
+        the lines f.readlines() returns for a table file holding text
+    '''
+    return io.StringIO(text, newline=None).readlines()
+
+
+def get_text_checksum(text):
+    return hashlib.md5(''.join(text_to_lines(text)).encode('utf-8')).hexdigest()
+
+
+class TableStore(object):
+    '''
+        extracted section lines of every report in one SQLite file, keyed by
+        (report key, table name); WAL lets the extraction workers write while
+        readers load one report at a time.
+        A table is only rewritten when its checksum changes, builders tell the
+        reports they have to parse again by get_report_signatures.
+        The unit of a statement is kept next to it and dropped whenever the
+        statement is rewritten without one
+    '''
+
+    def __init__(self, path=None) -> None:
+        self.path = path or os.path.join(cfg.DATA_PATH, cfg.TABLE_STORE)
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # a connection must not cross a fork, every worker opens its own
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._pid = os.getpid()
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS tables (
+                report_key TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                content TEXT NOT NULL,
+                checksum TEXT,
+                source_size INTEGER,
+                source_mtime REAL,
+                PRIMARY KEY (report_key, table_name))''')
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(tables)')]
+            if 'checksum' not in columns:
+                # stores written before checksums were tracked
+                for column in ['checksum TEXT', 'source_size INTEGER', 'source_mtime REAL']:
+                    self._conn.execute('ALTER TABLE tables ADD COLUMN {}'.format(column))
+            # the change log of older stores, nothing reads it anymore
+            self._conn.execute('DROP TABLE IF EXISTS changes')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS units (
+                report_key TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                unit INTEGER NOT NULL,
+                scale TEXT,
+                evidence TEXT,
+                page INTEGER,
+                PRIMARY KEY (report_key, table_name))''')
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def _put(self, rows):
+        '''
+            rows: [(report key, table name, text, (size, mtime) of the source file or None)],
+            returns the (report key, table name) whose content changed
+        '''
+        changed = []
+        with self.conn:
+            for key, name, text, source_stat in rows:
+                size, mtime = source_stat if source_stat is not None else (None, None)
+                checksum = get_text_checksum(text)
+                row = self.conn.execute('SELECT checksum FROM tables WHERE report_key = ? AND table_name = ?',
+                    (key, name)).fetchone()
+                if row is not None and row[0] == checksum:
+                    self.conn.execute('''UPDATE tables SET source_size = ?, source_mtime = ?
+                        WHERE report_key = ? AND table_name = ?''', (size, mtime, key, name))
+                    continue
+                self.conn.execute('INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, name, text, checksum, size, mtime))
+                self.conn.execute('DELETE FROM units WHERE report_key = ? AND table_name = ?', (key, name))
+                changed.append((key, name))
+        return changed
+
+    def put_report(self, key, texts, source_stats={}, units={}):
+        '''
+            texts: {table name: table file text} of one report,
+            units: {table name: (unit, scale, evidence line, page)} of its statements
+        '''
+        changed = self._put([(key, name, text, source_stats.get(name)) for name, text in texts.items()])
+        for name, unit in units.items():
+            self.put_unit(key, name, *unit)
+        return changed
+
+    def put_table(self, table_name, texts, source_stats={}):
+        '''
+            texts: {report key: table file text} of one table
+        '''
+        return self._put([(key, table_name, text, source_stats.get(key)) for key, text in texts.items()])
+
+    def delete(self, keys, table_name):
+        with self.conn:
+            for key in keys:
+                self.conn.execute('DELETE FROM tables WHERE report_key = ? AND table_name = ?', (key, table_name))
+                self.conn.execute('DELETE FROM units WHERE report_key = ? AND table_name = ?', (key, table_name))
+
+    def put_unit(self, key, table_name, unit, scale=None, evidence=None, page=None):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?)',
+                (key, table_name, unit, scale, evidence, page))
+
+    def get_unit(self, key, table_name):
+        '''
+            {'unit', 'scale', 'evidence', 'page'} saved with a statement, None if unknown
+        '''
+        row = self.conn.execute('''SELECT unit, scale, evidence, page FROM units
+            WHERE report_key = ? AND table_name = ?''', (key, table_name)).fetchone()
+        return None if row is None else dict(zip(['unit', 'scale', 'evidence', 'page'], row))
+
+    def keys_without_unit(self, table_name):
+        rows = self.conn.execute('''SELECT t.report_key FROM tables t LEFT JOIN units u
+            ON t.report_key = u.report_key AND t.table_name = u.table_name
+            WHERE t.table_name = ? AND u.report_key IS NULL''', (table_name,))
+        return [key for key, in rows]
+
+    def get_source_stats(self, table_name):
+        '''
+            {report key: (size, mtime)} of the table files the rows were last synced from
+        '''
+        rows = self.conn.execute('SELECT report_key, source_size, source_mtime FROM tables WHERE table_name = ?',
+            (table_name,))
+        return {key: (size, mtime) for key, size, mtime in rows if size is not None}
+
+    def keys(self, table_name):
+        rows = self.conn.execute('SELECT report_key FROM tables WHERE table_name = ?', (table_name,))
+        return [key for key, in rows]
+
+    def get(self, key, table_name):
+        '''
+            lines of one table, None if the report has no such table
+        '''
+        row = self.conn.execute('SELECT content FROM tables WHERE report_key = ? AND table_name = ?',
+            (key, table_name)).fetchone()
+        return None if row is None else text_to_lines(row[0])
+
+    def get_report(self, key):
+        '''
+            {table name: lines} of the tables stored for one report
+        '''
+        rows = self.conn.execute('SELECT table_name, content FROM tables WHERE report_key = ?', (key,))
+        return {name: text_to_lines(text) for name, text in rows}
+
+    def get_report_signatures(self, key=None):
+        '''
+            {report key: md5 of the checksums and units of its tables}, of one
+            report if key is given; it changes whenever any table of the report is
+            rewritten or its unit is saved or changed
+        '''
+        sql = '''SELECT t.report_key, t.table_name, t.checksum, u.unit FROM tables t LEFT JOIN units u
+            ON t.report_key = u.report_key AND t.table_name = u.table_name'''
+        if key is None:
+            rows = self.conn.execute(sql)
+        else:
+            rows = self.conn.execute(sql + ' WHERE t.report_key = ?', (key,))
+        checksums = {}
+        for report_key, name, checksum, unit in rows:
+            checksums.setdefault(report_key, []).append('{}:{}:{}'.format(name, checksum, unit))
+        return {k: hashlib.md5('|'.join(sorted(v)).encode('utf-8')).hexdigest() for k, v in checksums.items()}
+
+    def get_report_signature(self, key):
+        return self.get_report_signatures(key).get(key)
+
+    def is_empty(self):
+        return self.conn.execute('SELECT 1 FROM tables LIMIT 1').fetchone() is None
+
+    def import_merged_json(self, table_name, path):
+        '''
+            load a <table_name>.json written by the old merge_info,
+            {report key: {..., table_name: lines}}
+        '''
+        with open(path, 'r', encoding='utf-8') as f:
+            merged = json.load(f)
+        self.put_table(table_name, {key: ''.join(v[table_name]) for key, v in merged.items() if table_name in v})
+        return len(merged)
+
+
+_stores = {}
+
+
+def get_table_store(path=None):
+    '''
+        the shared TableStore of path, cfg.TABLE_STORE under cfg.DATA_PATH by default
+    '''
+    path = path or os.path.join(cfg.DATA_PATH, cfg.TABLE_STORE)
+    if path not in _stores:
+        _stores[path] = TableStore(path)
+    return _stores[path]
@@ -0,0 +1,40 @@
+import random
+
+from keyword_util import KeywordAutomaton, KeywordLineIndex
+
+
+def random_text(rnd, chars, max_len):
+    return ''.join(rnd.choice(chars) for _ in range(rnd.randint(0, max_len)))
+
+
+def test_automaton_matches_substring_search():
+    rnd = random.Random(0)
+    for _ in range(200):
+        keywords = list(set(random_text(rnd, 'abc', 4) for _ in range(6)) - {''})
+        automaton = KeywordAutomaton(keywords)
+        text = random_text(rnd, 'abcd', 30)
+        found = set(automaton.keywords[idx] for idx in automaton.search(text))
+        assert found == set(k for k in keywords if k in text)
+
+
+def test_automaton_reports_every_occurrence():
+    automaton = KeywordAutomaton(['资产', '资产总计', '总计'])
+    matches = [(end, automaton.keywords[idx]) for end, idx in automaton.iter_matches('资产总计资产')]
+    assert sorted(matches) == [(2, '资产'), (4, '总计'), (4, '资产总计'), (6, '资产')]
+
+
+def test_line_index_windows_match_substring_search():
+    rnd = random.Random(1)
+    for _ in range(50):
+        lines = [random_text(rnd, 'abcd', 8) for _ in range(20)]
+        index = KeywordLineIndex(lines)
+        index.add_keywords([random_text(rnd, 'abc', 3) for _ in range(3)])
+        for _ in range(20):
+            keyword = random_text(rnd, 'abc', 3)
+            start = rnd.randint(0, len(lines))
+            end = rnd.randint(start, len(lines))
+            window = lines[start:end]
+            # '' is in any text, even an empty window
+            assert index.contains(keyword, start, end) == (keyword == '' or any(keyword in line for line in window))
+            if keyword != '':
+                assert index.count(keyword, start, end) == len([line for line in window if keyword in line])
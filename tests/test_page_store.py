@@ -0,0 +1,60 @@
+import pytest
+
+from page_store import PageStore, write_page_store
+
+
+PAGES = [
+    (1, ['第一节 重要提示', 'line 2']),
+    (2, []),
+    (5, ['合并资产负债表', '单位：元', '货币资金 | 1,000.00']),
+]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'doc.pages')
+    write_page_store(path, PAGES)
+    with PageStore(path) as store:
+        assert store.page_ids == [1, 2, 5]
+        assert store.num_lines == 5
+        for page_id, lines in PAGES:
+            assert store.get_page_lines(page_id) == lines
+            assert store.get_page(page_id) == {'page': page_id, 'text': '\n'.join(lines)}
+        assert store.get_lines(0, store.num_lines) == [line for _, lines in PAGES for line in lines]
+        assert store.get_lines(1, 3) == ['line 2', '合并资产负债表']
+
+
+def test_missing_page(tmp_path):
+    path = str(tmp_path / 'doc.pages')
+    write_page_store(path, PAGES)
+    with PageStore(path) as store:
+        assert store.page_index(3) is None
+        assert store.get_page(3) is None
+        assert store.get_page_lines(3) == []
+        assert store.get_lines(4, 100) == ['货币资金 | 1,000.00']
+        assert store.get_lines(3, 3) == []
+
+
+def test_not_a_page_store(tmp_path):
+    path = tmp_path / 'doc.pages'
+    path.write_bytes(b'JUNK' + b'\0' * 32)
+    with pytest.raises(ValueError):
+        PageStore(str(path))
+
+
+@pytest.mark.parametrize('keep', [0, 10, 20, 40, -1])
+def test_truncated_store(tmp_path, keep):
+    path = tmp_path / 'doc.pages'
+    write_page_store(str(path), PAGES)
+    data = path.read_bytes()
+    path.write_bytes(data[:keep])
+    with pytest.raises(ValueError):
+        PageStore(str(path))
+
+
+def test_open_page_store_skips_truncated_store(tmp_path):
+    from file import open_page_store
+
+    path = tmp_path / 'doc.pages'
+    write_page_store(str(path), PAGES)
+    path.write_bytes(path.read_bytes()[:20])
+    assert open_page_store(str(path), str(tmp_path / 'missing.txt')) is None
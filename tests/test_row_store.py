@@ -0,0 +1,48 @@
+from row_store import RowStore, row_value_to_number
+from table_store import TableStore
+
+
+ROWS = [
+    ('cbs_info', '2021', '资产总计', '2045588428.00元', 1, 80),
+    ('cbs_info', '2020', '资产总计', '1640253950.00元', 1, 80),
+    ('employee_info', '2021', '在职员工的数量合计', '1711人', None, 48),
+    ('basic_info', '2021', '股票简称', '指南针', None, 7),
+]
+
+
+def test_row_value_to_number():
+    assert row_value_to_number('2045588428.00元') == 2045588428.0
+    assert row_value_to_number('-12.50元') == -12.5
+    assert row_value_to_number('167人') == 167
+    assert row_value_to_number('指南针') is None
+    assert row_value_to_number('') is None
+
+
+def test_rows_round_trip_in_order(tmp_path):
+    store = RowStore(str(tmp_path / 'rows.sqlite'))
+    assert store.get_report_rows('r.pdf', 'sig') is None
+    store.put_report('r.pdf', 'x', '2021', ROWS, 'sig')
+    assert store.get_report_rows('r.pdf', 'sig') == [row[:4] for row in ROWS]
+    values = store.conn.execute('SELECT value, unit, page FROM rows ORDER BY position').fetchall()
+    assert values == [(2045588428.0, 1, 80), (1640253950.0, 1, 80), (1711.0, None, 48), (None, None, 7)]
+
+    store.put_report('r.pdf', 'x', '2021', ROWS[:1], 'sig2')
+    assert store.get_report_rows('r.pdf', 'sig2') == [ROWS[0][:4]]
+    store.delete(['r.pdf'])
+    assert store.keys() == []
+
+
+def test_stale_signature(tmp_path):
+    tables = TableStore(str(tmp_path / 'tables.sqlite'))
+    rows = RowStore(str(tmp_path / 'rows.sqlite'))
+    tables.put_report('r.pdf', {'cbs_info': 'page|80\n资产总计|1.00|2.00\n'})
+    signature = tables.get_report_signature('r.pdf')
+    rows.put_report('r.pdf', 'x', '2021', ROWS[:2], signature)
+    assert rows.get_report_rows('r.pdf', tables.get_report_signature('r.pdf')) is not None
+
+    # rewriting any table of the report makes its rows stale, the same content does not
+    tables.put_report('r.pdf', {'cbs_info': 'page|80\n资产总计|1.00|2.00\n'})
+    assert tables.get_report_signature('r.pdf') == signature
+    tables.put_report('r.pdf', {'dev_info': 'page|19\n研发人员数量（人）|167|150\n'})
+    assert rows.get_report_rows('r.pdf', tables.get_report_signature('r.pdf')) is None
+    assert rows.get_signatures() == {'r.pdf': signature}
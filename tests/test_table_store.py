@@ -0,0 +1,66 @@
+from table_store import TableStore, text_to_lines, get_text_checksum
+
+
+BASIC = 'page|7\n股票简称|指南针|股票代码|300803\n'
+CBS = 'page|80\n项目|2021年12月31日|2020年12月31日\n资产总计|2,045,588,428.00|1,640,253,950.00\n'
+
+
+def open_store(tmp_path):
+    return TableStore(str(tmp_path / 'tables.sqlite'))
+
+
+def test_text_to_lines_matches_readlines(tmp_path):
+    text = 'a|1\r\nb|2\n\nc|3'
+    path = tmp_path / 'table.txt'
+    path.write_bytes(text.encode('utf-8'))
+    with open(path, 'r', encoding='utf-8') as f:
+        assert text_to_lines(text) == f.readlines()
+    assert get_text_checksum(text) == get_text_checksum(text.replace('\r\n', '\n'))
+
+
+def test_put_and_get(tmp_path):
+    store = open_store(tmp_path)
+    assert store.is_empty()
+    changed = store.put_report('r.pdf', {'basic_info': BASIC, 'cbs_info': CBS})
+    assert sorted(changed) == [('r.pdf', 'basic_info'), ('r.pdf', 'cbs_info')]
+    assert store.get('r.pdf', 'cbs_info') == text_to_lines(CBS)
+    assert store.get('r.pdf', 'dev_info') is None
+    assert store.get_report('r.pdf') == {'basic_info': text_to_lines(BASIC), 'cbs_info': text_to_lines(CBS)}
+    assert store.keys('cbs_info') == ['r.pdf']
+
+
+def test_unchanged_content_is_not_rewritten(tmp_path):
+    store = open_store(tmp_path)
+    store.put_report('r.pdf', {'cbs_info': CBS})
+    signature = store.get_report_signature('r.pdf')
+    assert store.put_report('r.pdf', {'cbs_info': CBS}, source_stats={'cbs_info': (10, 1.5)}) == []
+    assert store.get_report_signature('r.pdf') == signature
+    # the source stats are still refreshed
+    assert store.get_source_stats('cbs_info') == {'r.pdf': (10, 1.5)}
+
+
+def test_signatures_follow_rewrites_and_deletes(tmp_path):
+    store = open_store(tmp_path)
+    store.put_table('cbs_info', {'r.pdf': CBS, 'r2.pdf': CBS})
+    store.put_table('basic_info', {'r2.pdf': BASIC})
+    signatures = store.get_report_signatures()
+    changed = store.put_table('cbs_info', {'r.pdf': CBS + '负债合计|1.00|2.00\n', 'r2.pdf': CBS})
+    assert changed == [('r.pdf', 'cbs_info')]
+    store.delete(['r2.pdf', 'missing.pdf'], 'cbs_info')
+    new_signatures = store.get_report_signatures()
+    assert new_signatures['r.pdf'] != signatures['r.pdf']
+    assert new_signatures['r2.pdf'] != signatures['r2.pdf']
+    assert store.keys('cbs_info') == ['r.pdf']
+
+
+def test_units_are_part_of_the_signature(tmp_path):
+    store = open_store(tmp_path)
+    store.put_report('r.pdf', {'basic_info': BASIC, 'cbs_info': CBS})
+    assert store.keys_without_unit('cbs_info') == ['r.pdf']
+    signature = store.get_report_signature('r.pdf')
+    store.put_unit('r.pdf', 'cbs_info', 1, '元', '单位：元', 80)
+    assert store.keys_without_unit('cbs_info') == []
+    with_unit = store.get_report_signature('r.pdf')
+    assert with_unit != signature
+    store.put_unit('r.pdf', 'cbs_info', 10000, '万元', '单位：万元', 80)
+    assert store.get_report_signature('r.pdf') != with_unit
@@ -0,0 +1,54 @@
+from text_table import parse_line, parse_text_tables, split_cells, validate_text_tables
+
+
+def layout_line(name, values, note=''):
+    # pdftotext -table right aligns the value columns
+    return '{:<20}{:<8}'.format(name, note) + ''.join('{:>22}'.format(v) for v in values)
+
+
+def statement_page():
+    lines = ['合并资产负债表', '单位：元', layout_line('项目', ['2021年12月31日', '2020年12月31日'], '附注'), '流动资产：']
+    lines += [
+        layout_line('货币资金', ['1,234,567.89', '987,654.32'], '七、1'),
+        layout_line('应收账款', ['12,000.00', '-']),
+        layout_line('流动资产合计', ['1,246,567.89', '987,654.32']),
+        layout_line('非流动资产合计', ['800,000.00', '700,000.00']),
+        layout_line('资产总计', ['2,046,567.89', '1,687,654.32']),
+        '母公司资产负债表',
+        layout_line('货币资金', ['100.00', '90.00']),
+        layout_line('资产总计', ['200.00', '180.00']),
+    ]
+    return '\n'.join(lines)
+
+
+def test_split_cells_joins_numbers_broken_by_spaces():
+    assert [c for c, _ in split_cells('12 345.00  -')] == ['12345.00', '-']
+
+
+def test_parse_line():
+    assert parse_line('2021年年度报告') is None
+    assert parse_line('流动资产：') == ('流动资产：', [], [])
+    row_name, notes, values = parse_line(layout_line('货币资金', ['1,234,567.89', '987,654.32'], '七、1'))
+    assert (row_name, notes) == ('货币资金', ['七、1'])
+    assert [v for v, _ in values] == ['1,234,567.89', '987,654.32']
+
+
+def test_every_title_starts_a_table():
+    tables = parse_text_tables([(80, statement_page())])
+    assert [t.page for t in tables] == [80, 80]
+    consolidated, parent = tables
+    assert consolidated.num_value_columns == 2
+    assert consolidated.aligned_ratio == 1.0
+    assert consolidated.df.values.tolist()[1] == ['货币资金', '七、1', '1,234,567.89', '987,654.32']
+    assert consolidated.df.values.tolist()[2] == ['应收账款', '', '12,000.00', '-']
+    assert parent.df.values.tolist() == [['货币资金', '', '100.00', '90.00'], ['资产总计', '', '200.00', '180.00']]
+
+
+def test_validate_text_tables():
+    consolidated, parent = parse_text_tables([(80, statement_page())])
+    keywords = ['货币资金', '流动资产合计', '资产总计']
+    assert validate_text_tables([consolidated], keywords, 3)
+    # too few rows, missing keywords or no tables at all are left to the table engine
+    assert not validate_text_tables([parent], keywords, 2)
+    assert not validate_text_tables([consolidated], keywords + ['负债合计'], 4)
+    assert not validate_text_tables([], keywords, 1)
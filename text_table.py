@@ -0,0 +1,167 @@
+import re
+import numpy as np
+import pandas as pd
+
+import re_util
+from pdf_util import ParsedTable
+
+MONEY_RE = re.compile('^[\(（]?-?(\d{1,3}(,\d{3})+|\d+)(\.\d+)?[\)）]?$')
+PLACEHOLDERS = ['-', '--', '—', '——', '－']
+TITLE_RE = re.compile('表(（续）|\(续\))?$')
+# right edges of values closer than this (in characters) share a column
+COLUMN_TOLERANCE = 4
+
+
+class TextTable(ParsedTable):
+    '''
+        table rebuilt from the pdftotext -table layout, columns are [row name, note]
+        followed by one column per value column found on the page
+        aligned_ratio: share of values whose right edge is on one of the value columns
+    '''
+
+    def __init__(self, df, page, bbox, aligned_ratio, num_value_columns) -> None:
+        super().__init__(df, page, bbox, 'text')
+        self.aligned_ratio = aligned_ratio
+        self.num_value_columns = num_value_columns
+
+
+def is_value(cell):
+    return cell in PLACEHOLDERS or (MONEY_RE.match(cell) is not None and ('.' in cell or ',' in cell))
+
+
+def has_chinese(cell):
+    return re.search('[一-龥]', cell) is not None
+
+
+def split_cells(line):
+    '''
+        [(cell, right edge)] of a pdftotext -table line; cells are separated by
+        column gaps of 2+ spaces, numbers broken by layout spaces are joined again
+        with re_util.process_line/sep_numbers
+    '''
+    cells = []
+    for segment in re.finditer('\S+(?: \S+)*', line):
+        parts = re_util.sep_numbers(re_util.process_line(segment.group())).split('|')
+        parts = [p.strip() for p in parts if p.strip() != '']
+        # edges of parts split out of one segment are counted back from its end
+        for k, part in enumerate(parts):
+            cells.append((part, segment.end() - sum(len(p) + 1 for p in parts[k+1:])))
+
+    merged = []
+    for cell, end in cells:
+        if len(merged) > 0 and not is_value(merged[-1][0]) and re.match('^-?[\d,]+$', merged[-1][0]) \
+                and is_value(merged[-1][0] + cell):
+            merged[-1] = (merged[-1][0] + cell, end)
+        else:
+            merged.append((cell, end))
+    return merged
+
+
+def parse_line(line):
+    '''
+        (row name, notes, [(value, right edge)]) of a statement row, None for anything else
+    '''
+    if re_util.is_header_footer(line):
+        return None
+    cells = split_cells(line)
+    if len(cells) == 0 or not has_chinese(cells[0][0]):
+        return None
+    row_name = cells[0][0]
+    notes = [c for c, _ in cells[1:] if not is_value(c)]
+    values = [(c, end) for c, end in cells[1:] if is_value(c)]
+    if len(values) > 0:
+        return row_name, notes, values
+    # category rows like "流动资产：" carry no value
+    if len(cells) == 1 and re.search('[:：]$', row_name) and len(row_name) <= 20:
+        return row_name, [], []
+    return None
+
+
+def is_title(line):
+    line = line.replace(' ', '')
+    return len(line) <= 30 and TITLE_RE.search(line) is not None and not re.search('\d\.\d\d', line)
+
+
+def find_value_columns(rows):
+    '''
+        cluster the right edges of the values, a column needs values on a fifth of the rows
+    '''
+    ends = sorted([end for _, _, values in rows for _, end in values])
+    clusters = []
+    for end in ends:
+        if len(clusters) > 0 and end - clusters[-1][-1] <= COLUMN_TOLERANCE:
+            clusters[-1].append(end)
+        else:
+            clusters.append([end])
+    num_value_rows = len([r for r in rows if len(r[2]) > 0])
+    return [float(np.median(c)) for c in clusters if len(c) >= 0.2 * num_value_rows]
+
+
+def build_table(rows, page_id, bbox):
+    columns = find_value_columns(rows)
+    num_values = 0
+    num_aligned = 0
+    table_rows = []
+    for row_name, notes, values in rows:
+        row = [row_name, ''.join(notes)] + [''] * len(columns)
+        for value, end in values:
+            num_values += 1
+            if len(columns) == 0:
+                continue
+            idx = int(np.argmin([abs(end - c) for c in columns]))
+            if abs(end - columns[idx]) <= COLUMN_TOLERANCE:
+                num_aligned += 1
+            row[2+idx] = value if row[2+idx] == '' else row[2+idx] + value
+        table_rows.append(row)
+    aligned_ratio = num_aligned / num_values if num_values > 0 else 0
+    return TextTable(pd.DataFrame(table_rows), page_id, bbox, aligned_ratio, len(columns))
+
+
+def parse_text_tables(pages):
+    '''
+        pages: [(page id, page text)] of pure_content.txt written with pdftotext -table
+        every statement title starts a new table, so the consolidated and parent
+        company statements sharing a page come out as separate tables like camelot;
+        bbox only keeps the top to bottom order of the tables on a page
+    '''
+    tables = []
+    for page_id, text in pages:
+        rows = []
+        start = 0
+        lines = text.split('\n')
+        for i in range(len(lines) + 1):
+            if i == len(lines) or is_title(lines[i]):
+                if len([r for r in rows if len(r[2]) > 0]) > 0:
+                    tables.append(build_table(rows, page_id, (0, -i, 0, -start)))
+                rows = []
+                start = i
+                continue
+            row = parse_line(lines[i])
+            if row is not None:
+                rows.append(row)
+    return tables
+
+
+def validate_text_tables(tables, required_post_keywords, min_match_number, min_rows=5):
+    '''
+        parsed rows are trusted only if they look like a full statement: enough
+        known row names, a current and a prior year column, and values that sit
+        on those columns
+    '''
+    if len(tables) == 0:
+        return False
+    num_value_rows = 0
+    row_names = []
+    for table in tables:
+        if table.num_value_columns not in [2, 3] or table.aligned_ratio < 0.9:
+            return False
+        for _, row in table.df.iterrows():
+            row_names.append(row.values[0])
+            if any(v != '' for v in row.values[2:]):
+                num_value_rows += 1
+    if num_value_rows < min_rows:
+        return False
+
+    names_text = '\n'.join(row_names)
+    num_match = len([k for k in required_post_keywords if k in names_text])
+    return num_match >= min_match_number